@@ -1,24 +1,175 @@
-import pandas as pd
+import sys
+import argparse
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
-def concat_dfs(fp_list):
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from src.cli import add_metrics_args, metrics_from_args  # noqa: E402
+from common.statements import statement_month  # noqa: E402
+
+# numpy and pandas are imported where they are used, so -h returns without
+# loading them
+
+# columns written by parse/capital_one.py
+DTYPES = {
+    "date": "str",
+    "descr": "str",
+    "amount": "float64",
+    "month": "Int64"
+}
+# columns that identify a transaction when deduping overlapping statements
+KEY_COLS = ["date", "descr", "amount"]
+
+
+def _check_fp_list(fp_list):
     if isinstance(fp_list, (str, Path)):
         fp_list = [fp_list]
     elif not isinstance(fp_list, list):
         raise TypeError(f"'fp_list' must be a list of file paths, not {type(fp_list)}.")
-    out = pd.DataFrame()
-    for fp in fp_list:
-        out = pd.concat([out, pd.read_csv(fp, sep="|")], axis=0)
+    return fp_list
+
+
+def statement_order(fp_list):
+    """Parsed statements oldest first (by the MMYYYY date in their names,
+    files without one first, then by name). Concatenated in this order a
+    new statement's rows land at the end of the combined file, and the rows
+    before them are written exactly as before, so what reads the combined
+    file incrementally (the stats cube) only has to read the new rows."""
+    def key(fp):
+        return (*(statement_month(fp) or (0, 0)), Path(fp).name)
+    return sorted(_check_fp_list(fp_list), key=key)
+
+
+def read_output(fp, sep="|", chunksize=None):
+    """Read a parsed statement with explicit dtypes (an iterator of chunks if
+    chunksize is given)."""
+    import pandas as pd
+    return pd.read_csv(fp, sep=sep, dtype=DTYPES, chunksize=chunksize)
+
+
+def row_keys(df, counts=None):
+    """A 64-bit hash per row identifying the transaction and which occurrence
+    of it this is within its file, so identical transactions inside one
+    statement are kept but the same transaction in two statements is not.
+    `counts` carries the occurrence counts over between chunks of a file.
+    """
+    import numpy as np
+    import pandas as pd
+    h = pd.util.hash_pandas_object(df[KEY_COLS], index=False).to_numpy()
+    occ = pd.Series(h).groupby(h).cumcount().to_numpy(dtype=np.uint64)
+    if counts is not None:
+        occ += np.array([counts.get(x, 0) for x in h], dtype=np.uint64)
+        for x, n in zip(*np.unique(h, return_counts=True)):
+            counts[x] = counts.get(x, 0) + int(n)
+    return h ^ ((occ + np.uint64(1)) * np.uint64(0x9E3779B97F4A7C15))
+
+
+def concat_dfs(fp_list, sep="|", threads=1, dedupe=True):
+    """Read all files (in `threads` threads) and concatenate them once.
+    If dedupe, transactions repeated across files (overlapping statements)
+    are kept only once.
+    """
+    import numpy as np
+    import pandas as pd
+    fp_list = _check_fp_list(fp_list)
+    if len(fp_list) == 0:
+        return pd.DataFrame(columns=list(DTYPES))
+    with ThreadPoolExecutor(max_workers=max(threads, 1)) as ex:
+        dfs = list(ex.map(lambda fp: read_output(fp, sep=sep), fp_list))
+    keys = [row_keys(df) for df in dfs] if dedupe else None
+    out = pd.concat(dfs, axis=0, ignore_index=True)
+    if dedupe:
+        out = out.loc[~pd.Series(np.concatenate(keys)).duplicated().to_numpy()]
     return out
 
 
-if __name__=="__main__":
+def stream_concat(fp_list, output_path, sep="|", chunksize=100_000, dedupe=True,
+                  drop_na_dates=True):
+    """Concatenate files into output_path one chunk at a time, so memory is
+    bounded by chunksize rather than the full history (dedupe keeps one
+    64-bit key per distinct transaction seen).
+    Returns the number of rows written.
+    """
+    import numpy as np
+    from src.stream import chunk_writer
+    fp_list = _check_fp_list(fp_list)
+    write, close = chunk_writer(output_path, sep=sep, columns=list(DTYPES))
+    seen = set()
+    n = 0
+    try:
+        for fp in fp_list:
+            counts = {}
+            for chunk in read_output(fp, sep=sep, chunksize=chunksize):
+                if drop_na_dates:
+                    chunk = chunk.loc[~chunk.date.isna()]
+                if dedupe:
+                    keys = row_keys(chunk, counts)
+                    new = np.array([k not in seen for k in keys.tolist()], dtype=bool)
+                    seen.update(keys[new].tolist())
+                    chunk = chunk.loc[new]
+                if len(chunk) > 0:
+                    write(chunk)
+                    n += len(chunk)
+    finally:
+        close()
+    return n
 
-    # cli args
-    input_dir = "./parse/outputs/"
-    output_path = "./analysis/data/spend_01-11_2023.txt"
-    delim = "|"
 
-    out = concat_dfs(list(Path(input_dir).glob("*.txt")))
+def concat_files(fp_list, output_path, sep="|", threads=1, chunksize=None, dedupe=True):
+    """Concatenate parsed statement files into one table at output_path,
+    streaming in chunks if `chunksize` is set or the output is parquet.
+    The whole file is rewritten; pass the files in `statement_order` so a
+    new statement only adds rows at its end.
+    Returns the number of transactions saved.
+    """
+    if chunksize is not None or str(output_path).endswith(".parquet"):
+        return stream_concat(fp_list, output_path, sep=sep,
+                             chunksize=chunksize or 100_000, dedupe=dedupe)
+    out = concat_dfs(fp_list, sep=sep, threads=threads, dedupe=dedupe)
     out = out.loc[~out.date.isna()]
-    out.to_csv(output_path, sep=delim, index=False)
+    out.to_csv(output_path, sep=sep, index=False)
+    return len(out)
+
+
+parser = argparse.ArgumentParser(
+    prog="1_concat_data.py",
+    description="Combine the statements parsed by capital_one.py into one table, oldest statement first, keeping transactions repeated across overlapping statements once.",
+    epilog="Run from the repository root."
+)
+parser.add_argument("inputs",
+                    nargs="*",
+                    default=["./parse/outputs/"],
+                    help="Parsed statement files, or directories of them (*.txt). Defaults to ./parse/outputs/."
+                    )
+parser.add_argument("-o", "--output",
+                    default="./analysis/data/spend.txt",
+                    help="Where to save the combined table (.txt, or .parquet). Defaults to ./analysis/data/spend.txt."
+                    )
+parser.add_argument("-d", "--delim",
+                    default="|",
+                    help="Delimiter of the files. Defaults to the pipe `|`."
+                    )
+parser.add_argument("-t", "--threads", type=int, default=4,
+                    help="Threads reading the files. Defaults to 4.")
+parser.add_argument("--chunksize",
+                    type=int,
+                    default=None,
+                    help="Stream the files this many rows at a time instead of reading them whole."
+                    )
+parser.add_argument("--no-dedupe",
+                    action="store_true",
+                    help="Keep transactions repeated across statements."
+                    )
+add_metrics_args(parser)
+
+
+if __name__=="__main__":
+    args = parser.parse_args()
+    metrics_from_args(args)
+    fps = []
+    for p in map(Path, args.inputs):
+        fps.extend(p.glob("*.txt") if p.is_dir() else [p])
+    fps = statement_order(fps)
+    n = concat_files(fps, args.output, sep=args.delim, threads=args.threads,
+                     chunksize=args.chunksize, dedupe=not args.no_dedupe)
+    print(f"Saved {n} transactions from {len(fps)} file(s) to {args.output}")
@@ -1,88 +1,164 @@
-import os
-import openai
-import pandas as pd
+import time
+import sys
+import argparse
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from src.cli import (add_embedding_args, add_metrics_args, metrics_from_args,  # noqa: E402
+                     backend_from_args, confirm)
+from common.metrics import timer  # noqa: E402
 
-def ask_yesno(msg):
-    msg2 = f"{msg} (yes/no): "
-    i = input(msg2).strip().lower()
-    if i.startswith("y"):
-        return True
-    elif i.startswith("n"):
-        return False
-    else:
-        print("ERROR: Answer y(es) or n(o) to continue execution.")
-        ask_yesno(msg)
+# numpy, pandas and the embedding backends are imported where they are used,
+# so -h returns without loading them
 
-def calc_tokens(text, token_rate=0.0001):
-    tok = len(''.join(text)) / 4
-    return tok, tok * token_rate
 
-def print_tokens(text):
-    token_rate = 0.0001
-    tok, cost = calc_tokens(text)
-    print(f"***Embedding roughly {tok} tokens at rate of ${token_rate} per token...")
-    print(f"*** ~ ${tok * token_rate}")
-
-
-def get_embedding(text, engine="text-similarity-davinci-001", **kwargs):
-    """Embed some text using an openai model.
-    Requires that `openai.api_key = "your-api-key"` has been executed.
-    Returns the embeddings as a list.
+def embed_column(df, txt_col, backend=None, cache=None, plan=None):
+    """Embed each row of a (string) column in a pd.DataFrame.
+    Only (normalized) text not already in the embedding cache is sent to the
+    backend; the default OpenAI backend sends it in batches, several requests
+    at a time (see src.embed.EmbeddingClient).
+    Returns a float32 matrix with one row per row of df.
     """
-    # https://platform.openai.com/docs/guides/embeddings/use-cases
-    # https://platform.openai.com/docs/guides/embeddings/what-are-embeddings
-    # https://github.com/openai/openai-python/blob/main/openai/embeddings_utils.py
-    # new lines can negatively affect performance
-    text = text.replace("\n", " ")
-    emb = openai.Embedding.create(
-        input=[text], engine=engine, **kwargs
-    )
-    return emb["data"][0]["embedding"]
+    from src.embed_cache import embed_cached
+    if backend is None:
+        from src.backends import OpenAIBackend
+        backend = OpenAIBackend()
+    return embed_cached(df[txt_col].fillna("").tolist(), backend, cache, plan=plan)
 
 
-def embed_df_column(df, txt_col):
-    """Embed each row of a (string) column in a pd.DataFrame.
+def embed_df_column(df, txt_col, backend=None, cache=None, plan=None):
+    """Like `embed_column`, but adds the embeddings to df as a column of lists.
     Returns the updated df (although the provided df will be modified in-place)
     """
-    df[txt_col + "_emb"] = df[txt_col].apply(lambda x: get_embedding(text=x))
+    df[txt_col + "_emb"] = embed_column(df, txt_col, backend, cache, plan).tolist()
     return df
 
-if __name__=="__main__":
+
+def embed_file(fp, out, backend, cache=None, txt_col="descr", sep="|", reuse_fp=None,
+               chunksize=None):
+    """Embed a column of the table at `fp` and save the table with its
+    embeddings to `out` (see src.emb_store.save_embeddings).
+    The table is read, embedded and written `chunksize` rows at a time, so
+    memory use doesn't grow with the size of the table.
+    If `reuse_fp` is a table saved by an earlier run with the same backend
+    (it can be `out` itself), rows whose text it already has reuse its
+    embeddings, so only new text is embedded (e.g. after a new statement).
+    `chunksize` defaults to src.stream.DEFAULT_CHUNKSIZE.
+    Returns (rows, rows embedded).
+    """
+    import numpy as np
+    from src.emb_store import has_embeddings, emb_paths
+    from src.stream import iter_table, count_rows, EmbeddingWriter, DEFAULT_CHUNKSIZE
+    from src.embed_cache import embed_cached, normalize_text
+    chunksize = chunksize or DEFAULT_CHUNKSIZE
+    prev_rows, prev_emb = {}, None
+    if reuse_fp is not None and has_embeddings(reuse_fp):
+        # normalized text -> row of the earlier embeddings (memory mapped)
+        start = 0
+        for chunk in iter_table(reuse_fp, sep=sep, chunksize=chunksize,
+                                usecols=[txt_col], dtype=str):
+            for i, t in enumerate(chunk[txt_col].fillna(""), start=start):
+                prev_rows.setdefault(normalize_text(t), i)
+            start += len(chunk)
+        prev_emb = np.load(emb_paths(reuse_fp)[1], mmap_mode="r")
+    n_rows, n_new = count_rows(fp, sep=sep, chunksize=chunksize), 0
+    with EmbeddingWriter(out, n_rows, sep=sep) as writer:
+        for dat in iter_table(fp, sep=sep, chunksize=chunksize, dtype=str):
+            texts = dat[txt_col].fillna("").tolist()
+            todo = np.arange(len(dat))
+            if prev_emb is None:
+                emb = embed_cached(texts, backend, cache)
+            else:
+                rows = np.array([prev_rows.get(normalize_text(t), -1) for t in texts], dtype=np.int64)
+                hit = rows >= 0
+                emb = np.zeros((len(dat), prev_emb.shape[1]), dtype=np.float32)
+                emb[hit] = prev_emb[rows[hit]]
+                todo = np.flatnonzero(~hit)
+                if len(todo):
+                    emb[todo] = embed_cached([texts[i] for i in todo], backend, cache)
+            writer.write(dat, emb)
+            n_new += len(todo)
+    return n_rows, n_new
 
 
-    # cli args
-    fp = "./analysis/data/labeled_spend_01-08_2023.txt"
-    delim = "|"
-    txt_col = "descr"
-    out_dir = "./analysis/data"
+parser = argparse.ArgumentParser(
+    prog="2_embed_data.py",
+    description="Embed a text column of a delimited table, saving the table and a row aligned float32 .npy of embeddings.",
+    epilog="Run from the repository root. Pass --yes or --max-cost to run unattended (e.g. from cron)."
+)
+parser.add_argument("input",
+                    help="The delimited table to embed, e.g. the output of 1_concat_data.py."
+                    )
+parser.add_argument("-o", "--output",
+                    default=None,
+                    help="Where to save the table with embeddings. Defaults to <out-dir>/<input name>_w_emb.txt."
+                    )
+parser.add_argument("--out-dir",
+                    default="./analysis/data",
+                    help="Output directory when -o isn't given. Defaults to ./analysis/data."
+                    )
+parser.add_argument("-d", "--delim",
+                    default="|",
+                    help="Delimiter of the table. Defaults to the pipe `|`."
+                    )
+parser.add_argument("-c", "--txt-col",
+                    default="descr",
+                    help="The column to embed. Defaults to 'descr'."
+                    )
+parser.add_argument("--chunksize",
+                    type=int,
+                    default=None,
+                    help="Rows read, embedded and written at a time. Defaults to 100,000."
+                    )
+add_embedding_args(parser)
+add_metrics_args(parser)
 
-    # set openai key
-    apikey = os.environ.get("OPENAI")
-    if apikey is None:
-        raise RuntimeError("Required environmental variable 'OPENAI' is not set.")
-    openai.api_key = os.environ["OPENAI"]
 
-    # Load data
-    dat = pd.read_csv(fp, sep=delim, dtype=str)
-    dat["txt_processed"] = dat[txt_col].str.strip().str.lower()
+if __name__=="__main__":
+    args = parser.parse_args()
+    metrics_from_args(args)
+    import pandas as pd
+    from src.backends import OpenAIBackend, HashingBackend
+    from src.embed_cache import plan_embeddings, cache_report, print_cache_report
+    backend, cache = backend_from_args(args)
+    token_rate = args.token_rate if isinstance(backend, OpenAIBackend) else 0.0
+
+    # Load the text (only, the table is streamed when embedding)
+    col = pd.read_csv(args.input, sep=args.delim, usecols=[args.txt_col], dtype=str)[args.txt_col]
+    texts = col.fillna("").tolist()
+    if isinstance(backend, HashingBackend) and backend.idf is None:
+        # fit (and save) the IDF weights on the first data embedded, later
+        # data and the labels reuse them so embeddings stay comparable
+        backend.fit_idf(texts, save_fp=args.idf)
 
     # print info
     print("***TEXT TO EMBED (first 5 rows)")
-    print(dat["txt_processed"].head(5))
+    print(col.head(5).str.strip().str.lower())
     print("***")
-    print_tokens(text=''.join(dat[txt_col]))
+    print(f"***Embedding backend: {backend.name}")
+    plan = plan_embeddings(texts, cache, backend.name)
+    report = cache_report(plan[0], plan[2], token_rate)
+    print_cache_report(report)
     print("***")
 
     # embed
-    if ask_yesno(f"Embed text from column: '{txt_col}' ?"):
-        print("***Embedding...")
-        dat = embed_df_column(dat, txt_col)
-        # save
-        base = Path(fp).name.split(".")[0]
-        out = Path(out_dir) / f"{base}_w_emb.csv"
-        dat.to_csv(
-            out, sep=delim, index=False 
-        )
-        print(f"***Saved to {out}")
+    if not confirm(f"Embed text from column: '{args.txt_col}' ?", report["cost"],
+                   yes=args.yes, max_cost=args.max_cost):
+        raise SystemExit(1)
+    print("***Embedding...")
+    out = args.output
+    if out is None:
+        out = Path(args.out_dir) / f"{Path(args.input).name.split('.')[0]}_w_emb.txt"
+    t0 = time.perf_counter()
+    with timer("embed.file"):
+        n, _ = embed_file(args.input, out, backend, cache, txt_col=args.txt_col,
+                          sep=args.delim, chunksize=args.chunksize)
+    secs = time.perf_counter() - t0
+    print(f"***Embedded {n} rows ({report['new']} new) in {secs:.2f}s"
+          f" ({n / max(secs, 1e-9):.0f} rows/s)")
+    if isinstance(backend, OpenAIBackend):
+        client = backend.client
+        print(f"***{client.n_requests} requests, {client.n_retries} retries, {client.n_tokens} tokens")
+    # the table, and the embeddings next to it as a float32 .npy
+    out = Path(out)
+    print(f"***Saved to {out} (embeddings in {out.with_suffix('.emb.npy').name})")
@@ -1,9 +1,15 @@
-import os
-import openai
 import pickle
+import sys
+import argparse
 from pathlib import Path
 from datetime import datetime
-import json
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from src.cli import (add_embedding_args, add_metrics_args, metrics_from_args,  # noqa: E402
+                     backend_from_args, confirm)
+
+# numpy and the embedding backends are imported where they are used, so -h
+# returns without loading them
 
 stop_words = ["i", "me", "my", "myself", "we", "our", "ours", "ourselves",
               "you", "your", "yours", "yourself", "yourselves", "he", "him",
@@ -23,105 +29,97 @@ stop_words = ["i", "me", "my", "myself", "we", "our", "ours", "ourselves",
 # using just the class name, or the class name + my own made up description, does
 # much better than class name + long list of keywords (which completely fails)
 # - figure out something in between
-def ask_yesno(msg):
-    msg2 = f"{msg} (yes/no): "
-    i = input(msg2).strip().lower()
-    if i.startswith("y"):
-        return True
-    elif i.startswith("n"):
-        return False
-    else:
-        print("ERROR: Answer y(es) or n(o) to continue execution.")
-        ask_yesno(msg)
-
-def calc_tokens(text, token_rate=0.0001):
-    tok = len(''.join(text)) / 4
-    return tok, tok * token_rate
-
-def print_tokens(text):
-    token_rate = 0.0001
-    tok, cost = calc_tokens(text)
-    print(f"***Embedding roughly {tok} tokens at rate of ${token_rate} per token...")
-    print(f"*** ~ ${tok * token_rate}")
-
-def load_labels(fp):
-    with open(fp, "r") as f:
-        l = json.load(f)
-    return l
-
-def get_embedding(text, engine="text-similarity-davinci-001", **kwargs):
-    """Embed some text using an openai model.
-    Requires that `openai.api_key = "your-api-key"` has been executed.
-    Returns the embeddings as a list.
-    """
-    # https://platform.openai.com/docs/guides/embeddings/use-cases
-    # https://platform.openai.com/docs/guides/embeddings/what-are-embeddings
-    # https://github.com/openai/openai-python/blob/main/openai/embeddings_utils.py
-    # new lines can negatively affect performance
-    text = text.replace("\n", " ")
-    emb = openai.Embedding.create(
-        input=[text], engine=engine, **kwargs
-    )
-    return emb["data"][0]["embedding"]
-
-def _concat_kws(labels, concat_kws):
-    return [k + ": " + concat_kws.join(v) for k, v in labels.items()]
-
-def embed_labels(labels, save_fp, include_keywords=True, concat_keywords=", "):
+def embed_labels(labels, save_fp, include_keywords=True, concat_keywords=", ",
+                 backend=None, cache=None):
     """Embed the class labels.
     labels - a dict of {class-name: optional description}s
     concat_descr - if True, include the description in the prompt sent to openai
     save_fp - if provided, save pickled embeddings here
+    backend - the src.backends embedding backend, defaults to OpenAI (all labels in one request)
+    cache - an optional src.embed_cache.EmbeddingCache, labels embedded before are reused
 
     Returns a dict of {class-name: embeddings}
     """
-    if include_keywords:
-        labs = _concat_kws(labels, concat_kws=concat_keywords)
-    else:
-        labs = list(labels.keys())
-    # get embeddings from openai
-    lab_embs = {k: get_embedding(lab) for k, lab in zip(labels.keys(), labs)}
+    from src.classify import label_prompts
+    from src.embed_cache import embed_cached
+    labs = label_prompts(labels, include_keywords, concat_keywords)
+    # get embeddings
+    if backend is None:
+        from src.backends import OpenAIBackend
+        backend = OpenAIBackend()
+    embs = embed_cached(labs, backend, cache)
+    lab_embs = {k: emb.tolist() for k, emb in zip(labels.keys(), embs)}
     # pickle embeddings
     with open(save_fp, "wb") as f:
         pickle.dump(lab_embs, f)
     return lab_embs
 
 
-if __name__=="__main__":
-
-    # cli args
-    labels_fp = "analysis/data/labels/labels_nl_descr_simple.json"
-    out_dir = "analysis/data"
-    suffix = "date"
-    concat_keywords = ", "
-    uniq_keywords = False
+parser = argparse.ArgumentParser(
+    prog="3_embed_labels.py",
+    description="Embed class labels (a json of {label: [keywords]}), with and without their keywords, and pickle them.",
+    epilog="Run from the repository root. Pass --yes or --max-cost to run unattended."
+)
+parser.add_argument("labels",
+                    nargs="?",
+                    default="analysis/data/labels/labels_nl_descr_simple.json",
+                    help="The labels json. Defaults to analysis/data/labels/labels_nl_descr_simple.json."
+                    )
+parser.add_argument("--out-dir",
+                    default="analysis/data",
+                    help="Where to save the pickled embeddings. Defaults to analysis/data."
+                    )
+parser.add_argument("--suffix",
+                    default="date",
+                    help="Suffix for the output names, 'date' for today's date. Defaults to 'date'."
+                    )
+parser.add_argument("--concat-keywords",
+                    default=", ",
+                    help="Separator between keywords in the prompt. Defaults to ', '."
+                    )
+parser.add_argument("--uniq-keywords",
+                    action="store_true",
+                    help="Only keep the unique, non stop word words of each keyword list."
+                    )
+parser.add_argument("--only",
+                    choices=["keywords", "names"],
+                    default=None,
+                    help="Only embed the labels with keywords, or only the names. Defaults to both."
+                    )
+add_embedding_args(parser)
+add_metrics_args(parser)
 
 
-    # set openai key
-    apikey = os.environ.get("OPENAI")
-    if apikey is None:
-        raise RuntimeError("Required environmental variable 'OPENAI' is not set.")
-    openai.api_key = os.environ["OPENAI"]
+if __name__=="__main__":
+    args = parser.parse_args()
+    metrics_from_args(args)
+    from src.backends import OpenAIBackend
+    from src.classify import load_labels, label_prompts
+    from src.embed_cache import plan_embeddings, cache_report, print_cache_report
+    backend, cache = backend_from_args(args)
+    token_rate = args.token_rate if isinstance(backend, OpenAIBackend) else 0.0
+    concat_keywords = args.concat_keywords
 
     # args
-    base = str(Path(labels_fp).name).replace(".json", "")
+    base = str(Path(args.labels).name).replace(".json", "")
+    suffix = args.suffix
     if suffix == "date":
         suffix = datetime.today().strftime('%Y-%m-%d')
     if suffix:
         suffix = "_" + suffix
-    out_kw = Path(out_dir) / f"{base}{suffix}.pkl"
-    out_smpl = Path(out_dir) / f"labs_only{suffix}.pkl"
+    out_kw = Path(args.out_dir) / f"{base}{suffix}.pkl"
+    out_smpl = Path(args.out_dir) / f"labs_only{suffix}.pkl"
 
     # load labels
-    labels = load_labels(labels_fp)
-    if uniq_keywords:
+    labels = load_labels(args.labels)
+    if args.uniq_keywords:
         # just keep unique words from each keyword list
         labels = {k : set(" ".join(v).split(" ")) for k, v in labels.items()}
         labels = {k : sorted([v for v in vals if v not in stop_words]) 
                       for k, vals in labels.items()}
     
     # print info
-    labs_w_kws = _concat_kws(labels, concat_keywords)
+    labs_w_kws = label_prompts(labels, True, concat_keywords)
     print("\n***TEXT TO EMBED")
     print("***")
     for i, l in enumerate(labels.keys()):
@@ -130,20 +128,26 @@ if __name__=="__main__":
         print(f"   {labs_w_kws[i]}")
         print("***")
 
-    print_tokens(text=" ".join(labs_w_kws))
-
+    jobs = []
+    if args.only != "names":
+        jobs.append(("WITH", True, out_kw))
+    if args.only != "keywords":
+        jobs.append(("WITHOUT", False, out_smpl))
+    total_cost = 0.0
+    for name, include_keywords, _ in jobs:
+        labs = label_prompts(labels, include_keywords, concat_keywords)
+        keys, _, missing = plan_embeddings(labs, cache, backend.name)
+        report = cache_report(keys, missing, token_rate)
+        total_cost += report["cost"]
+        print(f"***{name} KEYWORDS")
+        print_cache_report(report)
 
     # EMBED LABELS
-    if ask_yesno("Embed labels with keywords?"):
-        # inlude keywords
-        print("***Embedding...")
-        embed_labels(labels, save_fp=out_kw,
-                     include_keywords=True, concat_keywords=concat_keywords)
-        print(f"***Saved {out_kw}")
+    if not confirm("Embed labels?", total_cost, yes=args.yes, max_cost=args.max_cost):
+        raise SystemExit(1)
+    for name, include_keywords, out in jobs:
+        print(f"***Embedding labels {name.lower()} keywords...")
+        embed_labels(labels, save_fp=out, include_keywords=include_keywords,
+                     concat_keywords=concat_keywords, backend=backend, cache=cache)
+        print(f"***Saved {out}")
         print("***")
-
-    if ask_yesno("Embed labels without keywords?"):
-        # class names only
-        print("***Embedding...")
-        embed_labels(labels, save_fp=out_smpl, include_keywords=False)
-        print(f"Saved {out_smpl}")
\ No newline at end of file
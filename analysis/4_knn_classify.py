@@ -0,0 +1,154 @@
+import time
+import sys
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from src.cli import add_metrics_args, metrics_from_args  # noqa: E402
+
+# label transactions by a vote of their nearest hand labeled transactions
+# (numpy and pandas are imported where they are used, so -h returns without
+# loading them)
+
+
+def update_index(index_fp, labeled_fp, lab_col="label", delim="|", rebuild=False):
+    """Load the index at index_fp (or start a new one, also if `rebuild`) and
+    bring it up to date with the hand labels: rows are keyed on their txn_id
+    (src.txn_store.table_txn_ids), so labeled rows not in it yet are added,
+    rows whose label was changed are relabeled and rows that are gone or no
+    longer labeled are removed. The labeled file needs embeddings from
+    2_embed_data.py.
+    Returns (index, number of rows added, relabeled or removed).
+    """
+    import numpy as np
+    from src.ann import IVFIndex
+    from src.stream import iter_batches
+    from src.txn_store import table_txn_ids
+    index = IVFIndex.load(index_fp) if Path(index_fp).exists() and not rebuild else None
+    n_changed = 0
+    labeled_ids = []
+    for lab, lab_emb in iter_batches(labeled_fp, sep=delim):
+        if index is None:
+            index = IVFIndex(dim=lab_emb.shape[1])
+        labeled = lab[lab_col].notna().to_numpy()
+        ids = table_txn_ids(lab)[labeled]
+        labels = lab[lab_col].to_numpy(dtype=object)[labeled]
+        labeled_ids.append(ids)
+        n_changed += index.relabel(ids, labels)
+        new = ~np.isin(ids, index.ids)
+        if new.any():
+            index.add(lab_emb[labeled][new], labels[new], ids=ids[new])
+            n_changed += int(new.sum())
+    if index is not None:
+        gone = index.ids[~np.isin(index.ids, np.concatenate(labeled_ids))]
+        index.remove(gone)
+        n_changed += len(gone)
+    if n_changed or rebuild:
+        index.save(index_fp)
+    return index, n_changed
+
+
+def knn_file(index, data_fp, out, k=10, n_probe=None, weighted=True, delim="|",
+             chunksize=None):
+    """Label each row of a table with embeddings by a vote of its nearest
+    neighbors in `index`, and save it to `out`, `chunksize` rows at a time
+    (default src.stream.DEFAULT_CHUNKSIZE).
+    Returns the number of rows.
+    """
+    from src.stream import iter_batches, chunk_writer, DEFAULT_CHUNKSIZE
+    chunksize = chunksize or DEFAULT_CHUNKSIZE
+    write, close = chunk_writer(out, sep=delim)
+    n = 0
+    try:
+        for dat, emb in iter_batches(data_fp, sep=delim, chunksize=chunksize):
+            dat["label"], dat["knn_score"] = index.knn_label(emb, k=k, weighted=weighted,
+                                                             n_probe=n_probe)
+            write(dat)
+            n += len(dat)
+    finally:
+        close()
+    return n
+
+
+parser = argparse.ArgumentParser(
+    prog="4_knn_classify.py",
+    description="Label transactions by a vote of their nearest hand labeled transactions, from an index updated with the hand labels added or changed since the last run.",
+    epilog="Run from the repository root. Both tables need embeddings from 2_embed_data.py."
+)
+parser.add_argument("input",
+                    help="Transactions to label, with embeddings."
+                    )
+parser.add_argument("-o", "--output",
+                    default=None,
+                    help="Where to save the labeled table. Defaults to <out-dir>/<input name>_knn.csv."
+                    )
+parser.add_argument("--out-dir",
+                    default="./analysis/data",
+                    help="Output directory when -o isn't given. Defaults to ./analysis/data."
+                    )
+parser.add_argument("--labeled",
+                    default="analysis/data/hand_labeled_spend_w_emb.txt",
+                    help="Hand labeled transactions with embeddings. Defaults to analysis/data/hand_labeled_spend_w_emb.txt."
+                    )
+parser.add_argument("--index",
+                    default="analysis/data/knn_index.npz",
+                    help="Where the nearest neighbor index is kept. Defaults to analysis/data/knn_index.npz."
+                    )
+parser.add_argument("--lab-col",
+                    default="label",
+                    help="Label column of the hand labeled table. Defaults to 'label'."
+                    )
+parser.add_argument("-d", "--delim",
+                    default="|",
+                    help="Delimiter of the tables. Defaults to the pipe `|`."
+                    )
+parser.add_argument("--rebuild",
+                    action="store_true",
+                    help="Build the index from scratch instead of updating it."
+                    )
+parser.add_argument("-k", type=int, default=10,
+                    help="Neighbors voting on each label. Defaults to 10.")
+parser.add_argument("--n-probe", type=int, default=16,
+                    help="Index lists scanned per query, higher is slower but closer to brute force. Defaults to 16.")
+parser.add_argument("--unweighted",
+                    action="store_true",
+                    help="Count every neighbor's vote the same instead of by similarity."
+                    )
+parser.add_argument("--recall-sample", type=int, default=200,
+                    help="Check recall against brute force on this many rows (0 to skip). Defaults to 200.")
+add_metrics_args(parser)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    metrics_from_args(args)
+    import numpy as np
+    from src.stream import iter_batches
+
+    out = args.output
+    if out is None:
+        out = Path(args.out_dir) / f"{Path(args.input).name.split('.')[0]}_knn.csv"
+
+    index, n_changed = update_index(args.index, args.labeled, lab_col=args.lab_col,
+                                    delim=args.delim, rebuild=args.rebuild)
+    print(f"index has {len(index)} labeled transactions ({n_changed} added, relabeled or removed)"
+          f" in {index.n_lists} lists")
+
+    print("labeling by nearest labeled neighbors...")
+    t0 = time.perf_counter()
+    n = knn_file(index, args.input, out, k=args.k, n_probe=args.n_probe,
+                 weighted=not args.unweighted, delim=args.delim)
+    secs = time.perf_counter() - t0
+    print(f"{n} rows in {secs:.2f}s ({1000 * secs / max(n, 1):.3f}ms per row)")
+
+    if args.recall_sample and n:
+        # read through iter_batches, as the rows were, so tables with
+        # stringified embeddings can be sampled too
+        sample = np.sort(np.random.default_rng(0).choice(n, min(args.recall_sample, n), replace=False))
+        emb, start = [], 0
+        for _, batch in iter_batches(args.input, sep=args.delim):
+            rows = sample[(sample >= start) & (sample < start + len(batch))] - start
+            emb.append(batch[rows])
+            start += len(batch)
+        print(f"recall@{args.k} vs brute force: {index.recall(np.concatenate(emb), k=args.k, n_probe=args.n_probe):.3f}")
+    print(f"Saved {out}")
@@ -0,0 +1,166 @@
+import math
+import time
+import sys
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from src.cli import add_metrics_args, metrics_from_args  # noqa: E402
+
+# label transactions with a linear classifier trained on the hand labeled
+# transactions, updated online as new hand labels are added
+# (numpy and pandas are imported where they are used, so -h returns without
+# loading them)
+
+
+def hand_labels(labeled_fp, lab_col="label", delim="|", chunksize=None):
+    """(sorted txn_ids, labels) of the labeled rows of a hand labeled table,
+    read without its embeddings."""
+    import numpy as np
+    from src.stream import iter_table, DEFAULT_CHUNKSIZE
+    from src.txn_store import table_txn_ids, last_by_id
+    ids, labels = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=object)]
+    cols = {"txn_id", "date", "descr", "amount", lab_col}
+    for lab in iter_table(labeled_fp, sep=delim, chunksize=chunksize or DEFAULT_CHUNKSIZE,
+                          usecols=lambda c: c in cols, dtype={lab_col: str}):
+        labeled = lab[lab_col].notna().to_numpy()
+        ids.append(table_txn_ids(lab)[labeled])
+        labels.append(lab[lab_col].to_numpy(dtype=object)[labeled])
+    return last_by_id(np.concatenate(ids), np.concatenate(labels))
+
+
+def is_stale(clf, ids, labels):
+    """Whether a model learned labels that have since been changed or
+    removed from the hand labels (sorted `ids` and their `labels`)."""
+    from src.txn_store import lookup
+    now, found = lookup(ids, labels, clf.ids)
+    return bool(len(clf.ids)) and not (found.all() and (now == clf.id_labels).all())
+
+
+def update_model(model_fp, labeled_fp, lab_col="label", delim="|", epochs=5,
+                 chunksize=None, rebuild=False):
+    """Load the model at model_fp (or start a new one, also if `rebuild`)
+    and train it on the labeled rows it hasn't seen yet, a batch at a time.
+    Rows are keyed on their txn_id (src.txn_store.table_txn_ids); if a label
+    the model learned was changed or removed since, it is trained again from
+    scratch, as it can't unlearn it. The labeled file needs embeddings from
+    2_embed_data.py.
+    Each batch is predicted before it is trained on, so the accuracy
+    returned is on rows the model hadn't seen (nan if it had no labels yet).
+    Returns (model, number of new rows, accuracy, whether it was retrained).
+    """
+    import numpy as np
+    from src.linear import SoftmaxClassifier
+    from src.stream import iter_batches, DEFAULT_CHUNKSIZE
+    from src.txn_store import table_txn_ids
+    chunksize = chunksize or DEFAULT_CHUNKSIZE
+    clf = SoftmaxClassifier.load(model_fp) if Path(model_fp).exists() and not rebuild else None
+    retrained = clf is not None and is_stale(clf, *hand_labels(labeled_fp, lab_col, delim, chunksize))
+    if retrained:
+        clf = None
+    n_new = n_checked = n_correct = 0
+    for lab, lab_emb in iter_batches(labeled_fp, sep=delim, chunksize=chunksize):
+        if clf is None:
+            clf = SoftmaxClassifier(dim=lab_emb.shape[1])
+        ids = table_txn_ids(lab)
+        new = ~np.isin(ids, clf.ids) & lab[lab_col].notna().to_numpy()
+        if not new.any():
+            continue
+        y = lab.loc[new, lab_col].to_numpy(dtype=object)
+        if len(clf):
+            pred, _ = clf.predict(lab_emb[new])
+            n_correct += int((pred == y).sum())
+            n_checked += len(y)
+        clf.partial_fit(lab_emb[new], y, ids=ids[new], epochs=epochs)
+        n_new += int(new.sum())
+    if n_new or retrained or rebuild:
+        clf.save(model_fp)
+    return clf, n_new, (n_correct / n_checked if n_checked else float("nan")), retrained
+
+
+def predict_file(clf, data_fp, out, delim="|", chunksize=None):
+    """Label each row of a table with embeddings with the classifier, and
+    save it to `out`, `chunksize` rows at a time (default
+    src.stream.DEFAULT_CHUNKSIZE). Returns the number of rows.
+    """
+    from src.stream import iter_batches, chunk_writer, DEFAULT_CHUNKSIZE
+    chunksize = chunksize or DEFAULT_CHUNKSIZE
+    write, close = chunk_writer(out, sep=delim)
+    n = 0
+    try:
+        for dat, emb in iter_batches(data_fp, sep=delim, chunksize=chunksize):
+            dat["label"], dat["linear_score"] = clf.predict(emb)
+            write(dat)
+            n += len(dat)
+    finally:
+        close()
+    return n
+
+
+parser = argparse.ArgumentParser(
+    prog="4_linear_classify.py",
+    description="Label transactions with a linear classifier, first trained on the hand labeled transactions it hasn't seen yet.",
+    epilog="Run from the repository root. Both tables need embeddings from 2_embed_data.py."
+)
+parser.add_argument("input",
+                    help="Transactions to label, with embeddings."
+                    )
+parser.add_argument("-o", "--output",
+                    default=None,
+                    help="Where to save the labeled table. Defaults to <out-dir>/<input name>_linear.csv."
+                    )
+parser.add_argument("--out-dir",
+                    default="./analysis/data",
+                    help="Output directory when -o isn't given. Defaults to ./analysis/data."
+                    )
+parser.add_argument("--labeled",
+                    default="analysis/data/hand_labeled_spend_w_emb.txt",
+                    help="Hand labeled transactions with embeddings. Defaults to analysis/data/hand_labeled_spend_w_emb.txt."
+                    )
+parser.add_argument("--model",
+                    default="analysis/data/linear_model.npz",
+                    help="Where the model is kept. Defaults to analysis/data/linear_model.npz."
+                    )
+parser.add_argument("--lab-col",
+                    default="label",
+                    help="Label column of the hand labeled table. Defaults to 'label'."
+                    )
+parser.add_argument("-d", "--delim",
+                    default="|",
+                    help="Delimiter of the tables. Defaults to the pipe `|`."
+                    )
+parser.add_argument("--rebuild",
+                    action="store_true",
+                    help="Train the model from scratch instead of updating it."
+                    )
+parser.add_argument("--epochs", type=int, default=5,
+                    help="Passes over each new batch of hand labels. Defaults to 5.")
+add_metrics_args(parser)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    metrics_from_args(args)
+
+    out = args.output
+    if out is None:
+        out = Path(args.out_dir) / f"{Path(args.input).name.split('.')[0]}_linear.csv"
+
+    t0 = time.perf_counter()
+    clf, n_new, acc, retrained = update_model(args.model, args.labeled, lab_col=args.lab_col,
+                                              delim=args.delim, epochs=args.epochs,
+                                              rebuild=args.rebuild)
+    secs = time.perf_counter() - t0
+    if retrained:
+        print("hand labels the model had learned were changed or removed, trained it again")
+    print(f"model has {len(clf)} labels from {clf.n_seen} labeled transactions"
+          f" ({n_new} new, trained in {secs:.2f}s)")
+    if not math.isnan(acc):
+        print(f"accuracy on the new labels before training on them: {acc:.3f}")
+
+    print("labeling with the linear classifier...")
+    t0 = time.perf_counter()
+    n = predict_file(clf, args.input, out, delim=args.delim)
+    secs = time.perf_counter() - t0
+    print(f"{n} rows in {secs:.2f}s ({n / max(secs, 1e-9):.0f} rows/s)")
+    print(f"Saved {out}")
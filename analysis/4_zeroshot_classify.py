@@ -1,50 +1,26 @@
-import numpy as np
-import pandas as pd
+import sys
+import argparse
 from pathlib import Path
-import pickle
 
-def cosine_similarity(a, b):
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-
-def calc_tokens(text, token_rate=0.0001):
-    tok = len(''.join(text)) / 4
-    print(f"Embedding roughly {tok} tokens at rate of ${token_rate} per token...")
-    print(f" ~ ${tok * token_rate}")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from src.cli import add_embedding_args, add_metrics_args, metrics_from_args, backend_from_args  # noqa: E402
 
-def str2float_list(str_list):
-    return [float(e) for e in str_list.strip("[]").split(",")]
-
-def load_class_embeddings(filepaths, agg_mthd="mean"):
-    """If multiple filepaths, label embeddings from the different files
-    are combined using `agg_mthd`.
-    """
-    if not isinstance(filepaths, list):
-        filepaths = [filepaths]
-    if agg_mthd == "mean":
-        div = len(filepaths)
-    elif agg_mthd == "sum":
-        div = 1
-    else:
-        raise ValueError("agg_mthd: Argument must be 'sum' or 'mean'")
-    lab_embs = None
-    for fp in filepaths:
-        with open(fp, "rb") as f:
-            x = pickle.load(f)
-            if lab_embs is None:
-                lab_embs = {k : np.array(v) / div for k, v in x.items()}
-            else:
-                for k in lab_embs.keys():
-                    lab_embs[k] += np.array(x[k]) / div
-    return lab_embs
+# numpy, pandas and the embedding backends are imported where they are used,
+# so -h returns without loading them
 
+def cosine_similarity(a, b):
+    import numpy as np
+    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
 
 def cos_sim_match(txt_emb, lab_embs):
     """Compare a text embedding with all label embeddings, and classify the
     text based on the highest cosine similarity.
+    (Reference version, see src.classify.classify_batch to classify many rows.)
 
     txt_emb - a single list containing the embedding for some text
     lab_embs - a dict of {class-name: embeddings}
     """
+    import numpy as np
     labels = list(lab_embs.keys())
     sims = np.zeros(shape=(len(labels)))
     for i, lab in enumerate(labels):
@@ -53,37 +29,189 @@ def cos_sim_match(txt_emb, lab_embs):
     return labels[highest], sims[highest]
 
 
-if __name__ == "__main__":
+def label_batch(dat, labels, lab_mat, emb=None, embed=None, fast=None, top_k=3,
+                chunksize=65_536):
+    """Label a batch of transactions, adding label, cos_sim and margin
+    columns (and label_2, cos_sim_2, ... up to top_k) to `dat`.
+    With a src.fastpath.FastClassifier (`fast`), descriptions it matches
+    are labeled by it (cos_sim and margin are NaN, label_source says
+    "exact" or "rule") and only the rest are classified by embedding
+    similarity. Their embeddings are the rows of `emb`, or come from
+    `embed(texts)` for just those rows.
+    """
+    import numpy as np
+    from src.classify import classify_batch
+    n = len(dat)
+    k = min(top_k, len(labels))
+    miss = np.ones(n, dtype=bool)
+    if fast is not None:
+        fast_labels, sources = fast.classify(dat["descr"])
+        miss = sources == None # noqa: E711 (elementwise)
+    top_labels = np.full((n, k), None, dtype=object)
+    top_sims = np.full((n, k), np.nan, dtype=np.float32)
+    margin = np.full(n, np.nan, dtype=np.float32)
+    if miss.any():
+        x = emb[miss] if emb is not None else embed(dat["descr"][miss].fillna("").tolist())
+        top_labels[miss], top_sims[miss], margin[miss] = classify_batch(
+            x, labels, lab_mat, top_k=top_k, chunksize=chunksize)
+    if fast is not None:
+        top_labels[~miss, 0] = fast_labels[~miss]
+        sources[miss] = "embedding"
+        dat["label_source"] = sources
+    dat["label"], dat["cos_sim"], dat["margin"] = top_labels[:, 0], top_sims[:, 0], margin
+    for i in range(1, k):
+        dat[f"label_{i + 1}"], dat[f"cos_sim_{i + 1}"] = top_labels[:, i], top_sims[:, i]
+    return dat
 
-    # cli args
-    data_fp = "analysis/data/aug_2023_w_emb.csv"
-    emb_col = "descr_emb"
-    delim = "|"
-    labs_fp = ["analysis/data/labels_nl_descr_simple_2023-08-27.pkl",
-               "analysis/data/labels_kw_list_2023-08-27.pkl",
-               "analysis/data/labs_only_2023-08-27.pkl"]
-    out_dir = "analysis/data"
 
-    # output path
-    base = Path(data_fp).name.split(".")[0]
-    out = Path(out_dir) / f"{base}_classd.csv"
+def classify_file(data_fp, out, lab_embs, sep="|", emb_col="descr_emb",
+                  top_k=3, chunksize=65_536, fast=None):
+    """Label each row of a table with embeddings by its most similar label
+    embeddings (a dict of {class-name: embeddings}), and save it to `out`.
+    The table is processed and written `chunksize` rows at a time.
+    With `fast` (a src.fastpath.FastClassifier) known merchants are labeled
+    by lookup first, see `label_batch`.
+    Returns the number of rows.
+    """
+    from src.classify import label_matrix
+    from src.stream import iter_batches, chunk_writer
+    labels, lab_mat = label_matrix(lab_embs)
+    write, close = chunk_writer(out, sep=sep)
+    n = 0
+    try:
+        for dat, emb in iter_batches(data_fp, sep=sep, chunksize=chunksize, emb_col=emb_col):
+            write(label_batch(dat, labels, lab_mat, emb=emb, fast=fast,
+                              top_k=top_k, chunksize=chunksize))
+            n += len(dat)
+    finally:
+        close()
+    return n
 
-    # load data and prep embeddings
-    dat = pd.read_csv(data_fp, sep=delim)
-    dat[emb_col] = dat[emb_col].apply(str2float_list)
+
+def classify_table(data_fp, out, lab_embs, backend, cache=None, sep="|", txt_col="descr",
+                   top_k=3, chunksize=65_536, fast=None):
+    """Like `classify_file`, for a table without embeddings: the rows the
+    fast path doesn't label are embedded with `backend` (through the
+    embedding cache, if given) a batch at a time, so known merchants cost
+    no embedding requests at all.
+    Returns the number of rows.
+    """
+    from src.classify import label_matrix
+    from src.embed_cache import embed_cached
+    from src.stream import iter_table, chunk_writer
+    labels, lab_mat = label_matrix(lab_embs)
+    write, close = chunk_writer(out, sep=sep)
+    n = 0
+    try:
+        for dat in iter_table(data_fp, sep=sep, chunksize=chunksize):
+            if txt_col != "descr":
+                dat["descr"] = dat[txt_col]
+            write(label_batch(dat, labels, lab_mat, fast=fast, top_k=top_k, chunksize=chunksize,
+                              embed=lambda texts: embed_cached(texts, backend, cache)))
+            n += len(dat)
+    finally:
+        close()
+    return n
+
+
+parser = argparse.ArgumentParser(
+    prog="4_zeroshot_classify.py",
+    description="Label transactions by the label whose embedding is most similar to theirs, after looking up known merchants.",
+    epilog="Run from the repository root. A table without embeddings is embedded with --backend as it is labeled, only for the rows the lookup misses."
+)
+parser.add_argument("input",
+                    help="Transactions to label, with embeddings from 2_embed_data.py or without."
+                    )
+parser.add_argument("-o", "--output",
+                    default=None,
+                    help="Where to save the labeled table. Defaults to <out-dir>/<input name>_classd.csv."
+                    )
+parser.add_argument("--out-dir",
+                    default="./analysis/data",
+                    help="Output directory when -o isn't given. Defaults to ./analysis/data."
+                    )
+parser.add_argument("-d", "--delim",
+                    default="|",
+                    help="Delimiter of the table. Defaults to the pipe `|`."
+                    )
+parser.add_argument("--emb-col",
+                    default="descr_emb",
+                    help="Embedding column of tables saved as strings (older files). Defaults to 'descr_emb'."
+                    )
+parser.add_argument("--label-embs",
+                    nargs="+",
+                    default=["analysis/data/labels_nl_descr_simple_2023-08-27.pkl",
+                             "analysis/data/labels_kw_list_2023-08-27.pkl",
+                             "analysis/data/labs_only_2023-08-27.pkl"],
+                    metavar="PKL",
+                    help="Pickled label embeddings from 3_embed_labels.py, summed."
+                    )
+parser.add_argument("--labels",
+                    default=None,
+                    help="Labels json ({label: [keywords]}) to embed with --backend instead of loading --label-embs (e.g. with the hashing backend the data was embedded with)."
+                    )
+parser.add_argument("--labeled",
+                    default="analysis/data/hand_labeled_spend.txt",
+                    help="Hand labeled transactions whose descriptions are labeled by lookup (skipped if missing)."
+                    )
+parser.add_argument("--rules",
+                    default="analysis/data/labels/rules.json",
+                    help="Prefix rules json ({label: [prefixes]}) for the lookup (skipped if missing)."
+                    )
+parser.add_argument("--no-fast",
+                    action="store_true",
+                    help="Classify every row by embedding, without the lookup."
+                    )
+parser.add_argument("--top-k", type=int, default=3,
+                    help="Labels kept per transaction. Defaults to 3.")
+parser.add_argument("--chunksize", type=int, default=65_536,
+                    help="Rows read, labeled and written at a time. Defaults to 65,536.")
+add_embedding_args(parser)
+add_metrics_args(parser)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    metrics_from_args(args)
+    from src.classify import load_class_embeddings, load_labels, embed_label_dict
+    from src.emb_store import has_embeddings
+    from src.fastpath import FastClassifier
+
+    out = args.output
+    if out is None:
+        out = Path(args.out_dir) / f"{Path(args.input).name.split('.')[0]}_classd.csv"
+    # older tables keep their embeddings as strings in --emb-col
+    embedded = has_embeddings(args.input, sep=args.delim, emb_col=args.emb_col)
+
+    # the backend is only needed to embed the labels or rows without embeddings
+    backend = cache = None
+    if args.labels is not None or not embedded:
+        backend, cache = backend_from_args(args)
 
     # load class embeddings
-    lab_embs = load_class_embeddings(labs_fp, agg_mthd="sum")
+    if args.labels is None:
+        lab_embs = load_class_embeddings(args.label_embs, agg_mthd="sum")
+    else:
+        lab_embs = embed_label_dict(load_labels(args.labels), backend, cache=cache)
+
+    fast = None
+    labeled, rules = (p if p is not None and Path(p).exists() else None
+                      for p in (args.labeled, args.rules))
+    if not args.no_fast and (labeled or rules):
+        fast = FastClassifier.from_files(labeled, rules, sep=args.delim)
+        print(f"fast path: {len(fast.exact)} known descriptions, {len(fast.rules)} rules")
 
     # MATCH TEXT EMBEDDINGS TO LABEL WITH HIGHEST COSINE SIM
     print("matching data embeddings with class embeddings...")
-    dat["label"], dat["cos_sim"] = zip(
-        *dat[emb_col].apply(lambda x: cos_sim_match(txt_emb=x, lab_embs=lab_embs))
-    )
-
-    # save
-    dat.drop(labels=emb_col, axis=1, inplace=True)
-    dat.to_csv(
-        out, sep=delim, index=False
-    )
-    print(f"Saved {out}")
\ No newline at end of file
+    if embedded:
+        classify_file(args.input, out, lab_embs, sep=args.delim, emb_col=args.emb_col,
+                      top_k=args.top_k, chunksize=args.chunksize, fast=fast)
+    else:
+        # no embeddings yet: only the rows the fast path misses are embedded
+        classify_table(args.input, out, lab_embs, backend, cache=cache, sep=args.delim,
+                       top_k=args.top_k, chunksize=args.chunksize, fast=fast)
+    if cache is not None:
+        cache.close()
+    if fast is not None:
+        print(f"fast path labeled {fast.hits} of {fast.rows} rows ({fast.hit_rate:.1%})")
+    print(f"Saved {out}")
@@ -1,39 +1,81 @@
-import pandas as pd
+import sys
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from src.cli import add_metrics_args, metrics_from_args  # noqa: E402
 
 # aggregate transactions and output stats
 # todo: send to google sheets? dashboard? boring?
 
-def agg_stats(data, group_cols, prefix=""):
-    s = data.groupby(group_cols).agg({
-        "amount" : ["sum", "mean", "std"],
-        "label" : "count"
-    })
-    s = s.reset_index()
-    cols = []
-    for col in s.columns:
-        if col[0] in group_cols and col[1] == "":
-            cols.append(col[0])
-        else:
-            cols.append(
-                prefix + " ".join(col).strip().replace(" ", "_")
-            )
-    s.columns = cols
-    return s
 
+parser = argparse.ArgumentParser(
+    prog="export_stats.py",
+    description="Spending stats by label and year/month/week, kept up to date in a SQLite cube and exported to a file or stdout.",
+    epilog="Only transactions appended to the input since the last run are read; if the file was rewritten the cube is rebuilt."
+)
+parser.add_argument("input",
+                    nargs="?",
+                    default=None,
+                    help="Labeled transactions (date, amount and label columns) to add to the cube. Leave out to just query it."
+                    )
+parser.add_argument("--cube",
+                    default="analysis/data/stats.sqlite",
+                    help="The stats cube. Defaults to analysis/data/stats.sqlite."
+                    )
+parser.add_argument("-g", "--grain",
+                    choices=["year", "month", "week"], # src.stats.GRAINS
+                    default="month",
+                    help="Period to summarize by. Defaults to month."
+                    )
+parser.add_argument("--all-labels",
+                    action="store_true",
+                    help="Summarize over all labels instead of per label."
+                    )
+parser.add_argument("-l", "--label",
+                    action="append",
+                    default=None,
+                    help="Only this label (can be repeated)."
+                    )
+parser.add_argument("--start",
+                    default=None,
+                    help="First period, e.g. 2023, 2023-01 or 2023-W01."
+                    )
+parser.add_argument("--end",
+                    default=None,
+                    help="Last period (inclusive)."
+                    )
+parser.add_argument("-o", "--output",
+                    default="-",
+                    help="File to write the stats to. Defaults to stdout."
+                    )
+parser.add_argument("-f", "--format",
+                    choices=["csv", "tsv", "json", "parquet", "txt"],
+                    default=None,
+                    help="Output format. Defaults to the output's extension, or csv."
+                    )
+parser.add_argument("-d", "--delim",
+                    default="|",
+                    help="Delimiter of the input. Defaults to the pipe `|`."
+                    )
+parser.add_argument("--rebuild",
+                    action="store_true",
+                    help="Re-read the whole input instead of only what was appended to it."
+                    )
+add_metrics_args(parser)
 
 
 if __name__=="__main__":
-    fp = "analysis/data/labeled_spend_01-08_2023_w_emb.txt"
-    d = pd.read_csv(fp, sep="|")
-    d["date"] = pd.to_datetime(d["date"])
-    d["month"] = d.date.dt.month
-    d["year"] = d.date.dt.year
-
-    stats_yr = agg_stats(d, ["label", "year"], prefix="year_")
-    stats_yr.to_clipboard(excel=True, index=False)
-    
-    stats_mnth = agg_stats(d, "month").sort_values(by="month")
-    stats_mnth.to_clipboard(excel=True, index=False)
-
-    stats_mnth_lab = agg_stats(d, ["label", "month"])
-    stats_mnth_lab.to_clipboard(excel=True, index=False)
+    args = parser.parse_args()
+    metrics_from_args(args)
+    # pandas is only loaded once the arguments are parsed
+    from src.stats import StatsCube, export
+    with StatsCube(args.cube) as cube:
+        if args.input is not None:
+            if args.rebuild:
+                cube.clear(str(Path(args.input).resolve()))
+            n = cube.update(args.input, sep=args.delim)
+            print(f"Added {n} transaction(s) to {args.cube}", file=sys.stderr)
+        stats = cube.query(args.grain, by_label=not args.all_labels, labels=args.label,
+                           start=args.start, end=args.end)
+    export(stats, args.output, args.format)
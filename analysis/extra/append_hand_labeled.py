@@ -1,23 +1,65 @@
-import pandas as pd
+import sys
+import argparse
+from pathlib import Path
 
-# append new data to the hand labeled dataset
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
 
-fullpath = "./analysis/data/spend_01-11_2023.txt"
-labeledpath = "./analysis/data/hand_labeled_spend.txt"
+# append new data to the hand labeled dataset, kept in a TransactionStore
+# (src/txn_store.py), and export it to the labeled file to label by hand:
+#  1. labels edited in the labeled file since the last run are saved to the
+#     store (on the first run, the labeled file is imported into it)
+#  2. transactions of the full dataset dated from the last stored date on
+#     are appended (rows already stored, e.g. from overlapping statements,
+#     are skipped, and only the new ones are written, as a new segment)
+#  3. the store is exported to the labeled file, which the classifiers and
+#     the pipeline read (the pipeline's labeled stage also does 1 and 3)
 
-full = pd.read_csv(fullpath, sep="|")
-full["date"] = pd.to_datetime(full.date)
+parser = argparse.ArgumentParser(
+    prog="append_hand_labeled.py",
+    description="Add the new transactions of the full dataset to the hand labeled store, saving the labels edited in the labeled file, and export the store to it.",
+    epilog="Run from the repository root, then label the new rows of the labeled file and run it (or the pipeline) again."
+)
+parser.add_argument("--full",
+                    default="./analysis/data/spend.txt",
+                    help="The full dataset from 1_concat_data.py. Defaults to ./analysis/data/spend.txt."
+                    )
+parser.add_argument("--labeled",
+                    default="./analysis/data/hand_labeled_spend.txt",
+                    help="The labeled file to export to and read label edits from. Defaults to ./analysis/data/hand_labeled_spend.txt."
+                    )
+parser.add_argument("--store",
+                    default="./analysis/data/hand_labeled_store",
+                    help="The store directory. Defaults to ./analysis/data/hand_labeled_store."
+                    )
+parser.add_argument("-d", "--delim",
+                    default="|",
+                    help="Delimiter of the files. Defaults to the pipe `|`."
+                    )
 
-labeled = pd.read_csv(labeledpath, sep="|")
-labeled["date"] = pd.to_datetime(labeled.date)
-maxdate = labeled.date.max()
 
-new = pd.concat([
-    labeled,
-    full.loc[full.date > maxdate]
-], axis=0).reset_index(drop=True)
+if __name__ == "__main__":
+    args = parser.parse_args()
+    import pandas as pd
+    from src.txn_store import TransactionStore
 
+    store = TransactionStore(args.store, sep=args.delim)
+    if Path(args.labeled).exists():
+        if len(store) == 0:
+            n = store.append(pd.read_csv(args.labeled, sep=args.delim))
+            print(f"Imported {n} labeled rows from {args.labeled}")
+        else:
+            n = store.import_labels(args.labeled)
+            print(f"Saved {n} edited label(s) from {args.labeled}")
 
-labeled.to_csv(labeledpath.replace(".txt", "_backup.txt"), sep="|", index=False)
-new.to_csv(labeledpath, sep="|", index=False)
+    # like before the store, only transactions after the labeled ones are
+    # added (from the last stored date on, the day's stored rows are skipped)
+    full = pd.read_csv(args.full, sep=args.delim)
+    last = store.max_date()
+    if last is not None:
+        full = full.loc[(full["date"].astype(str).str[:10] >= last).to_numpy()]
+    n = store.append(full)
+    print(f"Appended {n} new rows, {len(store)} in {len(store.segments)} segment(s), up to {store.max_date()}")
 
+    store.export(args.labeled)
+    print(f"Exported to {args.labeled}")
@@ -0,0 +1,27 @@
+import sys
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from src.emb_store import convert_emb_csv
+
+# convert a table with stringified embedding lists (the old output of
+# 2_embed_data.py) to a table plus a float32 .npy embedding matrix
+
+parser = argparse.ArgumentParser(
+    prog="convert_emb_csv.py",
+    description="Convert a delimited file with stringified embeddings to the binary embedding format."
+)
+parser.add_argument("csv_fp", help="The file to convert, e.g. analysis/data/aug_2023_w_emb.csv")
+parser.add_argument("-o", "--output", default=None,
+                    help="The table to write. Defaults to the input path with a .txt suffix.")
+parser.add_argument("-e", "--emb-col", default="descr_emb")
+parser.add_argument("-d", "--delim", default="|")
+parser.add_argument("-c", "--chunksize", type=int, default=10_000)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    out = args.output or Path(args.csv_fp).with_suffix(".txt")
+    out = convert_emb_csv(args.csv_fp, out, emb_col=args.emb_col,
+                          sep=args.delim, chunksize=args.chunksize)
+    print(f"Saved {out}")
@@ -0,0 +1,99 @@
+import sys
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from src.cli import add_embedding_args, add_metrics_args, metrics_from_args, backend_from_args  # noqa: E402
+
+# Keep the classifiers loaded in a local HTTP service (see src/service.py),
+# so transactions can be labeled without reloading anything per run.
+# numpy, pandas and the backends are imported once the arguments are parsed.
+
+parser = argparse.ArgumentParser(
+    prog="serve_classify.py",
+    description="Serve transaction classification over HTTP on localhost, with the label embeddings, classifiers and embeddings kept in memory.",
+    epilog="POST /classify {\"texts\": [...]} returns a label, score and source per text; GET /stats reports latency and throughput. Run from the repository root."
+)
+parser.add_argument("--host", default="127.0.0.1",
+                    help="Address to listen on. Defaults to 127.0.0.1 (this machine only).")
+parser.add_argument("--port", type=int, default=8090,
+                    help="Port to listen on. Defaults to 8090.")
+parser.add_argument("--labels",
+                    default="analysis/data/labels/labels_nl_descr_simple.json",
+                    help="Labels json ({label: [keywords]}), embedded with the backend at startup."
+                    )
+parser.add_argument("--label-embs",
+                    nargs="+",
+                    default=None,
+                    metavar="PKL",
+                    help="Pickled label embeddings from 3_embed_labels.py to use (summed) instead of embedding --labels."
+                    )
+parser.add_argument("--labeled",
+                    default="analysis/data/hand_labeled_spend.txt",
+                    help="Hand labeled transactions for the exact match fast path (skipped if missing)."
+                    )
+parser.add_argument("--rules",
+                    default="analysis/data/labels/rules.json",
+                    help="Prefix rules json ({label: [prefixes]}) for the fast path (skipped if missing)."
+                    )
+parser.add_argument("--linear",
+                    default=None,
+                    metavar="NPZ",
+                    help="Label with this linear model from 4_linear_classify.py instead of label embedding similarity."
+                    )
+parser.add_argument("--top-k", type=int, default=3,
+                    help="Labels returned per text for embedding matches. Defaults to 3.")
+parser.add_argument("--max-batch", type=int, default=4096,
+                    help="Most texts classified in one batch. Defaults to 4096.")
+parser.add_argument("--max-wait-ms", type=float, default=0.0,
+                    help="How long a batch waits for more requests to join it. Defaults to 0: requests that queue up while a batch runs make up the next one.")
+add_embedding_args(parser)
+add_metrics_args(parser)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    metrics_from_args(args)
+    import time
+    import signal
+    from src.classify import load_class_embeddings, load_labels, embed_label_dict
+    from src.fastpath import FastClassifier
+    from src.linear import SoftmaxClassifier
+    from src.service import WarmClassifier, make_server
+
+    t0 = time.perf_counter()
+    backend, cache = backend_from_args(args)
+    backend.progress = None
+    if args.label_embs is not None:
+        lab_embs = load_class_embeddings(args.label_embs, agg_mthd="sum")
+    else:
+        lab_embs = embed_label_dict(load_labels(args.labels), backend, cache=cache)
+    if cache is not None:
+        # the service opens its own connection, in its worker thread
+        cache.close()
+    labeled, rules = (p if p is not None and Path(p).exists() else None
+                      for p in (args.labeled, args.rules))
+    fast = FastClassifier.from_files(labeled, rules) if labeled or rules else None
+    linear = SoftmaxClassifier.load(args.linear) if args.linear is not None else None
+    classifier = WarmClassifier(lab_embs, backend,
+                                cache_fp=None if args.no_cache else args.cache,
+                                fast=fast, linear=linear, top_k=args.top_k)
+    server = make_server(classifier, args.host, args.port,
+                         max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000)
+    print(f"***{len(lab_embs)} labels, backend {backend.name}"
+          + (f", fast path with {len(fast.exact)} descriptions and {len(fast.rules)} rules" if fast else "")
+          + (f", linear model with {len(linear)} labels" if linear else ""))
+    print(f"***Serving on http://{args.host}:{server.server_port} (ready in {time.perf_counter() - t0:.2f}s)")
+    def stop(*args):
+        raise KeyboardInterrupt
+    # stop cleanly (printing the latency summary, saving --metrics) on kill too
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        stats = server.batcher.stats()
+        print(f"\n***{stats['requests']} requests, p50 {stats['p50_ms'] or 0:.1f}ms,"
+              f" p95 {stats['p95_ms'] or 0:.1f}ms, p99 {stats['p99_ms'] or 0:.1f}ms")
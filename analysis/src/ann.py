@@ -0,0 +1,238 @@
+import numpy as np
+from .classify import normalize_rows
+from common.metrics import timer, count
+
+
+def spherical_kmeans(x, n_clusters, n_iter=10, seed=0):
+    """k-means on normalized vectors, using cosine similarity.
+    Returns the (normalized) centroids."""
+    rng = np.random.default_rng(seed)
+    cent = x[rng.choice(len(x), size=n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = np.argmax(x @ cent.T, axis=1)
+        sums = np.zeros_like(cent)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=n_clusters)
+        empty = counts == 0
+        # restart empty clusters from random points
+        sums[empty] = x[rng.choice(len(x), size=empty.sum())]
+        cent = normalize_rows(sums)
+    return cent
+
+
+class IVFIndex:
+    """Inverted file index for cosine similarity search, in pure NumPy.
+    Vectors are normalized and grouped into lists by their nearest k-means
+    centroid, and a query only scans the `n_probe` lists whose centroids are
+    closest to it. Vectors can be added at any time; the centroids are
+    retrained whenever the index has grown `retrain_factor` times since the
+    last training, so the lists stay balanced.
+    Each vector has a label and an integer id (e.g. the txn_id of the
+    labeled transaction it came from), by which it can be relabeled or
+    removed.
+    """
+    def __init__(self, dim, n_probe=8, min_train=1024, retrain_factor=4, seed=0):
+        self.dim = dim
+        self.n_probe = n_probe
+        self.min_train = min_train
+        self.retrain_factor = retrain_factor
+        self.seed = seed
+        self.centroids = None
+        self.trained_on = 0
+        self.labels = np.array([], dtype=object)
+        self.ids = np.array([], dtype=np.int64)
+        # per list: vectors (with spare capacity), row numbers, and size
+        self._vecs = [np.zeros((0, dim), dtype=np.float32)]
+        self._rows = [np.zeros(0, dtype=np.int64)]
+        self._sizes = [0]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def n_lists(self):
+        return len(self._sizes)
+
+    def vectors(self):
+        """All vectors, in the order they were added."""
+        out = np.zeros((len(self), self.dim), dtype=np.float32)
+        for v, r, n in zip(self._vecs, self._rows, self._sizes):
+            out[r[:n]] = v[:n]
+        return out
+
+    def _append(self, lst, vecs, rows):
+        n, cap = self._sizes[lst], self._vecs[lst].shape[0]
+        if n + len(vecs) > cap:
+            new_cap = max(2 * cap, n + len(vecs), 16)
+            v = np.zeros((new_cap, self.dim), dtype=np.float32)
+            r = np.zeros(new_cap, dtype=np.int64)
+            v[:n], r[:n] = self._vecs[lst][:n], self._rows[lst][:n]
+            self._vecs[lst], self._rows[lst] = v, r
+        self._vecs[lst][n:n + len(vecs)] = vecs
+        self._rows[lst][n:n + len(vecs)] = rows
+        self._sizes[lst] = n + len(vecs)
+
+    def _assign(self, x):
+        if self.centroids is None:
+            return np.zeros(len(x), dtype=np.int64)
+        return np.argmax(x @ self.centroids.T, axis=1)
+
+    def _build(self, x, rows):
+        """Rebuild the lists from scratch for vectors x with row numbers rows."""
+        n_lists = len(self.centroids) if self.centroids is not None else 1
+        assign = self._assign(x)
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(n_lists + 1))
+        self._vecs, self._rows, self._sizes = [], [], []
+        for i in range(n_lists):
+            sel = order[bounds[i]:bounds[i + 1]]
+            self._vecs.append(np.ascontiguousarray(x[sel]))
+            self._rows.append(rows[sel])
+            self._sizes.append(len(sel))
+
+    def train(self, n_lists=None, n_iter=10, sample_size=None):
+        """(Re)train the centroids on the vectors in the index and rebuild
+        the lists. Defaults to ~4*sqrt(n) lists."""
+        x = self.vectors()
+        n_lists = n_lists or max(1, int(4 * np.sqrt(len(x))))
+        n_lists = min(n_lists, len(x))
+        sample_size = sample_size or 256 * n_lists
+        rng = np.random.default_rng(self.seed)
+        sample = x if len(x) <= sample_size else x[rng.choice(len(x), sample_size, replace=False)]
+        self.centroids = spherical_kmeans(sample, n_lists, n_iter=n_iter, seed=self.seed)
+        self.trained_on = len(x)
+        self._build(x, np.arange(len(x)))
+
+    def add(self, vectors, labels, ids=None):
+        """Add vectors with their labels (and ids, default: consecutive)."""
+        x = normalize_rows(vectors)
+        if ids is None:
+            ids = np.arange(len(self), len(self) + len(x))
+        rows = np.arange(len(self), len(self) + len(x))
+        self.labels = np.concatenate([self.labels, np.asarray(labels, dtype=object)])
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        assign = self._assign(x)
+        for lst in np.unique(assign):
+            sel = assign == lst
+            self._append(lst, x[sel], rows[sel])
+        if len(self) >= self.min_train and len(self) >= self.retrain_factor * max(self.trained_on, 1):
+            self.train()
+
+    def relabel(self, ids, labels):
+        """Give the vectors with these ids (the ones in the index) new labels.
+        Returns the number of labels changed."""
+        if len(self) == 0 or len(ids) == 0:
+            return 0
+        order = np.argsort(self.ids, kind="stable")
+        pos = np.minimum(np.searchsorted(self.ids[order], ids), len(self) - 1)
+        found = self.ids[order][pos] == ids
+        rows, labels = order[pos[found]], np.asarray(labels, dtype=object)[found]
+        changed = self.labels[rows] != labels
+        self.labels[rows[changed]] = labels[changed]
+        return int(changed.sum())
+
+    def remove(self, ids):
+        """Remove the vectors with these ids, and rebuild the lists."""
+        keep = ~np.isin(self.ids, ids)
+        if keep.all():
+            return
+        x = self.vectors()[keep]
+        self.labels, self.ids = self.labels[keep], self.ids[keep]
+        self._build(x, np.arange(len(x)))
+
+    def _topk(self, sims, rows, k):
+        if len(rows) > k:
+            part = np.argpartition(-sims, k - 1)[:k]
+        else:
+            part = np.arange(len(rows))
+        part = part[np.argsort(-sims[part], kind="stable")]
+        return rows[part], sims[part]
+
+    def search(self, queries, k=10, n_probe=None):
+        """Approximate k nearest neighbors of each query.
+        Returns (rows, sims), lists with one array per query (a query gets
+        fewer than k results if its probed lists hold fewer vectors).
+        """
+        q = normalize_rows(np.atleast_2d(queries))
+        if self.centroids is None:
+            return self.search_exact(q, k)
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        cs = q @ self.centroids.T
+        probes = np.argpartition(-cs, n_probe - 1, axis=1)[:, :n_probe]
+        out_rows, out_sims = [], []
+        for qi, lists in zip(q, probes):
+            vecs = [self._vecs[l][:self._sizes[l]] for l in lists]
+            rows = np.concatenate([self._rows[l][:self._sizes[l]] for l in lists])
+            sims = np.concatenate([v @ qi for v in vecs]) if len(rows) else np.zeros(0, np.float32)
+            r, s = self._topk(sims, rows, k)
+            out_rows.append(r)
+            out_sims.append(s)
+        return out_rows, out_sims
+
+    def search_exact(self, queries, k=10, chunksize=1024):
+        """Brute force k nearest neighbors, for small indexes and recall checks."""
+        q = normalize_rows(np.atleast_2d(queries))
+        x = self.vectors()
+        all_rows = np.arange(len(x))
+        out_rows, out_sims = [], []
+        for start in range(0, len(q), chunksize):
+            sims = q[start:start + chunksize] @ x.T
+            for s in sims:
+                r, s = self._topk(s, all_rows, k)
+                out_rows.append(r)
+                out_sims.append(s)
+        return out_rows, out_sims
+
+    def recall(self, queries, k=10, n_probe=None):
+        """Share of the exact k nearest neighbors that `search` finds."""
+        approx, _ = self.search(queries, k, n_probe)
+        exact, _ = self.search_exact(queries, k)
+        found = sum(len(np.intersect1d(a, e)) for a, e in zip(approx, exact))
+        return found / max(sum(len(e) for e in exact), 1)
+
+    def knn_label(self, queries, k=10, weighted=True, exact=False, n_probe=None):
+        """Label each query by a vote of its k nearest neighbors, weighted by
+        similarity if `weighted`. Returns (labels, scores), where the score is
+        the winning label's share of the vote.
+        """
+        count("knn.queries", len(queries))
+        with timer("knn.search"):
+            rows, sims = self.search_exact(queries, k) if exact else self.search(queries, k, n_probe)
+        labels = np.empty(len(rows), dtype=object)
+        scores = np.zeros(len(rows), dtype=np.float32)
+        for i, (r, s) in enumerate(zip(rows, sims)):
+            if len(r) == 0:
+                labels[i] = None
+                continue
+            w = np.clip(s, 0, None) if weighted else np.ones(len(s))
+            votes = {}
+            for lab, wi in zip(self.labels[r], w):
+                votes[lab] = votes.get(lab, 0.0) + float(wi)
+            labels[i] = max(votes, key=votes.get)
+            total = sum(votes.values())
+            scores[i] = votes[labels[i]] / total if total > 0 else 0.0
+        return labels, scores
+
+    def save(self, path):
+        np.savez(path,
+                 vectors=self.vectors(),
+                 labels=self.labels.astype(str),
+                 ids=self.ids,
+                 centroids=self.centroids if self.centroids is not None else np.zeros((0, self.dim), np.float32),
+                 params=np.array([self.n_probe, self.min_train, self.retrain_factor,
+                                  self.seed, self.trained_on]))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as f:
+            vecs = f["vectors"]
+            n_probe, min_train, retrain_factor, seed, trained_on = f["params"].tolist()
+            index = cls(vecs.shape[1], n_probe=n_probe, min_train=min_train,
+                        retrain_factor=retrain_factor, seed=seed)
+            index.labels = f["labels"].astype(object)
+            index.ids = f["ids"].astype(np.int64)
+            if f["centroids"].shape[0] > 0:
+                index.centroids = f["centroids"]
+            index.trained_on = trained_on
+        index._build(vecs, np.arange(len(vecs)))
+        return index
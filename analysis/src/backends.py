@@ -0,0 +1,112 @@
+import hashlib
+from itertools import islice
+import numpy as np
+from pathlib import Path
+from .embed import EmbeddingClient, DEFAULT_ENGINE
+from .classify import normalize_rows
+
+
+class EmbeddingBackend:
+    """Turns texts into embeddings.
+    name - identifies the embedding space, embeddings are only comparable
+           (and cached together) within the same name
+    cacheable - whether embeddings are worth keeping in the embedding cache
+    embed(texts) - returns a float32 matrix with one row per text
+    progress - optional function called as progress(done, total) while embedding
+    """
+    name = None
+    cacheable = True
+    progress = None
+
+    def embed(self, texts):
+        raise NotImplementedError
+
+
+class OpenAIBackend(EmbeddingBackend):
+    """Embeddings from the OpenAI API (see src.embed.EmbeddingClient)."""
+    def __init__(self, engine=DEFAULT_ENGINE, **client_kwargs):
+        self.client = EmbeddingClient(engine=engine, **client_kwargs)
+        self.name = engine
+
+    @property
+    def progress(self):
+        return self.client.progress
+
+    @progress.setter
+    def progress(self, fn):
+        self.client.progress = fn
+
+    def embed(self, texts):
+        return np.asarray(self.client.embed(texts), dtype=np.float32)
+
+
+class HashingBackend(EmbeddingBackend):
+    """Local embeddings: hashed character n-gram counts, optionally TF-IDF
+    weighted, L2 normalized. No network or model download is needed and it
+    embeds many thousands of short descriptions per second on CPU.
+    If `idf_fp` exists the IDF weights are loaded from it (see `fit_idf`).
+    """
+    cacheable = False
+
+    def __init__(self, n_features=1024, ngram_range=(2, 4), idf_fp=None, batch_size=8192):
+        from sklearn.feature_extraction.text import HashingVectorizer
+        self.n_features = n_features
+        self.ngram_range = tuple(ngram_range)
+        self.batch_size = batch_size
+        self.vectorizer = HashingVectorizer(analyzer="char_wb",
+                                            ngram_range=self.ngram_range,
+                                            n_features=n_features,
+                                            alternate_sign=False,
+                                            norm=None)
+        self.idf = None
+        if idf_fp is not None and Path(idf_fp).exists():
+            self.idf = np.load(idf_fp)
+
+    @property
+    def name(self):
+        name = f"hashing-char{self.ngram_range[0]}-{self.ngram_range[1]}-{self.n_features}"
+        if self.idf is not None:
+            name += "-idf" + hashlib.sha256(self.idf.tobytes()).hexdigest()[:8]
+        return name
+
+    def fit_idf(self, texts, save_fp=None):
+        """Fit smoothed IDF weights (as in sklearn's TfidfTransformer) on
+        texts, any iterable of strings (read batch_size at a time)."""
+        df = np.zeros(self.n_features)
+        n = 0
+        texts = iter(texts)
+        while batch := list(islice(texts, self.batch_size)):
+            x = self.vectorizer.transform(batch)
+            df += np.bincount(x.indices, minlength=self.n_features)
+            n += len(batch)
+        self.idf = (np.log((1 + n) / (1 + df)) + 1).astype(np.float32)
+        if save_fp is not None:
+            np.save(save_fp, self.idf)
+        return self
+
+    def embed(self, texts):
+        texts = list(texts)
+        out = np.zeros((len(texts), self.n_features), dtype=np.float32)
+        if self.progress is not None:
+            self.progress(0, len(texts))
+        for start in range(0, len(texts), self.batch_size):
+            x = self.vectorizer.transform(texts[start:start + self.batch_size])
+            if self.idf is not None:
+                x = x.multiply(self.idf).tocsr()
+            out[start:start + x.shape[0]] = x.toarray()
+            if self.progress is not None:
+                self.progress(start + x.shape[0], len(texts))
+        return normalize_rows(out)
+
+
+BACKENDS = {
+    "openai": OpenAIBackend,
+    "hashing": HashingBackend
+}
+
+
+def get_backend(name, **kwargs):
+    """Make an embedding backend by name ('openai' or 'hashing')."""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{name}', choose from {list(BACKENDS)}")
+    return BACKENDS[name](**kwargs)
@@ -0,0 +1,112 @@
+import json
+import pickle
+import numpy as np
+from common.metrics import timer, count
+
+
+def load_labels(fp):
+    with open(fp, "r") as f:
+        l = json.load(f)
+    return l
+
+
+def label_prompts(labels, include_keywords=True, concat_keywords=", "):
+    """The text to embed for each label in a dict of {class-name: keywords}:
+    'class-name: kw1, kw2, ...' or just the class name."""
+    if include_keywords:
+        return [k + ": " + concat_keywords.join(v) for k, v in labels.items()]
+    return list(labels.keys())
+
+
+def embed_label_dict(labels, backend, include_keywords=(True, False),
+                     concat_keywords=", ", cache=None):
+    """Embed labels with a backend (src.backends), without pickled label
+    embeddings. The embeddings of each prompt style in `include_keywords` are
+    summed, like loading several label pickles with agg_mthd="sum".
+    Returns a dict of {class-name: embeddings}.
+    """
+    from .embed_cache import embed_cached
+    if isinstance(include_keywords, bool):
+        include_keywords = (include_keywords,)
+    total = None
+    for kw in include_keywords:
+        embs = embed_cached(label_prompts(labels, kw, concat_keywords), backend, cache)
+        total = embs if total is None else total + embs
+    return dict(zip(labels.keys(), total))
+
+
+def load_class_embeddings(filepaths, agg_mthd="mean"):
+    """If multiple filepaths, label embeddings from the different files
+    are combined using `agg_mthd`.
+    """
+    if not isinstance(filepaths, list):
+        filepaths = [filepaths]
+    if agg_mthd == "mean":
+        div = len(filepaths)
+    elif agg_mthd == "sum":
+        div = 1
+    else:
+        raise ValueError("agg_mthd: Argument must be 'sum' or 'mean'")
+    lab_embs = None
+    for fp in filepaths:
+        with open(fp, "rb") as f:
+            x = pickle.load(f)
+            if lab_embs is None:
+                lab_embs = {k : np.array(v) / div for k, v in x.items()}
+            else:
+                for k in lab_embs.keys():
+                    lab_embs[k] += np.array(x[k]) / div
+    return lab_embs
+
+
+def normalize_rows(x, eps=1e-12):
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), eps)
+
+
+def label_matrix(lab_embs):
+    """Stack a dict of {class-name: embeddings} into (labels, matrix), with
+    each row of the matrix normalized so a dot product is a cosine similarity.
+    """
+    labels = list(lab_embs.keys())
+    return labels, normalize_rows(np.stack([lab_embs[l] for l in labels]))
+
+
+def classify_batch(emb, labels, lab_mat, top_k=1, chunksize=65_536):
+    """Classify each row of `emb` by cosine similarity with the (normalized)
+    label matrix from `label_matrix`. Rows are processed `chunksize` at a
+    time with one matrix multiply per chunk, so memory stays bounded however
+    many rows there are (`emb` can be a memory mapped array).
+
+    Returns (top_labels, top_sims, margin): the top_k labels and their
+    similarities per row, best first, and the gap between the best and
+    second best similarity (how confident the match is, or just the best
+    similarity if there is only one label).
+    """
+    with timer("classify.batch"):
+        return _classify_batch(emb, labels, lab_mat, top_k, chunksize)
+
+
+def _classify_batch(emb, labels, lab_mat, top_k, chunksize):
+    n = emb.shape[0]
+    count("classify.rows", n)
+    k = min(top_k, len(labels))
+    labels = np.asarray(labels, dtype=object)
+    top_idx = np.zeros((n, k), dtype=np.int64)
+    top_sims = np.zeros((n, k), dtype=np.float32)
+    margin = np.zeros(n, dtype=np.float32)
+    for start in range(0, n, chunksize):
+        sims = normalize_rows(emb[start:start + chunksize]) @ lab_mat.T
+        rows = np.arange(sims.shape[0])[:, None]
+        m = min(k + 1, len(labels))
+        if m < len(labels):
+            idx = np.argpartition(-sims, m - 1, axis=1)[:, :m]
+        else:
+            idx = np.tile(np.arange(len(labels)), (sims.shape[0], 1))
+        idx = np.take_along_axis(idx, np.argsort(-sims[rows, idx], axis=1, kind="stable"), axis=1)
+        best = sims[rows, idx]
+        end = start + sims.shape[0]
+        top_idx[start:end] = idx[:, :k]
+        top_sims[start:end] = best[:, :k]
+        margin[start:end] = best[:, 0] - best[:, 1] if m > 1 else best[:, 0]
+    return labels[top_idx], top_sims, margin
@@ -0,0 +1,167 @@
+import os
+import sys
+import time
+from common import metrics
+
+# shared command line options for the analysis scripts
+# (backends and the cache, and so numpy, are only imported once the
+# arguments are parsed, so -h returns straight away)
+
+BACKEND_NAMES = ["openai", "hashing"] # src.backends.BACKENDS
+
+
+def ask_yesno(msg):
+    """Ask a yes/no question until answered. A closed stdin counts as no."""
+    while True:
+        try:
+            i = input(f"{msg} (yes/no): ").strip().lower()
+        except EOFError:
+            print()
+            return False
+        if i.startswith("y"):
+            return True
+        if i.startswith("n"):
+            return False
+        print("ERROR: Answer y(es) or n(o) to continue execution.")
+
+
+def confirm(msg, cost, yes=False, max_cost=None):
+    """Decide whether to go ahead with an embedding job estimated to cost
+    `cost` dollars. Over `max_cost` always aborts; `yes` or a `max_cost` the
+    cost fits in goes ahead without asking; otherwise ask (if stdin is a
+    terminal, else abort so unattended jobs never hang on a prompt).
+    """
+    if max_cost is not None and cost > max_cost:
+        print(f"***Estimated cost ${cost:.4f} is over the budget of ${max_cost:.4f}, aborting.")
+        return False
+    if yes or max_cost is not None:
+        return True
+    if not sys.stdin.isatty():
+        print("***Not running interactively, pass --yes or --max-cost to embed.")
+        return False
+    return ask_yesno(msg)
+
+
+class Progress:
+    """progress(done, total) callback printing a throughput line to stderr,
+    at most every `every` seconds. The clock starts at the first call (with
+    done=0 at the start of a job)."""
+    def __init__(self, label="Embedded", every=1.0, stream=None):
+        self.label = label
+        self.every = every
+        self.stream = stream or sys.stderr
+        self.start = None
+        self.last = 0.0
+
+    def __call__(self, done, total):
+        now = time.perf_counter()
+        if self.start is None or done == 0:
+            self.start = now
+        if done < total and now - self.last < self.every:
+            return
+        self.last = now
+        rate = done / max(now - self.start, 1e-9)
+        eta = (total - done) / rate if rate > 0 else float("inf")
+        end = "\n" if done >= total else ""
+        print(f"\r***{self.label} {done}/{total} ({done / max(total, 1):.0%})"
+              f", {rate:.0f}/s, eta {eta:.0f}s ", end=end, file=self.stream, flush=True)
+
+
+def add_embedding_args(parser):
+    parser.add_argument("-b", "--backend",
+                        default="openai",
+                        choices=BACKEND_NAMES,
+                        help="Embedding backend. 'hashing' is local and free. Defaults to 'openai'."
+                        )
+    parser.add_argument("--idf",
+                        default="analysis/data/hashing_idf.npy",
+                        help="IDF weights for the hashing backend. Defaults to analysis/data/hashing_idf.npy."
+                        )
+    parser.add_argument("--cache",
+                        default="analysis/data/embeddings.sqlite",
+                        help="SQLite embedding cache. Defaults to analysis/data/embeddings.sqlite."
+                        )
+    parser.add_argument("--no-cache",
+                        action="store_true",
+                        help="Embed everything, without reading or updating the embedding cache."
+                        )
+    parser.add_argument("--batch-size",
+                        type=int,
+                        default=256,
+                        help="Texts per embedding request. Defaults to 256."
+                        )
+    parser.add_argument("--concurrency",
+                        type=int,
+                        default=8,
+                        help="Embedding requests in flight at once. Defaults to 8."
+                        )
+    parser.add_argument("--rpm",
+                        type=int,
+                        default=3000,
+                        help="Requests per minute limit. Defaults to 3000."
+                        )
+    parser.add_argument("--tpm",
+                        type=int,
+                        default=1_000_000,
+                        help="Tokens per minute limit. Defaults to 1,000,000."
+                        )
+    parser.add_argument("--token-rate",
+                        type=float,
+                        default=0.0001,
+                        help="Price per token in $, for the cost estimate. Defaults to 0.0001."
+                        )
+    parser.add_argument("-y", "--yes",
+                        action="store_true",
+                        help="Embed without asking for confirmation."
+                        )
+    parser.add_argument("--max-cost",
+                        type=float,
+                        default=None,
+                        metavar="DOLLARS",
+                        help="Embed without asking if the estimated cost is at most DOLLARS, abort otherwise."
+                        )
+    parser.add_argument("-q", "--quiet",
+                        action="store_true",
+                        help="Don't print progress while embedding."
+                        )
+    return parser
+
+
+def add_metrics_args(parser):
+    parser.add_argument("--metrics",
+                        default=None,
+                        metavar="FILE",
+                        help="Save timings, counters (rows, API calls, cache hits) and peak memory as JSON to FILE."
+                        )
+    parser.add_argument("--profile",
+                        default=None,
+                        metavar="FILE",
+                        help="Profile the run with cProfile and dump the stats to FILE (view with snakeviz or flameprof)."
+                        )
+    return parser
+
+
+def metrics_from_args(args):
+    """Start the instrumentation asked for by add_metrics_args' options."""
+    metrics.enable(metrics_fp=args.metrics, profile_fp=args.profile)
+
+
+def backend_from_args(args):
+    """Make the embedding backend, and cache (or None), from the cli args."""
+    from .backends import get_backend
+    from .embed_cache import EmbeddingCache
+    if args.backend == "openai":
+        # openai key (not needed for a local server set with OPENAI_API_BASE)
+        apikey = os.environ.get("OPENAI")
+        if apikey is None and os.environ.get("OPENAI_API_BASE") is None:
+            raise RuntimeError("Required environmental variable 'OPENAI' is not set.")
+        backend = get_backend("openai", api_key=apikey, batch_size=args.batch_size,
+                              concurrency=args.concurrency, rpm=args.rpm, tpm=args.tpm)
+    else:
+        backend = get_backend(args.backend, idf_fp=args.idf)
+    if not args.quiet:
+        backend.progress = Progress()
+    cache = None
+    if backend.cacheable and not args.no_cache:
+        cache = EmbeddingCache(args.cache)
+    return backend, cache
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+# A table with embeddings is stored as
+#   name.txt      - the delimited table, with a row_id column
+#   name.emb.npy  - float32 embedding matrix, one row per table row
+#   name.ids.npy  - the row_id of each matrix row, to check they line up
+# so the embeddings can be memory mapped instead of parsed from text.
+
+
+def emb_paths(table_fp):
+    table_fp = Path(table_fp)
+    stem = table_fp.with_suffix("")
+    return (table_fp,
+            stem.with_name(stem.name + ".emb.npy"),
+            stem.with_name(stem.name + ".ids.npy"))
+
+
+def has_embeddings(table_fp, sep="|", emb_col=None):
+    """Whether a table has embeddings: a .emb.npy next to it or, if `emb_col`
+    is given, a column of stringified embeddings (tables saved the old way)."""
+    if emb_paths(table_fp)[1].exists():
+        return True
+    if emb_col is None or not Path(table_fp).exists():
+        return False
+    return emb_col in pd.read_csv(table_fp, sep=sep, nrows=0).columns
+
+
+def parse_emb_strings(strs, dtype=np.float32):
+    """Parse stringified lists ("[0.1, 0.2, ...]") into a matrix."""
+    rows = [np.fromstring(s.strip("[]"), sep=",", dtype=dtype) for s in strs]
+    return np.stack(rows) if rows else np.zeros((0, 0), dtype=dtype)
+
+
+def save_embeddings(df, emb, table_fp, sep="|"):
+    """Save a table and its (row aligned) embedding matrix."""
+    table_fp, emb_fp, ids_fp = emb_paths(table_fp)
+    emb = np.asarray(emb, dtype=np.float32)
+    if emb.shape[0] != len(df):
+        raise ValueError(f"{emb.shape[0]} embeddings for {len(df)} rows")
+    df = df.copy()
+    df["row_id"] = np.arange(len(df))
+    df.to_csv(table_fp, sep=sep, index=False)
+    np.save(emb_fp, emb)
+    np.save(ids_fp, df["row_id"].to_numpy(dtype=np.int64))
+    return table_fp
+
+
+def load_embeddings(table_fp, sep="|", emb_col="descr_emb", mmap=True, **kwargs):
+    """Load a table and its embedding matrix.
+    The matrix is memory mapped (read only, no copy) if `mmap`. Tables saved
+    the old way, with stringified lists in `emb_col`, are parsed instead (see
+    convert_emb_csv to convert them once).
+    Returns (df, matrix).
+    """
+    table_fp, emb_fp, ids_fp = emb_paths(table_fp)
+    if not emb_fp.exists():
+        df = pd.read_csv(table_fp, sep=sep, **kwargs)
+        emb = parse_emb_strings(df[emb_col].astype(str))
+        return df.drop(columns=emb_col), emb
+    df = pd.read_csv(table_fp, sep=sep, **kwargs)
+    emb = np.load(emb_fp, mmap_mode="r" if mmap else None)
+    if emb.shape[0] != len(df):
+        raise ValueError(f"{emb_fp} has {emb.shape[0]} rows but {table_fp} has {len(df)}")
+    if ids_fp.exists() and "row_id" in df.columns:
+        ids = np.load(ids_fp, mmap_mode="r")
+        if not np.array_equal(ids, df["row_id"].to_numpy(dtype=np.int64)):
+            raise ValueError(f"{emb_fp} rows are not aligned with {table_fp}")
+    return df, emb
+
+
+def convert_emb_csv(csv_fp, table_fp, emb_col="descr_emb", sep="|", chunksize=10_000):
+    """Convert a table with stringified embeddings in `emb_col` to the binary
+    format, streaming it in chunks into a memory mapped .npy file.
+    Returns the path of the new table.
+    """
+    table_fp, emb_fp, ids_fp = emb_paths(table_fp)
+    if Path(csv_fp).resolve() == table_fp.resolve():
+        raise ValueError("The converted table must be written to a new path.")
+    n = sum(len(c) for c in pd.read_csv(csv_fp, sep=sep, usecols=[emb_col],
+                                        dtype=str, chunksize=chunksize))
+    emb, start = None, 0
+    for i, chunk in enumerate(pd.read_csv(csv_fp, sep=sep, dtype=str, chunksize=chunksize)):
+        x = parse_emb_strings(chunk[emb_col])
+        if emb is None:
+            emb = np.lib.format.open_memmap(emb_fp, mode="w+", dtype=np.float32,
+                                            shape=(n, x.shape[1]))
+        emb[start:start + len(chunk)] = x
+        chunk = chunk.drop(columns=emb_col)
+        chunk["row_id"] = np.arange(start, start + len(chunk))
+        chunk.to_csv(table_fp, sep=sep, index=False,
+                     mode="w" if i == 0 else "a", header=(i == 0))
+        start += len(chunk)
+    if emb is not None:
+        emb.flush()
+        del emb
+    np.save(ids_fp, np.arange(n, dtype=np.int64))
+    return table_fp
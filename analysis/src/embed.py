@@ -0,0 +1,185 @@
+import os
+import json
+import math
+import time
+import random
+import asyncio
+import threading
+import urllib.request
+import urllib.error
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+from common.metrics import timer, count
+
+DEFAULT_ENGINE = "text-similarity-davinci-001"
+DEFAULT_API_BASE = "https://api.openai.com/v1"
+
+
+def calc_tokens(text, token_rate=0.0001):
+    tok = len(''.join(text)) / 4
+    return tok, tok * token_rate
+
+
+def parse_retry_after(value, now=None):
+    """Seconds to wait from a Retry-After header, given either as seconds or
+    as an HTTP date. None if it is missing or doesn't parse (the backoff is
+    used then)."""
+    if not value:
+        return None
+    try:
+        secs = float(value)
+        return max(secs, 0.0) if math.isfinite(secs) else None
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    now = now if now is not None else datetime.now(timezone.utc)
+    return max((when - now).total_seconds(), 0.0)
+
+
+class RetryableError(Exception):
+    def __init__(self, msg, retry_after=None):
+        super().__init__(msg)
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Token buckets for requests per minute and tokens per minute.
+    Either limit can be None to disable it.
+    """
+    def __init__(self, rpm=None, tpm=None):
+        self.limits = {"requests": rpm, "tokens": tpm}
+        self.level = {k: float(v or 0) for k, v in self.limits.items()}
+        self.last = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        for k, lim in self.limits.items():
+            if lim:
+                self.level[k] = min(lim, self.level[k] + (now - self.last) * lim / 60)
+        self.last = now
+
+    async def acquire(self, tokens):
+        need = {"requests": 1, "tokens": tokens}
+        async with self.lock:
+            while True:
+                self._refill()
+                wait = 0.0
+                for k, lim in self.limits.items():
+                    if lim:
+                        # a request bigger than the whole bucket waits for a full bucket
+                        short = min(need[k], lim) - self.level[k]
+                        wait = max(wait, short * 60 / lim)
+                if wait <= 0:
+                    for k, lim in self.limits.items():
+                        if lim:
+                            self.level[k] -= need[k]
+                    return
+                await asyncio.sleep(wait)
+
+
+class EmbeddingClient:
+    """Embed many texts with an OpenAI-compatible /embeddings endpoint.
+    Texts are sent `batch_size` per request with at most `concurrency`
+    requests in flight, throttled to `rpm` requests and `tpm` tokens per
+    minute, and retried with exponential backoff on rate limits and server
+    errors. Set `api_base` (or the OPENAI_API_BASE environmental variable) to
+    use another server, e.g. src/mock_server.py.
+    `progress`, if given, is called as progress(done, total) after each
+    batch, with the number of texts embedded so far.
+    """
+    def __init__(self, api_key=None, engine=DEFAULT_ENGINE, api_base=None,
+                 batch_size=256, concurrency=8, rpm=3000, tpm=1_000_000,
+                 max_retries=6, timeout=60, progress=None):
+        self.api_key = api_key if api_key is not None else os.environ.get("OPENAI")
+        self.engine = engine
+        self.api_base = (api_base or os.environ.get("OPENAI_API_BASE")
+                         or DEFAULT_API_BASE).rstrip("/")
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.progress = progress
+        self.n_requests = 0
+        self.n_retries = 0
+        self.n_tokens = 0
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.engine
+
+    def _post(self, inputs):
+        body = json.dumps({"input": inputs, "model": self.engine}).encode()
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        req = urllib.request.Request(f"{self.api_base}/embeddings", data=body,
+                                     headers=headers, method="POST")
+        count("embed.api_calls")
+        try:
+            with timer("embed.request"), urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                out = json.load(resp)
+        except urllib.error.HTTPError as e:
+            if e.code == 429 or e.code >= 500:
+                retry_after = e.headers.get("Retry-After") if e.headers else None
+                raise RetryableError(f"HTTP {e.code}", parse_retry_after(retry_after))
+            raise RuntimeError(f"Embedding request failed with HTTP {e.code}: {e.read()[:500]}")
+        except (urllib.error.URLError, TimeoutError, ConnectionError) as e:
+            raise RetryableError(str(e))
+        tokens = out.get("usage", {}).get("total_tokens", 0)
+        count("embed.tokens", tokens)
+        with self._lock:
+            self.n_requests += 1
+            self.n_tokens += tokens
+        data = sorted(out["data"], key=lambda d: d["index"])
+        return [d["embedding"] for d in data]
+
+    async def _embed_batch(self, batch, sem, limiter, pool, counts):
+        loop = asyncio.get_running_loop()
+        tokens = int(calc_tokens(batch)[0]) + 1
+        async with sem:
+            for attempt in range(self.max_retries + 1):
+                await limiter.acquire(tokens)
+                try:
+                    out = await loop.run_in_executor(pool, self._post, batch)
+                    counts[0] += len(batch)
+                    if self.progress is not None:
+                        self.progress(counts[0], counts[1])
+                    return out
+                except RetryableError as e:
+                    if attempt == self.max_retries:
+                        raise RuntimeError(f"Embedding request failed after {attempt + 1} attempts: {e}")
+                    self.n_retries += 1
+                    count("embed.retries")
+                    delay = e.retry_after or min(60, 2 ** attempt) * random.uniform(0.5, 1.5)
+                    await asyncio.sleep(delay)
+
+    async def aembed(self, texts):
+        """Embed a list of texts, returning a list of embeddings in the same order."""
+        # new lines can negatively affect performance, and empty inputs are rejected
+        texts = [t.replace("\n", " ") or " " for t in texts]
+        batches = [texts[i:i + self.batch_size]
+                   for i in range(0, len(texts), self.batch_size)]
+        sem = asyncio.Semaphore(self.concurrency)
+        limiter = RateLimiter(rpm=self.rpm, tpm=self.tpm)
+        counts = [0, len(texts)] # done, total
+        if self.progress is not None:
+            self.progress(0, len(texts))
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            out = await asyncio.gather(
+                *[self._embed_batch(b, sem, limiter, pool, counts) for b in batches]
+            )
+        return [emb for batch in out for emb in batch]
+
+    def embed(self, texts):
+        return asyncio.run(self.aembed(list(texts)))
+
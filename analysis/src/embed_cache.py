@@ -0,0 +1,127 @@
+import re
+import sqlite3
+import numpy as np
+from .embed import calc_tokens
+from common.metrics import timer, count
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """The cache key for a text: lower case with whitespace collapsed."""
+    return _WS_RE.sub(" ", str(text)).strip().lower()
+
+
+class EmbeddingCache:
+    """SQLite store of float32 embeddings keyed by model name + normalized text.
+    Merchant descriptions repeat month after month, so only strings that
+    haven't been seen before with the same model need to be embedded.
+    """
+    def __init__(self, path):
+        self.path = str(path)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                key TEXT NOT NULL,
+                vec BLOB NOT NULL,
+                PRIMARY KEY (model, key)
+            ) WITHOUT ROWID
+        """)
+        self.conn.commit()
+
+    def get_many(self, model, keys, chunk_size=500):
+        """Returns {key: vector} for the keys that are cached."""
+        keys = list(keys)
+        out = {}
+        for i in range(0, len(keys), chunk_size):
+            chunk = keys[i:i + chunk_size]
+            rows = self.conn.execute(
+                f"SELECT key, vec FROM embeddings WHERE model = ? AND key IN ({','.join('?' * len(chunk))})",
+                [model, *chunk]
+            )
+            for k, vec in rows:
+                out[k] = np.frombuffer(vec, dtype=np.float32)
+        return out
+
+    def put_many(self, model, items):
+        """Store an iterable of (key, vector) pairs."""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, key, vec) VALUES (?, ?, ?)",
+            ((model, k, np.asarray(v, dtype=np.float32).tobytes()) for k, v in items)
+        )
+        self.conn.commit()
+
+    def count(self, model=None):
+        if model is None:
+            return self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return self.conn.execute("SELECT COUNT(*) FROM embeddings WHERE model = ?",
+                                 (model,)).fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def plan_embeddings(texts, cache, model):
+    """Work out which texts need embedding.
+    Returns (keys, found, missing): the normalized key of each text, the
+    cached {key: vector}s, and the distinct keys that aren't cached.
+    """
+    keys = [normalize_text(t) for t in texts]
+    uniq = list(dict.fromkeys(keys))
+    found = cache.get_many(model, uniq) if cache is not None else {}
+    missing = [k for k in uniq if k not in found]
+    return keys, found, missing
+
+
+def cache_report(keys, missing, token_rate=0.0001):
+    """Summary of what embedding `keys` costs with the cache, compared to
+    embedding every row."""
+    tok_all, cost_all = calc_tokens(keys, token_rate)
+    tok_new, cost_new = calc_tokens(missing, token_rate)
+    return {
+        "rows": len(keys),
+        "new": len(missing),
+        "hit_rate": 1 - len(missing) / len(keys) if keys else 0.0,
+        "tokens": tok_new,
+        "cost": cost_new,
+        "cost_saved": cost_all - cost_new
+    }
+
+
+def print_cache_report(report):
+    print(f"***{report['rows']} rows, {report['new']} distinct strings not in the embedding cache"
+          f" (hit rate {report['hit_rate']:.1%})")
+    print(f"***Embedding roughly {report['tokens']} tokens, ~ ${report['cost']:.4f}"
+          f" (~ ${report['cost_saved']:.4f} saved by the cache)")
+
+
+def embed_cached(texts, backend, cache, model=None, plan=None):
+    """Embed texts, only sending the ones not in the cache to the backend
+    (an EmbeddingClient or src.backends.EmbeddingBackend).
+    Returns a float32 matrix with one row per text.
+    """
+    model = model if model is not None else backend.name
+    if not getattr(backend, "cacheable", True):
+        cache = None
+    keys, found, missing = plan if plan is not None else plan_embeddings(texts, cache, model)
+    count("embed.texts", len(keys))
+    count("embed.cache_hits", len(found))
+    count("embed.cache_misses", len(missing))
+    if missing:
+        with timer("embed.backend"):
+            vecs = backend.embed(missing)
+        new = {k: np.asarray(v, dtype=np.float32) for k, v in zip(missing, vecs)}
+        if cache is not None:
+            cache.put_many(model, new.items())
+        found = {**found, **new}
+    if not keys:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack([found[k] for k in keys])
@@ -0,0 +1,178 @@
+import re
+import json
+from collections import Counter
+from functools import lru_cache
+from common.metrics import count
+
+# Most transactions repeat a merchant that has been labeled before, so they
+# can be labeled by looking their (normalized) description up, before any
+# embedding or similarity work. Descriptions are looked up exactly among the
+# hand labeled ones, then by the longest matching prefix rule; only the
+# rest need the embedding classifiers.
+
+STATES = {"al", "ak", "az", "ar", "ca", "co", "ct", "de", "dc", "fl", "ga", "hi",
+          "id", "il", "in", "ia", "ks", "ky", "la", "me", "md", "ma", "mi", "mn",
+          "ms", "mo", "mt", "ne", "nv", "nh", "nj", "nm", "ny", "nc", "nd", "oh",
+          "ok", "or", "pa", "ri", "sc", "sd", "tn", "tx", "ut", "vt", "va", "wa",
+          "wv", "wi", "wy"}
+# payment processors put in front of the merchant, like "SQ *", "TST* " or
+# "PAYPAL *" (only dropped before a "*", so "PAYPAL TRANSFER" stays)
+PROCESSOR_RE = re.compile(r"^\s*(?:sq|tst|paypal|pp|sp|py|dd|ic|gglpay|google|apl|bt|in)\s*\*\s*")
+# separators, and store numbers like "#123"
+SEP_RE = re.compile(r"[*#\\]")
+# a state attached with a backslash, "STEAM GAMES\WA", comes without a city
+NO_CITY_RE = re.compile(r"\\[a-z]{2}\s*$")
+# first words of two word cities ("san jose"), and last words of cities
+# that have another word before them ("palm springs")
+CITY_FIRST = {"san", "santa", "los", "las", "el", "new", "north", "south", "east",
+              "west", "fort", "ft", "st", "saint", "mount", "mt", "port", "palm", "salt"}
+CITY_LAST = {"city", "beach", "springs", "park", "falls", "heights", "valley",
+             "lake", "hills", "island", "harbor", "village", "creek"}
+
+
+def merchant_words(text):
+    """Lower case words of a description or rule, without a processor prefix."""
+    return SEP_RE.sub(" ", PROCESSOR_RE.sub("", str(text).lower())).split()
+
+
+def strip_city(words):
+    """words without a trailing state code and the city before it, keeping
+    at least one word."""
+    if len(words) < 2 or words[-1] not in STATES:
+        return words
+    words = words[:-1]
+    n = 1
+    if len(words) > 2 and words[-1] in CITY_LAST:
+        n = 2
+    if len(words) > n + 1 and words[-n - 1] in CITY_FIRST:
+        n += 1
+    return words[:-n] if len(words) > n else words
+
+
+@lru_cache(maxsize=65_536)
+def normalize_descr(descr):
+    """The merchant part of a transaction description: lower case, without
+    a processor prefix, cut before the first word after the first that has
+    a digit in it (store numbers, phone numbers, then usually the city),
+    and without a trailing state code and city.
+    "STARBUCKS STORE 01234 SEATTLE WA" -> "starbucks store",
+    "SQ *BLUE BOTTLE COFFEE OAKLAND CA" -> "blue bottle coffee".
+    Cities are the word before the state, or two or three for ones like
+    "san jose" or "salt lake city" (CITY_FIRST and CITY_LAST).
+    Memoized, since descriptions repeat.
+    """
+    words = merchant_words(NO_CITY_RE.sub("", str(descr).lower()))
+    for i, w in enumerate(words[1:], start=1):
+        if any(c.isdigit() for c in w):
+            return " ".join(words[:i])
+    return " ".join(strip_city(words))
+
+
+class PrefixTrie:
+    """Labels keyed by word prefixes: a description matches the longest key
+    its words start with."""
+    def __init__(self):
+        self.root = {}
+
+    def insert(self, key, label):
+        node = self.root
+        for w in key.split():
+            node = node.setdefault(w, {})
+        node[None] = label
+
+    def longest_match(self, text):
+        node, label = self.root, None
+        for w in text.split():
+            node = node.get(w)
+            if node is None:
+                break
+            label = node.get(None, label)
+        return label
+
+    def __len__(self):
+        stack, n = [self.root], 0
+        while stack:
+            node = stack.pop()
+            n += None in node
+            stack.extend(v for k, v in node.items() if k is not None)
+        return n
+
+
+class FastClassifier:
+    """Exact and rule matches on normalized descriptions.
+    exact - {normalized description: label}, from hand labeled transactions
+    rules - PrefixTrie of {normalized prefix: label}, from a rules json
+            ({label: [prefixes]}, like the labels json)
+    `hits` and `rows` count what `classify` has matched so far.
+    """
+    def __init__(self, exact=None, rules=None):
+        self.exact = exact or {}
+        self.rules = rules or PrefixTrie()
+        self.hits = 0
+        self.rows = 0
+
+    @classmethod
+    def from_files(cls, labeled_fp=None, rules_fp=None, lab_col="label", sep="|",
+                   min_agree=0.8):
+        """Build from a hand labeled table (descr and `lab_col` columns) and/or
+        a rules json. A description labeled differently at different times
+        keeps its most common label if at least `min_agree` of its labels
+        agree, else it is left to the embedding classifiers."""
+        exact = {}
+        if labeled_fp is not None:
+            from .stream import iter_table
+            votes = {}
+            for chunk in iter_table(labeled_fp, sep=sep, usecols=["descr", lab_col], dtype=str):
+                chunk = chunk.dropna()
+                for d, l in zip(chunk["descr"], chunk[lab_col]):
+                    votes.setdefault(normalize_descr(d), Counter())[l] += 1
+            for key, c in votes.items():
+                label, n = c.most_common(1)[0]
+                if key and n >= min_agree * sum(c.values()):
+                    exact[key] = label
+        rules = PrefixTrie()
+        if rules_fp is not None:
+            with open(rules_fp, "r") as f:
+                for label, prefixes in json.load(f).items():
+                    for p in prefixes:
+                        key = " ".join(merchant_words(p))
+                        if key:
+                            rules.insert(key, label)
+        return cls(exact, rules)
+
+    def lookup(self, descr):
+        """(label, source) for one description, source being "exact" or
+        "rule", or (None, None) if it has to be classified otherwise."""
+        key = normalize_descr(descr)
+        label = self.exact.get(key)
+        if label is not None:
+            return label, "exact"
+        label = self.rules.longest_match(key)
+        if label is not None:
+            return label, "rule"
+        return None, None
+
+    def classify(self, descrs):
+        """Look up each description (each distinct one once).
+        Returns (labels, sources), object arrays with None where there was no
+        match."""
+        import numpy as np
+        import pandas as pd
+        descrs = pd.Series(descrs, dtype=object).fillna("")
+        codes, uniq = pd.factorize(descrs)
+        found = [self.lookup(d) for d in uniq]
+        labels = np.array([l for l, _ in found], dtype=object)[codes]
+        sources = np.array([s for _, s in found], dtype=object)[codes]
+        hits = int(np.count_nonzero(sources != None)) # noqa: E711 (elementwise)
+        self.rows += len(labels)
+        self.hits += hits
+        count("fastpath.rows", len(labels))
+        count("fastpath.hits", hits)
+        return labels, sources
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.rows if self.rows else float("nan")
+
+    def __len__(self):
+        return len(self.exact) + len(self.rules)
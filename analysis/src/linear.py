@@ -0,0 +1,136 @@
+import numpy as np
+from .classify import normalize_rows
+from common.metrics import timer, count
+
+
+class SoftmaxClassifier:
+    """Multinomial logistic regression on (normalized) embeddings, trained
+    online with `partial_fit` a batch at a time, in pure NumPy.
+    Steps are AdaGrad on minibatches, so learning rates settle per weight
+    and later batches refine rather than overwrite the model. Labels can be
+    added at any time: a label seen for the first time gets a new (zero)
+    row of weights. The ids of the rows trained on are kept with their
+    labels (e.g. txn_ids of hand labeled transactions), so updates can skip
+    rows seen before and tell when a label they learned has changed.
+    """
+    def __init__(self, dim, lr=0.5, l2=1e-5, batch_size=256, seed=0):
+        self.dim = dim
+        self.lr = lr
+        self.l2 = l2
+        self.batch_size = batch_size
+        self.seed = seed
+        self.labels = np.array([], dtype=object)
+        self.ids = np.array([], dtype=np.int64)
+        self.id_labels = np.array([], dtype=object)
+        self.W = np.zeros((0, dim), dtype=np.float32)
+        self.b = np.zeros(0, dtype=np.float32)
+        # AdaGrad's running sums of squared gradients
+        self._gW = np.zeros((0, dim), dtype=np.float32)
+        self._gb = np.zeros(0, dtype=np.float32)
+        self.n_seen = 0
+
+    def __len__(self):
+        return len(self.labels)
+
+    def label_index(self, labels, add=False):
+        """Index of each label in self.labels (-1 if unknown), adding new
+        labels first if `add`."""
+        labels = np.asarray(labels, dtype=object)
+        if add:
+            new = [l for l in dict.fromkeys(labels) if l not in set(self.labels)]
+            if new:
+                self.labels = np.concatenate([self.labels, np.asarray(new, dtype=object)])
+                pad = np.zeros((len(new), self.dim), dtype=np.float32)
+                self.W = np.vstack([self.W, pad])
+                self._gW = np.vstack([self._gW, pad])
+                self.b = np.concatenate([self.b, np.zeros(len(new), np.float32)])
+                self._gb = np.concatenate([self._gb, np.zeros(len(new), np.float32)])
+        lookup = {l: i for i, l in enumerate(self.labels)}
+        return np.array([lookup.get(l, -1) for l in labels], dtype=np.int64)
+
+    def _proba(self, x):
+        z = x @ self.W.T + self.b
+        z -= z.max(axis=1, keepdims=True)
+        p = np.exp(z)
+        return p / p.sum(axis=1, keepdims=True)
+
+    def partial_fit(self, vectors, labels, ids=None, epochs=1):
+        """Train on one batch of vectors and their labels, `epochs` passes
+        in shuffled minibatches. Returns the mean log loss of the last pass."""
+        x = normalize_rows(vectors)
+        y = self.label_index(labels, add=True)
+        if ids is not None:
+            self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+            self.id_labels = np.concatenate([self.id_labels, np.asarray(labels, dtype=object)])
+        rng = np.random.default_rng(self.seed + self.n_seen)
+        count("linear.fit_rows", len(x) * epochs)
+        loss = 0.0
+        with timer("linear.fit"):
+            for _ in range(epochs):
+                loss = 0.0
+                order = rng.permutation(len(x))
+                for start in range(0, len(x), self.batch_size):
+                    sel = order[start:start + self.batch_size]
+                    xb, yb = x[sel], y[sel]
+                    p = self._proba(xb)
+                    rows = np.arange(len(sel))
+                    loss += -np.log(np.maximum(p[rows, yb], 1e-12)).sum()
+                    p[rows, yb] -= 1.0 # d(loss)/dz
+                    p /= len(sel)
+                    gW = p.T @ xb + self.l2 * self.W
+                    gb = p.sum(axis=0)
+                    self._gW += gW * gW
+                    self._gb += gb * gb
+                    self.W -= self.lr * gW / (np.sqrt(self._gW) + 1e-8)
+                    self.b -= self.lr * gb / (np.sqrt(self._gb) + 1e-8)
+                loss /= max(len(x), 1)
+        self.n_seen += len(x)
+        return loss
+
+    def predict(self, vectors, chunksize=65_536):
+        """Label each row of `vectors`, `chunksize` rows at a time (so they
+        can be memory mapped). Returns (labels, scores), where the score is
+        the predicted label's probability. Labels are None if the model
+        hasn't been trained yet."""
+        n = vectors.shape[0]
+        count("linear.predict_rows", n)
+        out = np.empty(n, dtype=object)
+        scores = np.zeros(n, dtype=np.float32)
+        if len(self) == 0:
+            return out, scores
+        with timer("linear.predict"):
+            for start in range(0, n, chunksize):
+                p = self._proba(normalize_rows(vectors[start:start + chunksize]))
+                best = np.argmax(p, axis=1)
+                out[start:start + len(p)] = self.labels[best]
+                scores[start:start + len(p)] = p[np.arange(len(p)), best]
+        return out, scores
+
+    def accuracy(self, vectors, labels):
+        """Share of `labels` predicted correctly."""
+        pred, _ = self.predict(vectors)
+        return float(np.mean(pred == np.asarray(labels, dtype=object))) if len(pred) else float("nan")
+
+    def save(self, path):
+        np.savez(path,
+                 W=self.W, b=self.b, gW=self._gW, gb=self._gb,
+                 labels=self.labels.astype(str),
+                 ids=self.ids,
+                 id_labels=self.id_labels.astype(str),
+                 params=np.array([self.lr, self.l2, self.batch_size, self.seed, self.n_seen],
+                                 dtype=np.float64))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as f:
+            lr, l2, batch_size, seed, n_seen = f["params"].tolist()
+            clf = cls(f["W"].shape[1], lr=lr, l2=l2, batch_size=int(batch_size), seed=int(seed))
+            clf.W, clf.b = f["W"], f["b"]
+            clf._gW, clf._gb = f["gW"], f["gb"]
+            clf.labels = f["labels"].astype(object)
+            clf.ids = f["ids"].astype(np.int64)
+            # (models saved before the labels of the ids were kept have none)
+            clf.id_labels = f["id_labels"].astype(object) if "id_labels" in f.files \
+                else np.full(len(clf.ids), None, dtype=object)
+            clf.n_seen = int(n_seen)
+        return clf
@@ -0,0 +1,76 @@
+import json
+import random
+import hashlib
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# A local stand-in for the OpenAI /embeddings endpoint, for trying the
+# embedding client without an API key or network.
+# Run from the analysis directory: python -m src.mock_server --port 8089
+# then set OPENAI_API_BASE=http://127.0.0.1:8089
+
+
+def fake_embedding(text, dim):
+    """Deterministic unit vector for a text, so the same text always gets the
+    same embedding."""
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+    rng = random.Random(seed)
+    v = [rng.gauss(0, 1) for _ in range(dim)]
+    norm = sum(x * x for x in v) ** 0.5
+    return [x / norm for x in v]
+
+
+def make_handler(dim=1536, fail_rate=0.0, max_inputs=2048):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/embeddings"):
+                return self._send(404, {"error": {"message": "not found"}})
+            if fail_rate and random.random() < fail_rate:
+                return self._send(429, {"error": {"message": "rate limited"}},
+                                  headers={"Retry-After": "0.01"})
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            inputs = body.get("input", [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            if len(inputs) > max_inputs or any(i == "" for i in inputs):
+                return self._send(400, {"error": {"message": "invalid input"}})
+            self._send(200, {
+                "object": "list",
+                "model": body.get("model"),
+                "data": [{"object": "embedding", "index": i,
+                          "embedding": fake_embedding(t, dim)}
+                         for i, t in enumerate(inputs)],
+                "usage": {"prompt_tokens": sum(len(t) // 4 for t in inputs),
+                          "total_tokens": sum(len(t) // 4 for t in inputs)}
+            })
+
+        def _send(self, code, obj, headers=None):
+            out = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(out)
+
+        def log_message(self, *args):
+            pass
+    return Handler
+
+
+def serve(host="127.0.0.1", port=8089, dim=1536, fail_rate=0.0):
+    server = ThreadingHTTPServer((host, port), make_handler(dim, fail_rate))
+    print(f"Mock embedding server on http://{host}:{server.server_port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI embedding server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--fail-rate", type=float, default=0.0,
+                        help="Fraction of requests answered with HTTP 429, to exercise retries.")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.dim, args.fail_rate)
@@ -0,0 +1,229 @@
+import json
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from .classify import label_matrix, classify_batch
+from .embed_cache import embed_cached, normalize_text
+from common.metrics import METRICS, timer, count
+
+# A local classification service: the label matrix, classifiers and
+# embeddings stay loaded between requests, so labeling a statement's
+# transactions takes one HTTP round trip instead of a script starting up,
+# importing numpy/pandas and reloading everything.
+#   POST /classify  {"texts": [...]} -> {"results": [{"label", "score", "source", ...}]}
+#   GET  /stats     request latency percentiles, throughput and METRICS
+#   GET  /health
+# Requests arriving together are classified as one batch (see MicroBatcher).
+# Start it with analysis/serve_classify.py.
+
+
+class WarmClassifier:
+    """Labels descriptions with everything kept in memory.
+    Descriptions are looked up in `fast` (a src.fastpath.FastClassifier)
+    first; the rest are embedded with `backend`, through an in memory table
+    of the embeddings seen so far and then the SQLite cache at `cache_fp`,
+    and labeled by `linear` (a src.linear.SoftmaxClassifier) if given, else
+    by cosine similarity with the label embeddings `lab_embs`.
+    Not thread safe: the MicroBatcher calls it from its one worker thread.
+    """
+    def __init__(self, lab_embs, backend, cache_fp=None, fast=None, linear=None,
+                 top_k=3, max_memo=200_000):
+        self.labels, self.lab_mat = label_matrix(lab_embs)
+        self.backend = backend
+        self.cache_fp = cache_fp
+        self.fast = fast
+        self.linear = linear
+        self.top_k = top_k
+        self.max_memo = max_memo
+        self.memo = {}
+        self._cache = None
+
+    def embed(self, texts):
+        """Embeddings of texts, embedding only the ones not seen before."""
+        if self._cache is None and self.cache_fp is not None and self.backend.cacheable:
+            # sqlite connections belong to the thread that opened them
+            from .embed_cache import EmbeddingCache
+            self._cache = EmbeddingCache(self.cache_fp)
+        keys = [normalize_text(t) for t in texts]
+        todo = list(dict.fromkeys(k for k in keys if k not in self.memo))
+        count("service.memo_hits", len(keys) - len(todo))
+        if todo:
+            if len(self.memo) + len(todo) > self.max_memo:
+                self.memo.clear()
+            self.memo.update(zip(todo, embed_cached(todo, self.backend, self._cache)))
+        return np.stack([self.memo[k] for k in keys])
+
+    def classify(self, texts):
+        """A result dict per text: label, score (cosine similarity or
+        probability, None for a lookup) and source ("exact", "rule",
+        "linear" or "embedding"), plus the top_k labels and their scores
+        for embedding matches."""
+        results = [None] * len(texts)
+        miss = np.arange(len(texts))
+        if self.fast is not None:
+            fast_labels, sources = self.fast.classify(texts)
+            for i in np.flatnonzero(sources != None): # noqa: E711 (elementwise)
+                results[i] = {"label": fast_labels[i], "score": None, "source": sources[i]}
+            miss = np.flatnonzero(sources == None) # noqa: E711
+        if len(miss):
+            emb = self.embed([texts[i] for i in miss])
+            if self.linear is not None:
+                labels, scores = self.linear.predict(emb)
+                for i, lab, s in zip(miss, labels, scores):
+                    results[i] = {"label": lab, "score": float(s), "source": "linear"}
+            else:
+                top_labels, top_sims, _ = classify_batch(emb, self.labels, self.lab_mat,
+                                                         top_k=self.top_k)
+                for i, labs, sims in zip(miss, top_labels, top_sims):
+                    results[i] = {"label": labs[0], "score": float(sims[0]), "source": "embedding",
+                                  "labels": labs.tolist(), "scores": sims.tolist()}
+        return results
+
+
+class MicroBatcher:
+    """Collects the texts of concurrent requests and runs `fn` on them as one
+    batch, from a single worker thread. A batch takes every request queued
+    while the previous one ran, up to `max_batch` texts, and waits up to
+    `max_wait` seconds after its first request for more (0: never waits, so
+    a lone request isn't delayed and batches grow only under load).
+    `fn(texts)` returns one result per text.
+    """
+    def __init__(self, fn, max_batch=4096, max_wait=0.0, keep=10_000):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        # (finish time, seconds, texts) of recent requests, for `stats`
+        self.latencies = deque(maxlen=keep)
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, texts):
+        """Queue texts, returning a Future of their results."""
+        fut = Future()
+        self.queue.put((list(texts), fut, time.perf_counter()))
+        return fut
+
+    def __call__(self, texts, timeout=None):
+        t0 = time.perf_counter()
+        out = self.submit(texts).result(timeout)
+        secs = time.perf_counter() - t0
+        with self._lock:
+            self.latencies.append((time.time(), secs, len(texts)))
+        count("service.requests")
+        count("service.texts", len(texts))
+        return out
+
+    def _run(self):
+        while True:
+            items = [self.queue.get()]
+            n = len(items[0][0])
+            deadline = time.perf_counter() + self.max_wait
+            while n < self.max_batch:
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                items.append(item)
+                n += len(item[0])
+            texts = [t for item in items for t in item[0]]
+            count("service.batches")
+            try:
+                with timer("service.batch"):
+                    results = self.fn(texts)
+            except Exception as e:
+                for _, fut, _ in items:
+                    fut.set_exception(e)
+                continue
+            start = 0
+            for item_texts, fut, _ in items:
+                fut.set_result(results[start:start + len(item_texts)])
+                start += len(item_texts)
+
+    def stats(self, window=60.0):
+        """Latency percentiles (ms) of the recent requests, and requests and
+        texts per second over the last `window` seconds."""
+        with self._lock:
+            lat = list(self.latencies)
+        now = time.time()
+        recent = [l for l in lat if l[0] >= now - window]
+        secs = np.array([l[1] for l in lat]) * 1000
+        span = min(window, now - self.started) or 1.0
+        out = {"requests": len(lat),
+               "requests_per_s": len(recent) / span,
+               "texts_per_s": sum(l[2] for l in recent) / span}
+        for p in (50, 95, 99):
+            out[f"p{p}_ms"] = float(np.percentile(secs, p)) if len(secs) else None
+        return out
+
+
+def make_handler(batcher, max_texts=100_000):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path.rstrip("/") != "/classify":
+                return self._send(404, {"error": "not found"})
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                texts = body["texts"]
+                if isinstance(texts, str):
+                    texts = [texts]
+                if not isinstance(texts, list) or len(texts) > max_texts:
+                    raise ValueError(f"texts must be a list of at most {max_texts} strings")
+                texts = ["" if t is None else str(t) for t in texts]
+            except (ValueError, KeyError, TypeError) as e:
+                return self._send(400, {"error": str(e)})
+            try:
+                results = batcher(texts) if texts else []
+            except Exception as e:
+                return self._send(500, {"error": f"{type(e).__name__}: {e}"})
+            self._send(200, {"results": results})
+
+        def do_GET(self):
+            path = self.path.rstrip("/")
+            if path == "/health":
+                return self._send(200, {"ok": True})
+            if path == "/stats":
+                return self._send(200, {"service": batcher.stats(), "metrics": METRICS.snapshot()})
+            self._send(404, {"error": "not found"})
+
+        def _send(self, code, obj):
+            out = json.dumps(obj, default=str).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+        def log_message(self, *args):
+            pass
+    return Handler
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 drops connections from bursts of clients
+    request_queue_size = 128
+
+
+def make_server(classifier, host="127.0.0.1", port=8090, max_batch=4096, max_wait=0.0):
+    """An HTTP server for a WarmClassifier (call serve_forever() to run it).
+    Its MicroBatcher is server.batcher."""
+    batcher = MicroBatcher(classifier.classify, max_batch=max_batch, max_wait=max_wait)
+    server = Server((host, port), make_handler(batcher))
+    server.batcher = batcher
+    return server
+
+
+def classify_remote(texts, url="http://127.0.0.1:8090", timeout=60):
+    """Classify texts with a running service. Returns its result dicts."""
+    from urllib.request import Request, urlopen
+    req = Request(url.rstrip("/") + "/classify", data=json.dumps({"texts": list(texts)}).encode(),
+                  headers={"Content-Type": "application/json"})
+    with urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read())["results"]
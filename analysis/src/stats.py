@@ -0,0 +1,253 @@
+import sys
+import hashlib
+import sqlite3
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from .stream import DEFAULT_CHUNKSIZE
+from common.metrics import timer, count
+
+# Spending rollups by label x year/month/week, kept in a small SQLite cube.
+# Each transaction is read once: rows are summed per (label, day) and every
+# grain is rolled up from those daily sums. The cube stores sums (count,
+# sum, sum of squares, min, max) so new transactions are simply added in,
+# and means/stds are worked out when the cube is queried.
+
+GRAINS = ("year", "month", "week")
+ALL_LABELS = "*"        # label of the rows summing all labels
+UNLABELED = "unlabeled" # label of transactions without one
+
+
+def periods(dates, grain):
+    """Period keys of datetimes: '2023', '2023-08' or ISO weeks like '2023-W05'."""
+    if grain == "year":
+        return dates.dt.strftime("%Y")
+    if grain == "month":
+        return dates.dt.strftime("%Y-%m")
+    if grain == "week":
+        iso = dates.dt.isocalendar()
+        return iso["year"].astype(str) + "-W" + iso["week"].astype(str).str.zfill(2)
+    raise ValueError(f"grain must be one of {GRAINS}")
+
+
+def daily_sums(df, label_col="label"):
+    """Per (label, day) sums of a chunk of transactions, in one groupby with
+    the label as a categorical."""
+    date = pd.to_datetime(df["date"], errors="coerce")
+    amount = pd.to_numeric(df["amount"], errors="coerce")
+    d = pd.DataFrame({
+        "label": df[label_col].fillna(UNLABELED).astype(str).astype("category")
+                 if label_col in df.columns else pd.Categorical([UNLABELED] * len(df)),
+        "day": date.dt.normalize(),
+        "amount": amount,
+        "amount_sq": amount ** 2
+    }).loc[date.notna().to_numpy()]
+    return d.groupby(["label", "day"], observed=True).agg(
+        n=("label", "size"),
+        amount_n=("amount", "count"),
+        amount_sum=("amount", "sum"),
+        amount_sq=("amount_sq", "sum"),
+        amount_min=("amount", "min"),
+        amount_max=("amount", "max")
+    ).reset_index()
+
+
+def rollup(daily):
+    """Roll daily sums up to every grain, per label and for all labels.
+    Returns a frame with columns grain, period, label and the sums."""
+    daily = daily.assign(label=daily["label"].astype(str))
+    sums = {"n": "sum", "amount_n": "sum", "amount_sum": "sum", "amount_sq": "sum",
+            "amount_min": "min", "amount_max": "max"}
+    out = []
+    for grain in GRAINS:
+        d = daily.assign(period=periods(daily["day"], grain))
+        by_label = d.groupby(["period", "label"]).agg(sums).reset_index()
+        total = d.groupby("period").agg(sums).reset_index().assign(label=ALL_LABELS)
+        out.append(pd.concat([by_label, total]).assign(grain=grain))
+    cols = ["grain", "period", "label", *sums]
+    if not out:
+        return pd.DataFrame(columns=cols)
+    return pd.concat(out, ignore_index=True)[cols]
+
+
+def finish(sums):
+    """Means and standard deviations (ddof=1) from summed rollups."""
+    n = sums["amount_n"].where(sums["amount_n"] > 0)
+    var = (sums["amount_sq"] - sums["amount_sum"] ** 2 / n) / (n - 1).where(n > 1)
+    out = sums.drop(columns=["amount_sq", "amount_n"])
+    out["amount_sum"] = out["amount_sum"].round(2) # sums of cents, without float noise
+    out.insert(out.columns.get_loc("amount_sum") + 1, "amount_mean", sums["amount_sum"] / n)
+    out.insert(out.columns.get_loc("amount_mean") + 1, "amount_std", np.sqrt(var.clip(lower=0)))
+    return out
+
+
+class StatsCube:
+    """Rollups persisted in SQLite, kept up to date as transactions are added.
+    Rollups are kept per source, so one source can be rebuilt without the
+    others: `update(fp)` only reads the rows appended to a file since it was
+    last read, and starts that file over if its earlier part changed.
+    """
+    def __init__(self, path):
+        self.path = str(path)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS rollups (
+                source TEXT NOT NULL,
+                grain TEXT NOT NULL,
+                period TEXT NOT NULL,
+                label TEXT NOT NULL,
+                n INTEGER NOT NULL,
+                amount_n INTEGER NOT NULL,
+                amount_sum REAL NOT NULL,
+                amount_sq REAL NOT NULL,
+                amount_min REAL,
+                amount_max REAL,
+                PRIMARY KEY (source, grain, period, label)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS sources (
+                path TEXT PRIMARY KEY,
+                bytes INTEGER NOT NULL,
+                sha TEXT NOT NULL
+            );
+        """)
+        self.conn.commit()
+
+    def add(self, df, label_col="label", source="", commit=True):
+        """Add a frame of transactions (date, amount and label columns)."""
+        r = rollup(daily_sums(df, label_col))
+        r.insert(0, "source", source)
+        self.conn.executemany("""
+            INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (source, grain, period, label) DO UPDATE SET
+                n = n + excluded.n,
+                amount_n = amount_n + excluded.amount_n,
+                amount_sum = amount_sum + excluded.amount_sum,
+                amount_sq = amount_sq + excluded.amount_sq,
+                amount_min = min(coalesce(amount_min, excluded.amount_min), coalesce(excluded.amount_min, amount_min)),
+                amount_max = max(coalesce(amount_max, excluded.amount_max), coalesce(excluded.amount_max, amount_max))
+        """, (tuple(None if pd.isna(v) else v for v in row)
+              for row in r.astype(object).itertuples(index=False)))
+        if commit:
+            self.conn.commit()
+        return len(df)
+
+    def clear(self, source=None):
+        """Remove one source's rollups, or everything."""
+        if source is None:
+            self.conn.execute("DELETE FROM rollups")
+            self.conn.execute("DELETE FROM sources")
+        else:
+            self.conn.execute("DELETE FROM rollups WHERE source = ?", (source,))
+            self.conn.execute("DELETE FROM sources WHERE path = ?", (source,))
+        self.conn.commit()
+
+    def update(self, fp, sep="|", label_col="label", chunksize=DEFAULT_CHUNKSIZE):
+        """Add the transactions appended to the delimited file at fp since the
+        last update, or rebuild the cube from it if the file was rewritten.
+        Returns the number of transactions added.
+        """
+        fp = Path(fp)
+        key = str(fp.resolve())
+        row = self.conn.execute("SELECT bytes, sha FROM sources WHERE path = ?", (key,)).fetchone()
+        size = fp.stat().st_size
+        start = 0
+        if row is not None and row[0] <= size and _head_sha(fp, row[0]) == row[1]:
+            start = row[0]
+        else:
+            self.clear(key)
+        n = 0
+        with open(fp, "rb") as f:
+            header = f.readline().decode().rstrip("\r\n").split(sep)
+            if start > 0:
+                f.seek(start)
+            if start < size:
+                with timer("stats.update"):
+                    for chunk in pd.read_csv(f, sep=sep, names=header, chunksize=chunksize,
+                                             usecols=[c for c in ("date", "amount", label_col) if c in header]):
+                        n += self.add(chunk, label_col, source=key, commit=False)
+        count("stats.rows", n)
+        self.conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?)",
+                          (key, size, _head_sha(fp, size)))
+        self.conn.commit()
+        return n
+
+    def query(self, grain="month", by_label=True, labels=None, start=None, end=None):
+        """Rollups for one grain, oldest period first: per label if by_label,
+        else over all labels. Optionally only some labels, and periods from
+        start to end (inclusive, in the grain's key format, e.g. '2023-08')."""
+        if grain not in GRAINS:
+            raise ValueError(f"grain must be one of {GRAINS}")
+        sql = ("SELECT period, label, SUM(n) AS n, SUM(amount_n) AS amount_n,"
+               " SUM(amount_sum) AS amount_sum, SUM(amount_sq) AS amount_sq,"
+               " MIN(amount_min) AS amount_min, MAX(amount_max) AS amount_max"
+               " FROM rollups WHERE grain = ? AND label " + ("!= ?" if by_label else "= ?"))
+        params = [grain, ALL_LABELS]
+        if labels is not None:
+            labels = list(labels)
+            sql += f" AND label IN ({','.join('?' * len(labels))})"
+            params += labels
+        if start is not None:
+            sql += " AND period >= ?"
+            params.append(str(start))
+        if end is not None:
+            sql += " AND period <= ?"
+            params.append(str(end))
+        sql += " GROUP BY period, label ORDER BY period, label"
+        sums = pd.read_sql_query(sql, self.conn, params=params)
+        out = finish(sums).rename(columns={"period": grain})
+        if not by_label:
+            out = out.drop(columns="label")
+        return out
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _head_sha(fp, n_bytes):
+    """Hash of the first n_bytes of a file."""
+    h = hashlib.sha256()
+    with open(fp, "rb") as f:
+        while n_bytes > 0:
+            block = f.read(min(2**20, n_bytes))
+            if not block:
+                break
+            h.update(block)
+            n_bytes -= len(block)
+    return h.hexdigest()
+
+
+def export(df, fp=None, fmt=None):
+    """Write a stats table to fp, or stdout if fp is None or '-'. The format
+    is taken from the file extension (csv, tsv, json, parquet, txt) unless
+    given, txt being an aligned plain text table."""
+    if fp is None or str(fp) == "-":
+        fmt = fmt or "csv"
+        out = sys.stdout
+    else:
+        fmt = fmt or Path(fp).suffix.lstrip(".") or "csv"
+        out = fp
+    if fmt == "csv":
+        df.to_csv(out, index=False)
+    elif fmt == "tsv":
+        df.to_csv(out, sep="\t", index=False)
+    elif fmt == "json":
+        df.to_json(out, orient="records", indent=1)
+    elif fmt == "parquet":
+        if out is sys.stdout:
+            raise ValueError("parquet can't be written to stdout")
+        df.to_parquet(out, index=False)
+    elif fmt == "txt":
+        text = df.to_string(index=False)
+        if out is sys.stdout:
+            print(text)
+        else:
+            Path(out).write_text(text + "\n")
+    else:
+        raise ValueError(f"unknown format '{fmt}', use csv, tsv, json, parquet or txt")
@@ -0,0 +1,144 @@
+import os
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from numpy.lib.format import open_memmap
+from .emb_store import emb_paths, parse_emb_strings
+
+# Process a transaction table (and its embeddings) in fixed size batches, so
+# memory stays bounded by the batch size however much data has accumulated,
+# and write results out batch by batch.
+
+DEFAULT_CHUNKSIZE = 100_000
+
+
+def iter_table(fp, sep="|", chunksize=DEFAULT_CHUNKSIZE, **kwargs):
+    """Yield the rows of a delimited table as dataframes of up to chunksize rows."""
+    yield from pd.read_csv(fp, sep=sep, chunksize=chunksize, **kwargs)
+
+
+def count_rows(fp, sep="|", chunksize=DEFAULT_CHUNKSIZE):
+    """Number of rows in a delimited table, reading one column at a time."""
+    return sum(len(c) for c in pd.read_csv(fp, sep=sep, usecols=[0], dtype=str,
+                                           chunksize=chunksize))
+
+
+def iter_batches(table_fp, sep="|", chunksize=DEFAULT_CHUNKSIZE, emb_col="descr_emb", **kwargs):
+    """Yield (df, emb) batches of a table saved with src.emb_store.save_embeddings:
+    up to chunksize rows and the matching rows of the (memory mapped)
+    embedding matrix, copied into memory. Legacy tables with stringified
+    embeddings in `emb_col` are parsed a batch at a time.
+    """
+    table_fp, emb_fp, ids_fp = emb_paths(table_fp)
+    if not emb_fp.exists():
+        for chunk in iter_table(table_fp, sep=sep, chunksize=chunksize, **kwargs):
+            yield chunk.drop(columns=emb_col), parse_emb_strings(chunk[emb_col].astype(str))
+        return
+    emb = np.load(emb_fp, mmap_mode="r")
+    ids = np.load(ids_fp, mmap_mode="r") if ids_fp.exists() else None
+    start = 0
+    for chunk in iter_table(table_fp, sep=sep, chunksize=chunksize, **kwargs):
+        end = start + len(chunk)
+        if end > emb.shape[0]:
+            raise ValueError(f"{emb_fp} has {emb.shape[0]} rows but {table_fp} has more")
+        if ids is not None and "row_id" in chunk.columns and \
+                not np.array_equal(ids[start:end], chunk["row_id"].to_numpy(dtype=np.int64)):
+            raise ValueError(f"{emb_fp} rows are not aligned with {table_fp}")
+        yield chunk, np.array(emb[start:end])
+        start = end
+    if start != emb.shape[0]:
+        raise ValueError(f"{emb_fp} has {emb.shape[0]} rows but {table_fp} has {start}")
+
+
+def chunk_writer(output_path, sep="|", columns=None):
+    """Returns (write, close) functions that append dataframe chunks to a
+    delimited file, or to a Parquet file if output_path ends in .parquet.
+    If nothing was written, close() writes just a header of `columns`."""
+    output_path = Path(output_path)
+    if output_path.suffix == ".parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        state = {"writer": None}
+        def write(df):
+            if state["writer"] is None:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                state["writer"] = pq.ParquetWriter(output_path, table.schema)
+            else:
+                table = pa.Table.from_pandas(df, schema=state["writer"].schema,
+                                             preserve_index=False)
+            state["writer"].write_table(table)
+        def close():
+            if state["writer"] is not None:
+                state["writer"].close()
+        return write, close
+
+    state = {"header": True}
+    def write(df):
+        df.to_csv(output_path, sep=sep, index=False,
+                  mode="w" if state["header"] else "a", header=state["header"])
+        state["header"] = False
+    def close():
+        if state["header"]: # nothing written
+            pd.DataFrame(columns=columns or []).to_csv(output_path, sep=sep, index=False)
+    return write, close
+
+
+class EmbeddingWriter:
+    """Write a table and its embeddings a batch at a time, in the format of
+    src.emb_store.save_embeddings. The number of rows has to be known up
+    front (see count_rows) so the .npy can be preallocated on disk.
+    Files are written next to the outputs and moved into place by close(),
+    so the output can also be the table the batches are read from.
+
+        with EmbeddingWriter(out_fp, n_rows) as w:
+            for df, emb in batches:
+                w.write(df, emb)
+    """
+    def __init__(self, table_fp, n_rows, sep="|"):
+        table_fp = Path(table_fp)
+        self.final = emb_paths(table_fp)
+        self.table_fp, self.emb_fp, self.ids_fp = emb_paths(
+            table_fp.with_name(table_fp.stem + ".tmp" + table_fp.suffix))
+        self.n_rows = n_rows
+        self.n = 0
+        self._write, self._close = chunk_writer(self.table_fp, sep=sep)
+        self._emb = None
+        self._ids = open_memmap(self.ids_fp, mode="w+", dtype=np.int64, shape=(n_rows,))
+
+    def write(self, df, emb):
+        emb = np.asarray(emb, dtype=np.float32)
+        if emb.shape[0] != len(df):
+            raise ValueError(f"{emb.shape[0]} embeddings for {len(df)} rows")
+        if self.n + len(df) > self.n_rows:
+            raise ValueError(f"more than the {self.n_rows} rows expected")
+        if self._emb is None:
+            self._emb = open_memmap(self.emb_fp, mode="w+", dtype=np.float32,
+                                    shape=(self.n_rows, emb.shape[1]))
+        ids = np.arange(self.n, self.n + len(df))
+        df = df.copy()
+        df["row_id"] = ids
+        self._write(df)
+        self._emb[self.n:self.n + len(df)] = emb
+        self._ids[self.n:self.n + len(df)] = ids
+        self.n += len(df)
+
+    def close(self):
+        self._close()
+        if self._emb is None:
+            np.save(self.emb_fp, np.zeros((0, 0), dtype=np.float32))
+        else:
+            self._emb.flush()
+        self._ids.flush()
+        self._emb = self._ids = None
+        if self.n != self.n_rows:
+            raise ValueError(f"wrote {self.n} rows but {self.n_rows} were expected")
+        for tmp, fp in zip((self.table_fp, self.emb_fp, self.ids_fp), self.final):
+            os.replace(tmp, fp)
+        return self.final[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
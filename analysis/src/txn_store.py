@@ -0,0 +1,296 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from common.metrics import timer, count
+
+# An append-only store of (labeled) transactions, so adding a statement only
+# writes its new rows instead of rewriting the whole history:
+#   index.json          - the segments in order, with their row counts and
+#                         date ranges, replaced atomically on every change
+#   seg_000001.txt      - a delimited table of transactions sorted by date,
+#                         never modified once written
+#   seg_000001.ids.npy  - the txn_id of each of its rows
+#   labels.txt          - labels set since the segments were written, as
+#                         appended (txn_id, label) lines, the last one of a
+#                         txn_id winning; folded into the segments by `compact`
+# A txn_id is a hash of the date, description, amount and how many times
+# the same transaction appeared before it that day, so the rows of
+# overlapping statements get the same ids and are only stored once.
+# Readers scan only the segments whose dates overlap the range asked for,
+# with the labels of labels.txt applied. Segments are merged into one by
+# `compact`.
+
+STORE_VERSION = 1
+LABEL_COL = "label"
+
+
+def txn_ids(df):
+    """int64 ids of the transactions in df (date, descr and amount columns)."""
+    # the same whether the columns were parsed (datetimes, floats) or not
+    amount = pd.to_numeric(df["amount"], errors="coerce").map("{:.2f}".format)
+    keys = df["date"].astype(str).str[:10] + "|" + df["descr"].astype(str) + "|" + amount
+    nth = keys.groupby(keys).cumcount().astype(str)
+    return np.array([int.from_bytes(hashlib.blake2b(k.encode(), digest_size=8).digest(),
+                                    "little", signed=True)
+                     for k in keys + "|" + nth], dtype=np.int64)
+
+
+def table_txn_ids(df):
+    """The txn_id column of a table exported from a store, or `txn_ids` for
+    tables without one (e.g. hand labeled before the store)."""
+    if "txn_id" in df.columns:
+        return df["txn_id"].to_numpy(dtype=np.int64)
+    return txn_ids(df)
+
+
+def last_by_id(ids, values):
+    """(sorted unique ids, the last of their values)."""
+    ids, last = np.unique(ids[::-1], return_index=True)
+    return ids, values[::-1][last]
+
+
+def lookup(ids, values, keys):
+    """(values of keys in the sorted unique `ids`, whether each was found)."""
+    if len(ids) == 0:
+        return np.full(len(keys), np.nan, dtype=object), np.zeros(len(keys), dtype=bool)
+    pos = np.minimum(np.searchsorted(ids, keys), len(ids) - 1)
+    found = ids[pos] == keys
+    return np.where(found, values[pos], np.nan), found
+
+
+class TransactionStore:
+    """Segmented, append-only transaction table in a directory.
+    `max_segments` is how many segments can pile up before `append` merges
+    them with `compact`.
+    """
+    def __init__(self, path, sep="|", max_segments=16):
+        self.path = Path(path)
+        self.sep = sep
+        self.max_segments = max_segments
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.path / "index.json", "r") as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return {"version": STORE_VERSION, "next_segment": 1, "segments": []}
+        if index.get("version") != STORE_VERSION:
+            raise ValueError(f"{self.path} was written by another version of the store")
+        return index
+
+    def _save_index(self):
+        tmp = self.path / f"index.json.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmp, self.path / "index.json")
+
+    def _seg_paths(self, name):
+        return self.path / f"{name}.txt", self.path / f"{name}.ids.npy"
+
+    @property
+    def labels_fp(self):
+        return self.path / "labels.txt"
+
+    @property
+    def segments(self):
+        return self.index["segments"]
+
+    def __len__(self):
+        return sum(s["rows"] for s in self.segments)
+
+    def ids(self):
+        """The txn_ids of every stored row."""
+        ids = [np.load(self._seg_paths(s["name"])[1]) for s in self.segments]
+        return np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+
+    def _write_segment(self, df, ids):
+        """Write rows (already sorted by date) as a new segment, returning its
+        index entry. The index isn't updated."""
+        name = f"seg_{self.index['next_segment']:06d}"
+        self.index["next_segment"] += 1
+        table_fp, ids_fp = self._seg_paths(name)
+        df.to_csv(table_fp, sep=self.sep, index=False)
+        np.save(ids_fp, ids)
+        dates = df["date"].astype(str).str[:10]
+        return {"name": name, "rows": len(df), "min_date": dates.min(), "max_date": dates.max()}
+
+    def columns(self):
+        """The columns of the stored rows (segments written before a column
+        was added don't have it)."""
+        cols = {}
+        for s in self.segments:
+            header = pd.read_csv(self._seg_paths(s["name"])[0], sep=self.sep, nrows=0)
+            cols.update(dict.fromkeys(header.columns))
+        if self.label_overlay() is not None:
+            cols.setdefault(LABEL_COL)
+        return list(cols)
+
+    def label_overlay(self):
+        """The labels set with `set_labels` since the last compaction, as
+        (sorted txn_ids, their labels, NaN where cleared), or None."""
+        if not self.labels_fp.exists():
+            return None
+        log = pd.read_csv(self.labels_fp, sep=self.sep, dtype={"txn_id": np.int64, LABEL_COL: str})
+        if len(log) == 0:
+            return None
+        return last_by_id(log["txn_id"].to_numpy(), log[LABEL_COL].to_numpy(dtype=object))
+
+    def _apply_labels(self, df, overlay):
+        if overlay is None:
+            return df
+        if LABEL_COL not in df.columns:
+            df = df.assign(**{LABEL_COL: np.nan})
+        labels, hit = lookup(*overlay, df["txn_id"].to_numpy(dtype=np.int64))
+        if hit.any():
+            df = df.astype({LABEL_COL: object})
+            df.loc[hit, LABEL_COL] = labels[hit]
+        return df
+
+    def set_labels(self, ids, labels):
+        """Label the stored transactions with txn_ids `ids` (None/NaN clears a
+        label) by appending to labels.txt, so no segment is rewritten.
+        Ids that aren't stored are skipped. Returns the number of labels set."""
+        ids = np.asarray(ids, dtype=np.int64)
+        labels = np.asarray(labels, dtype=object)
+        known = np.isin(ids, self.ids())
+        if not known.any():
+            return 0
+        with timer("store.set_labels"):
+            log = pd.DataFrame({"txn_id": ids[known], LABEL_COL: labels[known]})
+            new_file = not self.labels_fp.exists()
+            with open(self.labels_fp, "a") as f:
+                log.to_csv(f, sep=self.sep, index=False, header=new_file)
+                f.flush()
+                os.fsync(f.fileno())
+        count("store.labels_set", int(known.sum()))
+        return int(known.sum())
+
+    def labels(self):
+        """(sorted txn_ids, labels, NaN if unlabeled) of every stored row."""
+        ids, labels = [], []
+        for c in self.scan(columns=["txn_id", LABEL_COL]):
+            ids.append(c["txn_id"].to_numpy(dtype=np.int64))
+            labels.append(c[LABEL_COL].to_numpy(dtype=object) if LABEL_COL in c.columns
+                          else np.full(len(c), np.nan, dtype=object))
+        if not ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=object)
+        return last_by_id(np.concatenate(ids), np.concatenate(labels))
+
+    def import_labels(self, fp, sep=None):
+        """Set the labels of a table exported from the store (e.g. after
+        labeling it by hand) where they differ from the stored ones. Rows are
+        matched by their txn_id column, or by `txn_ids` if it has none; rows
+        that aren't stored are skipped, and other edits are ignored.
+        Returns the number of labels changed."""
+        df = pd.read_csv(fp, sep=sep or self.sep, dtype={LABEL_COL: str})
+        if LABEL_COL not in df.columns or len(df) == 0:
+            return 0
+        ids, edited = last_by_id(table_txn_ids(df), df[LABEL_COL].to_numpy(dtype=object))
+        stored, found = lookup(*self.labels(), ids)
+        edited_na, stored_na = pd.isna(edited), pd.isna(stored)
+        changed = found & ~((edited_na & stored_na) | (~edited_na & ~stored_na & (edited == stored)))
+        return self.set_labels(ids[changed], edited[changed])
+
+    def append(self, df):
+        """Add the transactions of df that aren't stored yet, as a new segment.
+        Returns the number of rows added."""
+        if len(df) == 0:
+            return 0
+        with timer("store.append"):
+            ids = txn_ids(df)
+            new = ~np.isin(ids, self.ids())
+            count("store.rows_seen", len(df))
+            if not new.any():
+                return 0
+            df, ids = df.loc[new], ids[new]
+            order = np.argsort(df["date"].astype(str).str[:10].to_numpy(), kind="stable")
+            df = df.iloc[order].assign(txn_id=ids[order])
+            self.segments.append(self._write_segment(df, ids[order]))
+            self._save_index()
+            count("store.rows_added", len(df))
+        if len(self.segments) > self.max_segments:
+            self.compact()
+        return len(df)
+
+    def scan(self, start=None, end=None, columns=None, chunksize=None):
+        """Yield the stored rows dated from `start` to `end` (inclusive ISO
+        dates, either can be None), a segment (or `chunksize` rows) at a
+        time, with the labels set since the last compaction. Only segments
+        whose date range overlaps are read."""
+        start, end = (None if d is None else str(pd.Timestamp(d).date()) for d in (start, end))
+        overlay = self.label_overlay()
+        want = columns
+        if columns is not None:
+            # the date to filter on, and the txn_id to apply the labels by
+            columns = ["date", *columns] + (["txn_id"] if overlay is not None else [])
+        for s in self.segments:
+            if (start is not None and s["max_date"] < start) or (end is not None and s["min_date"] > end):
+                continue
+            count("store.segments_read")
+            # (older segments can lack columns added later, e.g. labels)
+            usecols = None if columns is None else (lambda c: c in columns)
+            chunks = pd.read_csv(self._seg_paths(s["name"])[0], sep=self.sep, usecols=usecols,
+                                 chunksize=chunksize)
+            for chunk in ([chunks] if chunksize is None else chunks):
+                dates = chunk["date"].astype(str).str[:10]
+                keep = np.ones(len(chunk), dtype=bool)
+                if start is not None:
+                    keep &= (dates >= start).to_numpy()
+                if end is not None:
+                    keep &= (dates <= end).to_numpy()
+                if keep.any():
+                    chunk = chunk.loc[keep]
+                    if want is None or LABEL_COL in want:
+                        chunk = self._apply_labels(chunk, overlay)
+                    if want is not None:
+                        chunk = chunk[[c for c in chunk.columns if c in want or c == "date"]]
+                    yield chunk
+
+    def read(self, start=None, end=None, columns=None):
+        """The stored rows dated from `start` to `end` as one dataframe."""
+        chunks = list(self.scan(start, end, columns))
+        if not chunks:
+            return pd.DataFrame(columns=columns or [])
+        return pd.concat(chunks, ignore_index=True)
+
+    def max_date(self):
+        return max((s["max_date"] for s in self.segments), default=None)
+
+    def compact(self):
+        """Merge all segments into one sorted by date. The new segment is
+        written and put in the index before the old ones are removed, so the
+        store is readable at every step."""
+        if len(self.segments) < 2 and self.label_overlay() is None:
+            return
+        with timer("store.compact"):
+            old = list(self.segments)
+            df = pd.concat([pd.read_csv(self._seg_paths(s["name"])[0], sep=self.sep)
+                            for s in old], ignore_index=True)
+            df = df.iloc[np.argsort(df["date"].astype(str).str[:10].to_numpy(), kind="stable")]
+            # fold the labels in (applying them again after a crash here is harmless)
+            df = self._apply_labels(df, self.label_overlay())
+            self.index["segments"] = [self._write_segment(df, df["txn_id"].to_numpy(dtype=np.int64))]
+            self._save_index()
+            self.labels_fp.unlink(missing_ok=True)
+            for s in old:
+                for p in self._seg_paths(s["name"]):
+                    p.unlink(missing_ok=True)
+            count("store.compactions")
+
+    def export(self, fp, start=None, end=None, sep=None):
+        """Write the stored rows (from `start` to `end`), with their labels, to
+        one delimited file, streaming a segment at a time. The file is
+        replaced once complete."""
+        sep = sep or self.sep
+        columns = self.columns() or ["txn_id"]
+        tmp = Path(f"{fp}.{os.getpid()}.tmp")
+        pd.DataFrame(columns=columns).to_csv(tmp, sep=sep, index=False)
+        for chunk in self.scan(start, end):
+            chunk.reindex(columns=columns).to_csv(tmp, sep=sep, index=False, mode="a", header=False)
+        os.replace(tmp, fp)
+        return fp
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# backend_parity.py
+# Check the PDF extraction backends (src.extract) against each other on
+# synthetic statements: small PDFs written here with a known set of
+# transactions, laid out like a CapitalOne statement (account summary, a
+# "Trans Date" table continued across pages, footers). Each available
+# backend parses them through the same scraper and date fixing as
+# capital_one.py, and has to give exactly the known transactions.
+# tabula is only checked where it and a Java runtime are installed.
+# Exits 1 if a backend gets any statement wrong.
+#
+# Usage: python bench/backend_parity.py --statements 12 --rows 60
+
+import sys
+import time
+import shutil
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "parse"))
+import capital_one  # noqa: E402
+from src.extract import BACKENDS, get_backend  # noqa: E402
+
+MERCHANTS = ["STARBUCKS STORE 01234 SEATTLE WA", "AMAZON.COM*2K4 AMZN.COM/BILLWA",
+             "SAFEWAY #1234 PORTLAND OR", "SPOTIFY USA 877-778-1161 NY",
+             "UBER *TRIP HELP.UBER.COM CA", "COSTCO WHSE #0012 SEATTLE WA",
+             "TRADER JOE S #123 BOSTON MA", "SHELL OIL 57444 DENVER CO",
+             "NETFLIX.COM (800) 585-7265 CA", "PAYPAL *STEAM GAMES\\WA"]
+# (no descriptions containing a footer marker such as "capital one": the
+# scraper ends the table at them whichever backend read the rows)
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun",
+          "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+# x positions of the table columns, in points
+COLUMNS = [50, 110, 170, 480]
+ROWS_PER_PAGE = 40
+AREA = [0, 0, 2480, 3508]
+
+
+def pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path, pages, width=612, height=792, size=9):
+    """Write a minimal PDF of text lines in Helvetica. `pages` is a list of
+    pages, each a list of (x, y, text) with y in points from the top."""
+    objs = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+            "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        stream = "".join(f"BT /F1 {size} Tf {x} {height - y} Td ({pdf_escape(t)}) Tj ET\n"
+                         for x, y, t in lines).encode("latin-1")
+        objs.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"endstream")
+        objs.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}]"
+                    f" /Resources << /Font << /F1 3 0 R >> >> /Contents {len(objs)} 0 R >>")
+        kids.append(f"{len(objs)} 0 R")
+    objs[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objs, 1):
+        offsets.append(len(out))
+        body = obj if isinstance(obj, bytes) else obj.encode("latin-1")
+        out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs) + 1, xref)
+    Path(path).write_bytes(bytes(out))
+
+
+def synthetic_statement(n_rows, month, year, seed=0):
+    """Pages of a statement for the period ending in month/year, and its
+    transactions as (ISO date, description, amount). Transactions fall in
+    the month before and the month of the period end, so a January
+    statement has December charges from the year before."""
+    rng = random.Random(seed)
+    prev = (month - 2) % 12 + 1
+    truth, rows = [], []
+    for _ in range(n_rows):
+        m = rng.choice([prev, month])
+        d = rng.randint(1, 28)
+        y = year - 1 if m > month else year
+        amt = rng.randint(1, 500000) / 100
+        descr = rng.choice(MERCHANTS)
+        truth.append((f"{y}-{m:02d}-{d:02d}", descr, amt))
+        rows.append([f"{MONTHS[m - 1]} {d}", f"{MONTHS[m - 1]} {min(d + 1, 28)}",
+                     descr, f"${amt:,.2f}"])
+    header = ["Trans Date", "Post Date", "Description", "Amount"]
+    pages = []
+    for start in range(0, max(n_rows, 1), ROWS_PER_PAGE):
+        lines = []
+        if start == 0:
+            # account summary, outside the table
+            lines += [(50, 40, "Capital One Platinum Card"),
+                      (50, 54, f"Payment Due Date {MONTHS[month % 12]} 25, {year}"),
+                      (50, 68, "New Balance $1,234.56    Minimum Payment Due $35.00")]
+        y = 100
+        lines += [(x, y, h) for x, h in zip(COLUMNS, header)]
+        for row in rows[start:start + ROWS_PER_PAGE]:
+            y += 14
+            lines += [(x, y, c) for x, c in zip(COLUMNS, row)]
+        y += 20
+        last = start + ROWS_PER_PAGE >= n_rows
+        lines.append((50, y, "Total Transactions for This Period" if last
+                      else "Transactions continued on the next page"))
+        lines.append((50, y + 30, "Additional Information on the back of this page"))
+        pages.append(lines)
+    return pages, truth
+
+
+def available_backends():
+    """Backends that can run here: tabula needs tabula-py and java."""
+    names = []
+    for name in BACKENDS:
+        try:
+            if name == "tabula":
+                import tabula  # noqa: F401
+                if shutil.which("java") is None:
+                    raise ImportError("java not found")
+            else:
+                import pdfminer  # noqa: F401
+        except ImportError as e:
+            print(f"Skipping the {name} backend: {e}")
+            continue
+        names.append(name)
+    return names
+
+
+def rows_of(df):
+    return [(d.strftime("%Y-%m-%d"), s, float(a))
+            for d, s, a in zip(df.date, df.descr, df.amount)]
+
+
+def check(backends, n_statements=12, n_rows=60, year=2023):
+    """Parse the synthetic statements with each backend. Returns the number
+    of (backend, statement) pairs that didn't give the known transactions."""
+    n_failed = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        statements = []
+        for i in range(n_statements):
+            month = i % 12 + 1
+            fp = Path(tmp) / f"Statement_{month:02d}{year}.pdf"
+            pages, truth = synthetic_statement(n_rows + i, month, year, seed=i)
+            write_pdf(fp, pages)
+            statements.append((fp, truth))
+        print(f"{'backend':>8} {'statements':>11} {'transactions':>13} {'secs':>8}  mismatches")
+        for name in backends:
+            backend = get_backend(name)
+            t0 = time.perf_counter()
+            bad, n_txns = [], 0
+            for fp, truth in statements:
+                df = capital_one.parse_pdf(fp, AREA, "all", backend=backend)
+                got = rows_of(df)
+                n_txns += len(got)
+                if got != truth:
+                    bad.append(fp.name)
+            secs = time.perf_counter() - t0
+            n_failed += len(bad)
+            print(f"{name:>8} {len(statements):>11} {n_txns:>13} {secs:>8.2f}  {', '.join(bad) or '-'}")
+    return n_failed
+
+
+parser = argparse.ArgumentParser(
+    prog="backend_parity.py",
+    description="Check that each PDF extraction backend parses synthetic statements exactly."
+)
+parser.add_argument("backends", nargs="*", default=None,
+                    help=f"Backends to check, from {list(BACKENDS)}. Defaults to all available ones.")
+parser.add_argument("--statements", type=int, default=12,
+                    help="Number of synthetic statements.")
+parser.add_argument("--rows", type=int, default=60,
+                    help="Transactions in the first statement (each next one has one more).")
+parser.add_argument("--year", type=int, default=2023,
+                    help="Year the statement periods end in.")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    backends = args.backends or available_backends()
+    n_failed = check(backends, args.statements, args.rows, args.year)
+    print(f"{n_failed} statement(s) parsed wrong")
+    sys.exit(1 if n_failed else 0)
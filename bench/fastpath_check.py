@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# fastpath_check.py
+# Check the merchant normalization of the lookup fast path
+# (analysis/src/fastpath.py): descriptions of the same merchant bought
+# through a payment processor or in another city have to normalize to the
+# same key, so one hand label covers all of them, and descriptions of
+# other merchants must not be cut down to it.
+# Exits 1 if any description normalizes differently than expected.
+#
+# Usage: python bench/fastpath_check.py
+
+import sys
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "analysis"))
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from src.fastpath import FastClassifier, normalize_descr  # noqa: E402
+
+# (description, expected key)
+CASES = [
+    # store numbers, then the city and state
+    ("STARBUCKS STORE 01234 SEATTLE WA", "starbucks store"),
+    ("SAFEWAY #1234 PORTLAND OR", "safeway"),
+    ("TRADER JOE S #123 BOSTON MA", "trader joe s"),
+    ("SPOTIFY USA 877-778-1161 NY", "spotify usa"),
+    ("AMAZON.COM*2K4 AMZN.COM/BILLWA", "amazon.com"),
+    # processor prefixes
+    ("SQ *BLUE BOTTLE COFFEE OAKLAND CA", "blue bottle coffee"),
+    ("SQ*BLUE BOTTLE COFFEE OAKLAND CA", "blue bottle coffee"),
+    ("TST* BLUE BOTTLE COFFEE SEATTLE WA", "blue bottle coffee"),
+    ("PAYPAL *BLUE BOTTLE COFFEE", "blue bottle coffee"),
+    ("PAYPAL *STEAM GAMES\\WA", "steam games"),
+    ("PAYPAL TRANSFER", "paypal transfer"),
+    # cities without a store number before them, of one to three words
+    ("BLUE BOTTLE COFFEE OAKLAND CA", "blue bottle coffee"),
+    ("BLUE BOTTLE COFFEE SAN FRANCISCO CA", "blue bottle coffee"),
+    ("BLUE BOTTLE COFFEE NEW YORK NY", "blue bottle coffee"),
+    ("BLUE BOTTLE COFFEE PALM SPRINGS CA", "blue bottle coffee"),
+    ("BLUE BOTTLE COFFEE KANSAS CITY MO", "blue bottle coffee"),
+    ("BLUE BOTTLE COFFEE SALT LAKE CITY UT", "blue bottle coffee"),
+    ("BLUE BOTTLE COFFEE #12 LOS ANGELES CA", "blue bottle coffee"),
+    ("UBER *TRIP HELP.UBER.COM CA", "uber trip"),
+    # the merchant itself is never cut
+    ("SHELL OAKLAND CA", "shell"),
+    ("NETFLIX.COM CA", "netflix.com"),
+    ("COSTCO", "costco"),
+    ("", ""),
+]
+
+
+def check(cases):
+    """Print the cases that normalize differently than expected, and check
+    one hand label is found for every form of its merchant. Returns the
+    number of failures."""
+    n_failed = 0
+    for descr, want in cases:
+        got = normalize_descr(descr)
+        if got != want:
+            n_failed += 1
+            print(f"FAIL {descr!r} -> {got!r}, expected {want!r}")
+    fast = FastClassifier({normalize_descr("BLUE BOTTLE COFFEE OAKLAND CA"): "coffee"})
+    for descr, want in cases:
+        if want == "blue bottle coffee" and fast.lookup(descr) != ("coffee", "exact"):
+            n_failed += 1
+            print(f"FAIL {descr!r} isn't labeled by the hand label of 'BLUE BOTTLE COFFEE OAKLAND CA'")
+    print(f"{n_failed} failure(s) in {len(cases)} descriptions")
+    return n_failed
+
+
+parser = argparse.ArgumentParser(
+    prog="fastpath_check.py",
+    description="Check that the fast path normalizes descriptions of the same merchant to the same key."
+)
+
+if __name__ == "__main__":
+    parser.parse_args()
+    sys.exit(1 if check(CASES) else 0)
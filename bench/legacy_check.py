@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# legacy_check.py
+# Check the classify scripts (zero-shot, and k-NN with its recall sample)
+# still take tables saved the old way, with the embeddings as stringified
+# lists in a column ("[0.1, 0.2, ...]") instead of a .emb.npy next to the
+# table: they have to be labeled from those embeddings, without an
+# embedding backend (the OPENAI key is unset here, so anything that tries
+# to embed them fails).
+# Exits 1 if a script fails or mislabels more than 5% of the rows.
+#
+# Usage: python bench/legacy_check.py --rows 200
+
+import os
+import sys
+import pickle
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+LABELS = ["groceries", "travel", "dining", "utilities"]
+DIM = 16
+
+
+def make_data(d, n_rows, emb_col, n_labeled=40, seed=0):
+    """A legacy table of `n_rows` transactions embedded near one of the
+    label embeddings each, the label embeddings pickled as 3_embed_labels.py
+    saves them, and a legacy hand labeled table of `n_labeled` rows.
+    Returns (table, labels pkl, hand labeled table, the expected label of
+    each row)."""
+    rng = np.random.default_rng(seed)
+    centers = np.eye(len(LABELS), DIM, dtype=np.float32) * 4
+    def table(fp, n, labeled=False):
+        y = rng.integers(len(LABELS), size=n)
+        emb = centers[y] + rng.normal(scale=0.3, size=(n, DIM)).astype(np.float32)
+        df = pd.DataFrame({"date": "2023-11-01", "descr": [f"MERCHANT {i}" for i in range(n)],
+                           "amount": rng.uniform(1, 100, n).round(2)})
+        if labeled:
+            df["label"] = np.array(LABELS)[y]
+        df[emb_col] = [str(list(map(float, e))) for e in emb]
+        df.to_csv(fp, sep="|", index=False)
+        return np.array(LABELS)[y]
+    want = table(d / "spend_w_emb.txt", n_rows)
+    table(d / "labeled_w_emb.txt", n_labeled, labeled=True)
+    with open(d / "labels.pkl", "wb") as f:
+        pickle.dump({lab: list(map(float, c)) for lab, c in zip(LABELS, centers)}, f)
+    return d / "spend_w_emb.txt", d / "labels.pkl", d / "labeled_w_emb.txt", want
+
+
+def run(script, *args):
+    """Run an analysis script without an embedding API. Returns its output,
+    or None (after printing it) if it failed."""
+    env = {k: v for k, v in os.environ.items() if k not in ("OPENAI", "OPENAI_API_BASE")}
+    proc = subprocess.run([sys.executable, str(ROOT / "analysis" / script), *map(str, args)],
+                          cwd=ROOT, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        print(f"FAIL {script} exited {proc.returncode}:\n{proc.stdout}{proc.stderr}")
+        return None
+    return proc.stdout
+
+
+def check_labels(name, out_fp, want):
+    """Returns 1 (after printing it) if `out_fp` mislabels more than 5% of rows."""
+    got = pd.read_csv(out_fp, sep="|")["label"].to_numpy()
+    wrong = int(np.count_nonzero(got != want))
+    print(f"{name}: {wrong} of {len(want)} rows mislabeled")
+    if wrong > 0.05 * len(want):
+        print(f"FAIL {name} mislabeled {wrong} rows")
+        return 1
+    return 0
+
+
+def check(d, n_rows):
+    """Run the classify scripts on legacy tables in directory `d`.
+    Returns the number of failures."""
+    n_failed = 0
+    # a non-default --emb-col, so the script has to go by it
+    (d / "zeroshot").mkdir()
+    data, labels, _, want = make_data(d / "zeroshot", n_rows, emb_col="old_emb")
+    out = d / "zeroshot" / "out.csv"
+    if run("4_zeroshot_classify.py", data, "-o", out, "--emb-col", "old_emb",
+           "--label-embs", labels, "--no-fast") is None:
+        n_failed += 1
+    else:
+        n_failed += check_labels("4_zeroshot_classify.py", out, want)
+    # 4_knn_classify.py reads the default descr_emb column, of both tables
+    (d / "knn").mkdir()
+    data, _, labeled, want = make_data(d / "knn", n_rows, emb_col="descr_emb", seed=1)
+    out = d / "knn" / "out.csv"
+    if run("4_knn_classify.py", data, "-o", out, "--labeled", labeled,
+           "--index", d / "knn" / "index.npz", "--recall-sample", n_rows // 2) is None:
+        n_failed += 1
+    else:
+        n_failed += check_labels("4_knn_classify.py", out, want)
+    return n_failed
+
+
+parser = argparse.ArgumentParser(
+    prog="legacy_check.py",
+    description="Check the classify scripts label tables with stringified embeddings from those embeddings."
+)
+parser.add_argument("--rows", type=int, default=200,
+                    help="Transactions in the legacy table. Defaults to 200.")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as d:
+        n_failed = check(Path(d), args.rows)
+    print(f"{n_failed} failure(s)")
+    sys.exit(1 if n_failed else 0)
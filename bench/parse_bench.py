@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# parse_bench.py
+# Benchmark the row-by-row and vectorized page scrapers on synthetic
+# tabula-style page dataframes, checking that both give the same output,
+# and check --layout on a synthetic statement whose transactions continue
+# onto pages without a header.
+#
+# Usage: python bench/parse_bench.py --rows 1000,10000,100000
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "parse"))
+import capital_one  # noqa: E402
+from src.layout import detect_layout, check_frames, json_frames  # noqa: E402
+
+MERCHANTS = ["STARBUCKS STORE 01234 SEATTLE WA", "AMAZON.COM*2K4 AMZN.COM/BILLWA",
+             "SAFEWAY #1234 PORTLAND OR", "SPOTIFY USA 877-778-1161 NY",
+             "UBER *TRIP HELP.UBER.COM CA", "CAPITAL ONE AUTOPAY PYMT",
+             "TRADER JOE S #123 BOSTON MA", "SHELL OIL 57444 DENVER CO"]
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun",
+          "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+def synthetic_page(n_rows, seed=0, table_every=40):
+    """A tabula-style page: header, transaction and footer rows in 4 columns,
+    with some NaN cells and malformed amounts mixed in.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n_rows):
+        pos = i % table_every
+        if pos == 0:
+            rows.append(["Trans Date", "Post Date", "Description", "Amount"])
+        elif pos == table_every - 1:
+            rows.append(["Total Transactions for This Period", np.nan, np.nan, "$1,234.56"])
+        elif pos == table_every - 2:
+            rows.append([np.nan, "Fees", np.nan, np.nan])
+        else:
+            m = MONTHS[rng.integers(12)]
+            d = int(rng.integers(1, 29))
+            descr = MERCHANTS[rng.integers(len(MERCHANTS))]
+            amt = f"${rng.integers(1, 5000):,}.{rng.integers(100):02d}"
+            if rng.random() < 0.01:
+                amt = "N/A"
+            rows.append([f"{m} {d}", f"{m} {d}", descr, amt])
+    return pd.DataFrame(rows, columns=["Trans Date", "Post Date", "Description", "Amount"])
+
+
+def time_scraper(fn, pages, repeat=3):
+    best = float("inf")
+    out = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = capital_one.init_data()
+        for pg in pages:
+            out = fn(pg, out)
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def bench_scrape(n_rows, n_pages=4, repeat=3):
+    pages = [synthetic_page(n_rows // n_pages, seed=i) for i in range(n_pages)]
+    t_rows, out_rows = time_scraper(capital_one.scrape_page, pages, repeat)
+    t_vec, out_vec = time_scraper(capital_one.scrape_page_vec, pages, repeat)
+    assert out_rows == out_vec, "scrape_page and scrape_page_vec disagree"
+    return {"rows": n_rows, "transactions": len(out_vec["date"]),
+            "scrape_page_s": t_rows, "scrape_page_vec_s": t_vec,
+            "speedup": t_rows / t_vec}
+
+
+def synthetic_statement(n_rows, rows_per_page=30, seed=0):
+    """tabula's json output for a full scan of a statement: an account
+    summary, then a "Trans Date" table of n_rows transactions continued
+    across pages without repeating the header (each page has a page number
+    line at the top), closed by a total row, then a last page of other
+    information. Positions are in points, 20 per row."""
+    rng = np.random.default_rng(seed)
+    # (not the autopay row, a "capital one" footer would end the table)
+    merchants = [m for m in MERCHANTS if "CAPITAL ONE" not in m]
+    def table(page, rows, top):
+        cells = [[{"top": top + 20.0 * i, "left": 50.0 + 120 * j, "width": 100.0,
+                   "height": 12.0, "text": txt} for j, txt in enumerate(row)]
+                 for i, row in enumerate(rows)]
+        return {"page_number": page, "top": top, "left": 50.0, "right": 530.0,
+                "bottom": top + 20.0 * len(rows), "data": cells}
+    def txn():
+        m, d = MONTHS[rng.integers(12)], int(rng.integers(1, 29))
+        return [f"{m} {d}", f"{m} {d}", merchants[rng.integers(len(merchants))],
+                f"${rng.integers(1, 5000):,}.{rng.integers(100):02d}"]
+    tables = [table(1, [["Account Summary", "", "", ""], ["Previous Balance", "", "", "$1,000.00"]], 60.0)]
+    rows = [["Trans Date", "Post Date", "Description", "Amount"]] + [txn() for _ in range(n_rows)]
+    rows.append(["Total Transactions for This Period", "", "", "$1,234.56"])
+    page, top = 1, 300.0
+    while rows:
+        if page > 1:
+            tables.append(table(page, [["", "", f"Page {page}", ""]], 20.0))
+        n = rows_per_page if page > 1 else rows_per_page // 2
+        tables.append(table(page, rows[:n], top))
+        rows = rows[n:]
+        page, top = page + 1, 60.0
+    tables.append(table(page, [["Additional Information", "", "", ""]], 60.0))
+    return tables
+
+
+def read_with_layout(tables, layout):
+    """What reading a statement with `layout` gives: (page, [dataframes])
+    of the cells inside each page's area, as scrape_pdf_layout reads them."""
+    out = []
+    for p in layout["pages"]:
+        top, left, bottom, right = layout["areas"][str(p)]
+        kept = [dict(t, data=[r for r in t["data"] if top <= r[0]["top"] <= bottom])
+                for t in tables if t["page_number"] == p]
+        out.append((p, json_frames([t for t in kept if t["data"]])))
+    return out
+
+
+def check_layout():
+    """Detect the layout of a statement whose table runs over three pages,
+    and check later statements read with it pass check_frames and read all
+    their transaction rows (and one whose table ends sooner is scanned in
+    full)."""
+    header, footers = capital_one.HEADER_MARKER, capital_one.FOOTER_MARKERS
+    first = synthetic_statement(60)
+    layout = detect_layout(first, header, footers)
+    assert layout is not None and layout["pages"] == [1, 2, 3], f"layout missed pages: {layout}"
+    for seed, n_rows in [(1, 60), (2, 64)]:
+        tables = synthetic_statement(n_rows, seed=seed)
+        frames = read_with_layout(tables, layout)
+        assert check_frames(frames, header, footers), "a statement of the same template fell back to a full scan"
+        # every transaction row is read, continuation pages included, and
+        # scraped as in a full scan
+        read = [df for _, dfs in frames for df in dfs]
+        n_read = sum(int(df[0].astype(str).str.match(r"[A-Z][a-z]{2} \d").sum()) for df in read)
+        assert n_read == n_rows, f"read {n_read} of {n_rows} transaction rows with the layout"
+        assert capital_one.scrape_frames(read) == capital_one.scrape_frames(json_frames(tables)), \
+            "reading with the layout scraped other transactions than a full scan"
+    shorter = read_with_layout(synthetic_statement(20, seed=3), layout)
+    assert not check_frames(shorter, header, footers), "a statement whose table ends sooner wasn't scanned in full"
+    return layout
+
+
+parser = argparse.ArgumentParser(
+    prog="parse_bench.py",
+    description="Benchmark scrape_page against scrape_page_vec on synthetic pages."
+)
+parser.add_argument("--rows", default="1000,10000,100000",
+                    help="Comma separated total row counts to benchmark.")
+parser.add_argument("--repeat", type=int, default=3,
+                    help="Best of this many runs is reported.")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    # silence per-row parse warnings from the scrapers
+    capital_one.print = lambda *a, **k: None
+    print(f"{'rows':>10} {'scrape_page':>12} {'vectorized':>12} {'speedup':>8}")
+    for n in [int(r) for r in args.rows.split(",")]:
+        r = bench_scrape(n, repeat=args.repeat)
+        print(f"{r['rows']:>10} {r['scrape_page_s']:>11.4f}s {r['scrape_page_vec_s']:>11.4f}s {r['speedup']:>7.1f}x")
+    layout = check_layout()
+    print(f"layout of a table continued over pages {layout['pages']}: later statements read every transaction row with it")
@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+# run_bench.py
+# Time the hot paths of the parse -> concat -> embed -> classify -> stats
+# workflow on synthetic data at several scales, and save the results as JSON
+# so runs from different commits can be compared.
+#
+# Usage: python bench/run_bench.py --scales 1000,100000,1000000
+#        python bench/run_bench.py --compare bench/results/OLD.json bench/results/NEW.json
+#
+# Pure Python reference loops (scrape_page, format_date, cos_sim_match, ...)
+# are capped at --max-loop-rows and the 1536-dim embedding matrices at
+# --max-emb-rows, so large scales finish; each result records the rows it
+# actually ran on.
+
+import os
+import sys
+import json
+import time
+import pickle
+import argparse
+import platform
+import tempfile
+import subprocess
+import importlib.util
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "bench"))
+import parse_bench  # noqa: E402 (also puts parse/ on the path)
+
+CASES = ("scrape", "format", "concat", "emb_strings", "classify", "stats", "store")
+LABELS = ["groceries", "restaurants", "coffee", "gas", "rideshare", "travel",
+          "streaming", "shopping", "utilities", "rent", "health", "fitness",
+          "entertainment", "education", "gifts", "insurance", "pets", "home",
+          "payment", "fees"]
+
+
+def load_module(dirpath, name):
+    """Import a script from dirpath. parse/ and analysis/ both have a `src`
+    package, so the one already imported is dropped first (modules loaded
+    earlier keep the functions they imported)."""
+    for k in [k for k in sys.modules if k == "src" or k.startswith("src.")]:
+        del sys.modules[k]
+    if str(dirpath) in sys.path:
+        sys.path.remove(str(dirpath))
+    sys.path.insert(0, str(dirpath))
+    spec = importlib.util.spec_from_file_location(f"bench_{name}", Path(dirpath) / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def git_commit():
+    """(commit sha, whether the tree has uncommitted changes), or (None, None)."""
+    try:
+        sha = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                             text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                cwd=ROOT, capture_output=True, text=True, check=True).stdout
+        return sha, bool(status.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def best_of(fn, repeat=3, setup=None):
+    """Best wall time of `repeat` calls of fn (setup runs untimed before each).
+    Returns (seconds, last result)."""
+    best = float("inf")
+    out = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+# --- synthetic data ---
+
+def synthetic_transactions(n_rows, seed=0, labeled=False):
+    """A parsed-statement style table: ISO date, descr, amount and month
+    (plus a label column if labeled), with ~1% unparseable amounts as NaN."""
+    rng = np.random.default_rng(seed)
+    days = rng.integers(0, 365 * 10, n_rows)
+    dates = pd.Timestamp("2015-01-01") + pd.to_timedelta(np.sort(days), unit="D")
+    merchants = np.asarray(parse_bench.MERCHANTS, dtype=object)
+    descr = merchants[rng.integers(len(merchants), size=n_rows)] + " " \
+        + rng.integers(100, 1000, n_rows).astype(str).astype(object)
+    amount = np.round(rng.lognormal(3, 1.2, n_rows), 2)
+    amount[rng.random(n_rows) < 0.01] = np.nan
+    df = pd.DataFrame({"date": dates.strftime("%Y-%m-%d"), "descr": descr,
+                       "amount": amount, "month": dates.month})
+    if labeled:
+        df["label"] = np.asarray(LABELS, dtype=object)[rng.integers(len(LABELS), size=n_rows)]
+    return df
+
+
+def synthetic_embeddings(n_rows, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((n_rows, dim), dtype=np.float32)
+
+
+# --- cases ---
+# each case takes (scale, args, tmp_dir) and yields (fn name, rows, seconds)
+
+def case_scrape(n, args, tmp):
+    capital_one = parse_bench.capital_one
+    capital_one.print = lambda *a, **k: None
+    pages = [parse_bench.synthetic_page(n // 4, seed=i) for i in range(4)]
+
+    def run(fn, pgs):
+        out = capital_one.init_data()
+        for pg in pgs:
+            out = fn(pg, out)
+        return out
+
+    m = min(n, args.max_loop_rows)
+    t, _ = best_of(lambda: run(capital_one.scrape_page, [p.iloc[:m // 4] for p in pages]), args.repeat)
+    yield "scrape_page", m // 4 * 4, t
+    t, _ = best_of(lambda: run(capital_one.scrape_page_vec, pages), args.repeat)
+    yield "scrape_page_vec", n // 4 * 4, t
+
+
+def case_format(n, args, tmp):
+    parsing = parse_bench.capital_one # has src.parsing's format functions
+    rng = np.random.default_rng(0)
+    months = np.asarray(parse_bench.MONTHS, dtype=object)
+    dates = months[rng.integers(12, size=n)] + " " + rng.integers(1, 29, n).astype(str).astype(object)
+    nums = pd.Series(rng.lognormal(3, 1.2, n)).map("${:,.2f}".format).to_numpy(dtype=object)
+    m = min(n, args.max_loop_rows)
+
+    def loop_dates():
+        return [parsing.format_date(d) for d in dates[:m]]
+
+    t, _ = best_of(loop_dates, args.repeat, setup=parsing.format_date.cache_clear)
+    yield "format_date", m, t
+    t, _ = best_of(lambda: [parsing.format_num(x) for x in nums[:m]], args.repeat)
+    yield "format_num", m, t
+    t, _ = best_of(lambda: parsing.format_dates(dates), args.repeat,
+                   setup=parsing.format_date.cache_clear)
+    yield "format_dates", n, t
+    t, _ = best_of(lambda: parsing.format_nums(nums), args.repeat)
+    yield "format_nums", n, t
+
+
+def case_concat(n, args, tmp):
+    concat = args.modules["1_concat_data"]
+    # monthly statement files that overlap by a few rows, like real downloads
+    df = synthetic_transactions(n)
+    n_files = min(args.files, max(n, 1))
+    bounds = np.linspace(0, n, n_files + 1).astype(int)
+    fps = []
+    for i in range(n_files):
+        fp = Path(tmp) / f"concat_{n}_{i:03d}.txt"
+        df.iloc[max(bounds[i] - 5, 0):bounds[i + 1]].to_csv(fp, sep="|", index=False)
+        fps.append(fp)
+    t, _ = best_of(lambda: concat.concat_dfs(fps, threads=args.threads), args.repeat)
+    yield "concat_dfs", n, t
+    out = Path(tmp) / f"concat_{n}_out.txt"
+    t, _ = best_of(lambda: concat.stream_concat(fps, out), args.repeat)
+    yield "stream_concat", n, t
+
+
+def case_emb_strings(n, args, tmp):
+    # stringified-list embeddings, as the old CSVs stored them (str2float_list)
+    from src.emb_store import parse_emb_strings
+    m = min(n, args.max_loop_rows)
+    emb = synthetic_embeddings(m, args.dim)
+    strs = [str(row.tolist()) for row in emb]
+    t, _ = best_of(lambda: parse_emb_strings(strs), args.repeat)
+    yield "parse_emb_strings", m, t
+
+
+def case_classify(n, args, tmp):
+    from src.classify import load_class_embeddings, label_matrix, classify_batch
+    zeroshot = args.modules["4_zeroshot_classify"]
+    # label embeddings pickled like 3_embed_labels.py saves them
+    fps = []
+    for i in range(3):
+        fp = Path(tmp) / f"labels_{i}.pkl"
+        lab = synthetic_embeddings(len(LABELS), args.dim, seed=100 + i)
+        with open(fp, "wb") as f:
+            pickle.dump({k: v.tolist() for k, v in zip(LABELS, lab)}, f)
+        fps.append(str(fp))
+    t, lab_embs = best_of(lambda: load_class_embeddings(fps, agg_mthd="sum"), args.repeat)
+    yield "load_class_embeddings", len(LABELS) * len(fps), t
+
+    m = min(n, args.max_emb_rows)
+    emb = synthetic_embeddings(m, args.dim, seed=1)
+    k = min(m, args.max_loop_rows)
+    t, _ = best_of(lambda: [zeroshot.cos_sim_match(e, lab_embs) for e in emb[:k]], args.repeat)
+    yield "cos_sim_match", k, t
+    labels, lab_mat = label_matrix(lab_embs)
+    t, _ = best_of(lambda: classify_batch(emb, labels, lab_mat, top_k=3), args.repeat)
+    yield "classify_batch", m, t
+
+    from src.linear import SoftmaxClassifier
+    y = np.asarray(LABELS, dtype=object)[np.random.default_rng(2).integers(len(LABELS), size=m)]
+    clf = SoftmaxClassifier(args.dim)
+    t, _ = best_of(lambda: clf.partial_fit(emb, y), args.repeat)
+    yield "SoftmaxClassifier.fit", m, t
+    t, _ = best_of(lambda: clf.predict(emb), args.repeat)
+    yield "SoftmaxClassifier.pred", m, t
+
+
+def agg_stats(data, group_cols, prefix=""):
+    """The pandas groupby export_stats.py aggregated with before the stats
+    cube, kept as its baseline."""
+    s = data.groupby(group_cols).agg({
+        "amount" : ["sum", "mean", "std"],
+        "label" : "count"
+    })
+    s = s.reset_index()
+    cols = []
+    for col in s.columns:
+        if col[0] in group_cols and col[1] == "":
+            cols.append(col[0])
+        else:
+            cols.append(
+                prefix + " ".join(col).strip().replace(" ", "_")
+            )
+    s.columns = cols
+    return s
+
+
+def stats_tables(d):
+    """The tables export_stats.py wrote before the stats cube."""
+    return {
+        "year_label": agg_stats(d, ["label", "year"], prefix="year_"),
+        "month": agg_stats(d, "month").sort_values(by="month"),
+        "month_label": agg_stats(d, ["label", "month"])
+    }
+
+
+def case_stats(n, args, tmp):
+    from src.stats import StatsCube
+    df = synthetic_transactions(n, labeled=True)
+    d = df.assign(date=pd.to_datetime(df["date"]))
+    d["year"] = d.date.dt.year
+    t, _ = best_of(lambda: agg_stats(d, ["label", "month"]), args.repeat)
+    yield "agg_stats", n, t
+    t, _ = best_of(lambda: stats_tables(d), args.repeat)
+    yield "stats_tables", n, t
+
+    cube_fp = Path(tmp) / f"stats_{n}.sqlite"
+
+    def add():
+        with StatsCube(cube_fp) as cube:
+            cube.clear()
+            cube.add(df)
+
+    t, _ = best_of(add, args.repeat)
+    yield "StatsCube.add", n, t
+
+
+def case_store(n, args, tmp):
+    import shutil
+    from src.txn_store import TransactionStore
+    # labeled history growing a statement at a time, like append_hand_labeled.py
+    df = synthetic_transactions(n, labeled=True)
+    bounds = np.linspace(0, n, args.files + 1).astype(int)
+    parts = [df.iloc[bounds[i]:bounds[i + 1]] for i in range(args.files)]
+    flat = Path(tmp) / f"labeled_{n}.txt"
+    store_dir = Path(tmp) / f"store_{n}"
+
+    def rewrite():
+        # the old way: read everything, write a backup and the whole file again
+        flat.unlink(missing_ok=True)
+        for part in parts:
+            old = pd.read_csv(flat, sep="|") if flat.exists() else part.iloc[:0]
+            old.to_csv(flat.with_suffix(".bak"), sep="|", index=False)
+            pd.concat([old, part]).to_csv(flat, sep="|", index=False)
+
+    def append():
+        store = TransactionStore(store_dir)
+        for part in parts:
+            store.append(part)
+        return store
+
+    t, _ = best_of(rewrite, args.repeat)
+    yield "rewrite_labeled", n, t
+    t, store = best_of(append, args.repeat, setup=lambda: shutil.rmtree(store_dir, ignore_errors=True))
+    yield "store_append", n, t
+    start = parts[-1]["date"].iloc[0] if len(parts[-1]) else None
+    t, rows = best_of(lambda: sum(len(c) for c in store.scan(start=start)), args.repeat)
+    yield "store_scan", rows, t
+    # hand labeling a statement's worth of rows only appends to the label log
+    ids = store.ids()[:max(n // args.files, 1)]
+    t, _ = best_of(lambda: store.set_labels(ids, np.full(len(ids), "fees", dtype=object)), args.repeat)
+    yield "store_set_labels", len(ids), t
+
+
+CASE_FNS = {"scrape": case_scrape, "format": case_format, "concat": case_concat,
+            "emb_strings": case_emb_strings, "classify": case_classify, "stats": case_stats,
+            "store": case_store}
+
+
+def run(args):
+    cases = [c for c in args.cases.split(",") if c]
+    bad = [c for c in cases if c not in CASE_FNS]
+    if bad:
+        raise ValueError(f"unknown case(s) {bad}, choose from {CASES}")
+    # the parse modules are already loaded by parse_bench, load the analysis
+    # scripts after them so `src` is the analysis package from here on
+    args.modules = {name: load_module(ROOT / "analysis", name)
+                    for name in ("1_concat_data", "4_zeroshot_classify")}
+    sha, dirty = git_commit()
+    results = []
+    print(f"{'case':>12} {'function':>22} {'scale':>10} {'rows':>10} {'seconds':>10} {'rows/s':>12}")
+    with tempfile.TemporaryDirectory(prefix="bench_") as tmp:
+        for n in [int(s) for s in args.scales.split(",")]:
+            for case in cases:
+                for fn, rows, secs in CASE_FNS[case](n, args, tmp):
+                    r = {"case": case, "fn": fn, "scale": n, "rows": int(rows),
+                         "seconds": secs, "rows_per_s": rows / secs if secs > 0 else None}
+                    results.append(r)
+                    print(f"{case:>12} {fn:>22} {n:>10} {rows:>10} {secs:>9.4f}s "
+                          f"{r['rows_per_s'] or 0:>12,.0f}")
+    return {
+        "meta": {
+            "commit": sha,
+            "dirty": dirty,
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("modules", "compare", "output")}
+        },
+        "results": results
+    }
+
+
+def compare(old_fp, new_fp, threshold=1.1):
+    """Print the time ratio (new / old) of each function at each scale found
+    in both result files. Returns the number of regressions (ratio above
+    threshold)."""
+    def load(fp):
+        with open(fp) as f:
+            res = json.load(f)
+        return res["meta"], {(r["case"], r["fn"], r["scale"]): r for r in res["results"]}
+
+    old_meta, old = load(old_fp)
+    new_meta, new = load(new_fp)
+    print(f"old: {old_meta.get('commit')} ({old_fp})\nnew: {new_meta.get('commit')} ({new_fp})")
+    print(f"{'function':>22} {'scale':>10} {'old':>10} {'new':>10} {'ratio':>7}")
+    n_slower = 0
+    for key in sorted(old.keys() & new.keys(), key=lambda k: (k[2], CASES.index(k[0]) if k[0] in CASES else 0, k[1])):
+        o, nw = old[key], new[key]
+        if o["rows"] != nw["rows"] or o["seconds"] <= 0:
+            # capped at different row counts, compare throughput instead
+            ratio = (o["rows_per_s"] or 0) / nw["rows_per_s"] if nw["rows_per_s"] else float("inf")
+        else:
+            ratio = nw["seconds"] / o["seconds"]
+        flag = ""
+        if ratio > threshold:
+            flag = "  slower"
+            n_slower += 1
+        elif ratio < 1 / threshold:
+            flag = "  faster"
+        print(f"{key[1]:>22} {key[2]:>10} {o['seconds']:>9.4f}s {nw['seconds']:>9.4f}s {ratio:>6.2f}x{flag}")
+    print(f"{n_slower} regression(s) over {threshold:.2f}x")
+    return n_slower
+
+
+parser = argparse.ArgumentParser(
+    prog="run_bench.py",
+    description="Benchmark the parse, concat, embed, classify and stats hot paths on synthetic data.",
+    epilog="Results are saved as JSON; compare two runs with --compare OLD.json NEW.json."
+)
+parser.add_argument("--scales", default="1000,10000,100000",
+                    help="Comma separated row counts (1000 up to 10000000). Defaults to 1000,10000,100000.")
+parser.add_argument("--cases", default=",".join(CASES),
+                    help=f"Comma separated cases to run, from {','.join(CASES)}. Defaults to all.")
+parser.add_argument("--repeat", type=int, default=3,
+                    help="Best of this many runs is reported.")
+parser.add_argument("--dim", type=int, default=1536,
+                    help="Embedding dimension. Defaults to 1536 (text-embedding-ada-002).")
+parser.add_argument("--max-emb-rows", type=int, default=100_000,
+                    help="Most rows of embeddings to generate (100,000 x 1536 float32 is ~600MB).")
+parser.add_argument("--max-loop-rows", type=int, default=20_000,
+                    help="Most rows to run the pure Python reference loops and embedding string parsing on.")
+parser.add_argument("--files", type=int, default=12,
+                    help="Number of statement files to split the table into for concat.")
+parser.add_argument("--threads", type=int, default=4,
+                    help="Threads for concat_dfs to read files with.")
+parser.add_argument("-o", "--output", default=None,
+                    help="Where to save the results. Defaults to bench/results/<commit>.json.")
+parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), default=None,
+                    help="Compare two result files instead of running, exiting 1 on a regression.")
+parser.add_argument("--threshold", type=float, default=1.1,
+                    help="Time ratio (new / old) counted as a regression by --compare. Defaults to 1.1.")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.compare is not None:
+        sys.exit(1 if compare(*args.compare, threshold=args.threshold) else 0)
+    res = run(args)
+    out = args.output
+    if out is None:
+        sha = (res["meta"]["commit"] or "nogit")[:10]
+        out = ROOT / "bench" / "results" / f"{sha}{'-dirty' if res['meta']['dirty'] else ''}.json"
+    Path(out).parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(res, f, indent=1)
+    print(f"Saved {out}")
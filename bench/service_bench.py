@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# service_bench.py
+# Latency and throughput of the classification service (analysis/src/service.py)
+# under concurrent clients: a server with the local hashing backend and
+# synthetic labels is started in this process, and each client thread
+# sends statement sized batches of descriptions over HTTP. Runs with and
+# without micro-batching (--waits 0,5) show what batching requests buys.
+#
+# Usage: python bench/service_bench.py --clients 1,8,32 --texts 50
+
+import sys
+import time
+import random
+import argparse
+import threading
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "analysis"))
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from src.backends import get_backend  # noqa: E402
+from src.service import WarmClassifier, make_server, classify_remote  # noqa: E402
+from common.metrics import METRICS  # noqa: E402
+
+# (as in parse_bench.py, which can't be imported next to the analysis `src`)
+MERCHANTS = ["STARBUCKS STORE 01234 SEATTLE WA", "AMAZON.COM*2K4 AMZN.COM/BILLWA",
+             "SAFEWAY #1234 PORTLAND OR", "SPOTIFY USA 877-778-1161 NY",
+             "UBER *TRIP HELP.UBER.COM CA", "CAPITAL ONE AUTOPAY PYMT",
+             "TRADER JOE S #123 BOSTON MA", "SHELL OIL 57444 DENVER CO"]
+
+LABELS = ["groceries", "restaurants", "coffee", "travel", "transport", "gas",
+          "shopping", "subscriptions", "utilities", "rent", "health", "entertainment"]
+
+
+def descriptions(n, seed=0):
+    rng = random.Random(seed)
+    return [f"{rng.choice(MERCHANTS)} {rng.randint(100, 99999)}" for _ in range(n)]
+
+
+def run_clients(url, n_clients, n_requests, n_texts):
+    """Each client sends n_requests requests of n_texts descriptions.
+    Returns (latencies in seconds, wall seconds)."""
+    lat, lock = [], threading.Lock()
+
+    def client(i):
+        for r in range(n_requests):
+            texts = descriptions(n_texts, seed=i * n_requests + r)
+            t0 = time.perf_counter()
+            classify_remote(texts, url)
+            with lock:
+                lat.append(time.perf_counter() - t0)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(n_clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return np.array(lat), time.perf_counter() - t0
+
+
+def bench(clients, n_requests, n_texts, waits_ms):
+    backend = get_backend("hashing")
+    backend.fit_idf(descriptions(5000, seed=-1) + LABELS)
+    lab_embs = dict(zip(LABELS, backend.embed(LABELS)))
+    print(f"{'wait_ms':>8} {'clients':>8} {'requests':>9} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8}"
+          f" {'req/s':>8} {'texts/s':>9} {'batches':>8}")
+    for wait in waits_ms:
+        # a new server (and embedding memo) per setting, so runs don't warm each other
+        server = make_server(WarmClassifier(lab_embs, backend), port=0, max_wait=wait / 1000)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}"
+        classify_remote(["warm up"], url)
+        for n_clients in clients:
+            before = METRICS.counters.get("service.batches", 0)
+            lat, wall = run_clients(url, n_clients, n_requests, n_texts)
+            batches = METRICS.counters.get("service.batches", 0) - before
+            ms = lat * 1000
+            print(f"{wait:>8.1f} {n_clients:>8} {len(lat):>9} {np.percentile(ms, 50):>8.1f}"
+                  f" {np.percentile(ms, 95):>8.1f} {np.percentile(ms, 99):>8.1f}"
+                  f" {len(lat) / wall:>8.0f} {len(lat) * n_texts / wall:>9.0f} {batches:>8}")
+        server.shutdown()
+        server.server_close()
+
+
+parser = argparse.ArgumentParser(
+    prog="service_bench.py",
+    description="Latency and throughput of the classification service under concurrent clients."
+)
+parser.add_argument("--clients", default="1,8,32",
+                    help="Comma separated numbers of concurrent clients.")
+parser.add_argument("--requests", type=int, default=50,
+                    help="Requests per client.")
+parser.add_argument("--texts", type=int, default=50,
+                    help="Descriptions per request (about a statement's worth).")
+parser.add_argument("--waits", default="0,5",
+                    help="Comma separated micro-batching waits in ms to compare.")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    bench([int(c) for c in args.clients.split(",")], args.requests, args.texts,
+          [float(w) for w in args.waits.split(",")])
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# startup_bench.py
+# Check that the command line entry points start quickly: `--help` has to
+# return within a time budget without importing any heavy module (numpy,
+# pandas, tabula, ...), which should only load once arguments are parsed.
+# Exits 1 if an entry point is over budget or imports a heavy module.
+#
+# Usage: python bench/startup_bench.py --budget 0.5
+
+import sys
+import time
+import argparse
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+ENTRY_POINTS = ["parse/capital_one.py", "pipeline.py", "analysis/1_concat_data.py",
+                "analysis/2_embed_data.py", "analysis/3_embed_labels.py",
+                "analysis/4_zeroshot_classify.py", "analysis/4_knn_classify.py",
+                "analysis/4_linear_classify.py", "analysis/export_stats.py",
+                "analysis/serve_classify.py"]
+HEAVY = ["numpy", "pandas", "tabula", "jpype", "sklearn", "matplotlib", "pyarrow"]
+
+
+def imported_modules(script):
+    """Top level modules imported by `script --help`, from -X importtime."""
+    out = subprocess.run([sys.executable, "-X", "importtime", str(ROOT / script), "--help"],
+                         capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(f"{script} --help failed:\n{out.stderr[-2000:]}")
+    mods = set()
+    for line in out.stderr.splitlines():
+        if line.startswith("import time:") and line.count("|") == 2:
+            name = line.rsplit("|", 1)[1].strip()
+            mods.add(name.split(".")[0])
+    return mods
+
+
+def startup_time(script, repeat=5):
+    """Best wall time of `script --help` in a new interpreter."""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, str(ROOT / script), "--help"],
+                       capture_output=True, check=True)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def check(scripts, budget=0.5, repeat=5):
+    """Print the startup time and heavy imports of each script.
+    Returns the number of scripts that failed."""
+    # the interpreter itself, to report startup over bare python
+    base = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        base = min(base, time.perf_counter() - t0)
+    print(f"{'script':>32} {'--help':>9} {'over python':>12}  heavy imports")
+    n_failed = 0
+    for script in scripts:
+        secs = startup_time(script, repeat)
+        heavy = sorted(imported_modules(script) & set(HEAVY))
+        failed = secs > budget or bool(heavy)
+        n_failed += failed
+        print(f"{script:>32} {secs:>8.3f}s {secs - base:>11.3f}s  {', '.join(heavy) or '-'}"
+              + ("  FAIL" if failed else ""))
+    print(f"{n_failed} of {len(scripts)} entry point(s) over the {budget:.2f}s budget or importing heavy modules")
+    return n_failed
+
+
+parser = argparse.ArgumentParser(
+    prog="startup_bench.py",
+    description="Time `--help` of each entry point and check it imports no heavy modules."
+)
+parser.add_argument("scripts",
+                    nargs="*",
+                    default=ENTRY_POINTS,
+                    help="Scripts to check, relative to the repository root. Defaults to all entry points.")
+parser.add_argument("--budget", type=float, default=0.5,
+                    help="Most seconds `--help` may take. Defaults to 0.5.")
+parser.add_argument("--repeat", type=int, default=5,
+                    help="Best of this many runs is reported.")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    sys.exit(1 if check(args.scripts, args.budget, args.repeat) else 0)
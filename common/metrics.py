@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+from datetime import datetime, timezone
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError: # windows
+    resource = None
+
+# Lightweight run instrumentation: named timers and counters in one process
+# wide registry (METRICS), with peak RSS, saved as JSON by the --metrics
+# option of the command line scripts. --profile dumps a cProfile of the run.
+# The parse and analysis scripts each import their own `src` package, and
+# both import this one (their entry points put the repository root on the
+# path), so a process has one registry.
+
+
+def rss_mb():
+    """Current resident set size in MB, or None where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_mb():
+    """Peak resident set size of the process so far in MB, or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KB elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+class Metrics:
+    """Timers and counters, safe to update from several threads.
+    `with METRICS.timer("pdf.extract"):` adds the block's wall time to the
+    timer (calls, total and slowest seconds, peak RSS when it last ended),
+    `METRICS.count("pdf.tables", n)` adds n to a counter.
+    """
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            secs = time.perf_counter() - t0
+            peak = peak_rss_mb()
+            with self._lock:
+                t = self.timers.setdefault(name, {"calls": 0, "seconds": 0.0, "max_s": 0.0,
+                                                  "peak_rss_mb": None})
+                t["calls"] += 1
+                t["seconds"] += secs
+                t["max_s"] = max(t["max_s"], secs)
+                t["peak_rss_mb"] = peak
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, snapshot):
+        """Add the timers and counters of another snapshot (e.g. from a worker
+        process or a subprocess's --metrics file) to these."""
+        with self._lock:
+            for name, o in snapshot.get("timers", {}).items():
+                t = self.timers.setdefault(name, {"calls": 0, "seconds": 0.0, "max_s": 0.0,
+                                                  "peak_rss_mb": None})
+                t["calls"] += o["calls"]
+                t["seconds"] += o["seconds"]
+                t["max_s"] = max(t["max_s"], o["max_s"])
+                if o.get("peak_rss_mb") is not None:
+                    t["peak_rss_mb"] = max(t["peak_rss_mb"] or 0, o["peak_rss_mb"])
+            for name, n in snapshot.get("counters", {}).items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        with self._lock:
+            self.timers.clear()
+            self.counters.clear()
+            self.started = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "command": sys.argv,
+                "pid": os.getpid(),
+                "started": datetime.fromtimestamp(self.started, timezone.utc).isoformat(timespec="seconds"),
+                "wall_s": time.time() - self.started,
+                "rss_mb": rss_mb(),
+                "peak_rss_mb": peak_rss_mb(),
+                "timers": {k: dict(v) for k, v in self.timers.items()},
+                "counters": dict(self.counters)
+            }
+
+    def save(self, fp):
+        with open(fp, "w") as f:
+            json.dump(self.snapshot(), f, indent=1)
+
+
+METRICS = Metrics()
+timer = METRICS.timer
+count = METRICS.count
+
+
+def enable(metrics_fp=None, profile_fp=None, top=30):
+    """Instrument the rest of a script's run. With profile_fp the main thread
+    is profiled with cProfile, and at exit the profile is dumped there (a
+    pstats file, for snakeviz, flameprof or gprof2dot) with its top functions
+    printed to stderr. With metrics_fp the METRICS snapshot is saved there as
+    JSON at exit.
+    """
+    prof = None
+    if profile_fp is not None:
+        import cProfile
+        prof = cProfile.Profile()
+        prof.enable()
+
+    def finish():
+        if prof is not None:
+            import pstats
+            prof.disable()
+            prof.dump_stats(profile_fp)
+            pstats.Stats(prof, stream=sys.stderr).sort_stats("cumulative").print_stats(top)
+        if metrics_fp is not None:
+            METRICS.save(metrics_fp)
+
+    if prof is not None or metrics_fp is not None:
+        atexit.register(finish)
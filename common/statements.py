@@ -0,0 +1,14 @@
+import re
+from pathlib import Path
+
+# Statement PDFs are named like Statement_112023.pdf (MMYYYY), and their
+# parsed outputs keep the name: parse/ takes a statement's period from it,
+# and analysis/ concatenates the parsed statements in that order.
+STATEMENT_RE = re.compile(r"(0[1-9]|1[0-2])[-_]?((?:19|20)\d{2})(?!\d)")
+
+
+def statement_month(fp):
+    """(year, month) from the MMYYYY date in a statement's file name, or None
+    if it has none."""
+    m = STATEMENT_RE.search(Path(fp).name)
+    return None if m is None else (int(m.group(2)), int(m.group(1)))
@@ -1,22 +1,34 @@
 #!/usr/bin/env python
 # capital_one.py
-# Parse monthly CapitalOne account statement PDF into text delimited dataset
+# Parse monthly CapitalOne account statement PDF(s) into text delimited dataset(s)
 #
 # Hans Elliott
 
-import tabula
-import pandas as pd
-from src.helpers import validate_java
-import re
-import calendar
+# numpy, pandas and tabula are imported where they are used, so -h and
+# argument errors return without loading them
+
+import sys
 from pathlib import Path
-from datetime import datetime
-import argparse
 
-MONTHS = {mnth.lower(): idx for idx, mnth
-          in enumerate(calendar.month_abbr) if mnth}
+# the repository root, for common/ (the timers shared with analysis/)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from src.helpers import validate_java, check_jpype, collect_pdfs
+from src.cache import StatementCache, default_cache_dir
+from src.layout import LayoutCache, detect_layout, json_frames, check_frames
+from src.extract import read_pdf, page_rows, get_backend, BACKENDS
+from src.parsing import (format_date, format_num, format_dates, format_nums,
+                         infer_years, statement_period, YEAR)
+from common import metrics
+from common.metrics import METRICS, timer, count
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 
-YEAR = datetime.now().year
+# row that starts the transactions table
+HEADER_MARKER = "trans date"
+# rows that end the transactions table
+FOOTER_MARKERS = ["additional information", "transaction", "capital one",
+                  "total fees", "interest charge"]
 
 def init_data():
     return {
@@ -25,21 +37,6 @@ def init_data():
         "amount" : []
     }
 
-def format_date(date_str, year=None):
-    m, d = date_str.lower().strip().split(" ")
-    m = MONTHS[m.strip()]
-    if int(m) < 10:
-        m = "0" + str(m)
-    if int(d) < 10:
-        d = "0" + str(d)
-    if year is None:
-        year = YEAR 
-
-    return f"{year}-{m}-{d}"
-
-def format_num(num_str):
-    return float(re.sub("[^\d\.]", "", num_str))
-
 
 def scrape_page(page, data):
     in_table = False
@@ -47,15 +44,11 @@ def scrape_page(page, data):
         # print(i)
         row = ' '.join([str(e) for e in list(row)])
         row_lwr = row.lower().strip()
-        if "trans date" in row_lwr:
+        if HEADER_MARKER in row_lwr:
             # print("in")
             in_table = True
             continue
-        elif in_table and ("additional information" in row_lwr
-                           or "transaction" in row_lwr
-                           or "capital one" in row_lwr
-                           or "total fees" in row_lwr
-                           or "interest charge" in row_lwr):
+        elif in_table and any(m in row_lwr for m in FOOTER_MARKERS):
             # print("out")
             in_table = False
             continue
@@ -82,15 +75,277 @@ def scrape_page(page, data):
                 data["amount"].append("")
     return data
 
+
+def scrape_page_vec(page, data):
+    """Vectorized version of `scrape_page`, producing the same rows.
+    Rows are joined (src.extract.page_rows) and scraped with `scrape_rows`.
+    """
+    return scrape_rows(page_rows(page), data)
+
+
+def scrape_rows(rows, data):
+    """Scrape the transactions from the rows of a table or page, as strings
+    with cells separated by spaces (from an extraction backend).
+    Rows are searched with pandas string ops, and the in-table state is a
+    forward-filled mask that switches on at each "trans date" header and off
+    at each footer marker.
+    """
+    import numpy as np
+    import pandas as pd
+    rows = pd.Series(rows, dtype=object)
+    if len(rows) == 0:
+        return data
+    row_lwr = rows.str.lower().str.strip()
+
+    is_header = row_lwr.str.contains(HEADER_MARKER, regex=False)
+    is_footer = ~is_header & row_lwr.str.contains("|".join(FOOTER_MARKERS))
+    state = pd.Series(np.where(is_header, 1.0, np.where(is_footer, 0.0, np.nan)))
+    in_table = state.ffill().fillna(0).astype(bool) & ~is_header
+    if not in_table.any():
+        return data
+    row_split = rows[in_table].str.split(" ")
+
+    # get date
+    dates = format_dates(row_split.str[0:2].str.join(" "), year=None)
+    if (dates == "").any():
+        print(f"Warning - failed to parse {(dates == '').sum()} date(s).")
+    data["date"] += dates.tolist()
+    # get payment descr
+    data["descr"] += row_split.str[4:-1].str.join(" ").tolist()
+    # get payment amount
+    amounts = format_nums(row_split.str[-1]).astype(object)
+    failed = np.isnan(amounts.astype(float))
+    if failed.any():
+        print(f"Warning - failed to parse {failed.sum()} transaction amount(s).")
+    amounts[failed] = ""
+    data["amount"] += amounts.tolist()
+    return data
+
+
+def fix_dates(dat, year=None, month=None):
+    """Convert the scraped data to a dataframe and give each date the year of
+    its statement period. `year` and `month` are when the statement period
+    ends (see src.parsing.statement_period); the month is inferred from the
+    transactions if None, so December charges on a January statement get the
+    previous year.
+    """
+    import pandas as pd
+    dat = pd.DataFrame(dat)
+    dates = dat.date.astype(object).astype(str)
+    ok = dates.str.len() == 10
+    years = infer_years(dates[ok].str[5:7].astype(int),
+                        YEAR if year is None else year, month)
+    dates[ok] = pd.Series(years, index=dates[ok].index).astype(str) + dates[ok].str[4:]
+    dat["date"] = pd.to_datetime(dates, format="%Y-%m-%d", errors="coerce")
+    if (ok & dat.date.isna()).any():
+        print(f"Warning - {(ok & dat.date.isna()).sum()} date(s) are not valid in the inferred year.")
+    dat["month"] = dat.date.dt.month
+    return dat
+
+
+def scrape_frames(frames):
+    """Scrape the transactions from a list of page dataframes."""
+    dat = init_data()
+    for pg in frames:
+        with timer("scrape.page"):
+            dat = scrape_page_vec(pg, dat)
+        count("scrape.rows", pg.shape[0])
+    count("scrape.transactions", len(dat["date"]))
+    return dat
+
+
+def scrape_pdf(pdf_filename, area, pages, backend="tabula"):
+    """Read a statement PDF (or some of its pages) with an extraction
+    backend (src.extract) and scrape the transactions, a table or page at a
+    time as the backend reads them."""
+    backend = get_backend(backend) if isinstance(backend, str) else backend
+    dat = init_data()
+    for rows in backend.rows(pdf_filename, area, pages):
+        with timer("scrape.page"):
+            dat = scrape_rows(rows, dat)
+        count("scrape.rows", len(rows))
+    count("scrape.transactions", len(dat["date"]))
+    return dat
+
+
+def scrape_pdf_layout(pdf_filename, area, layout=None):
+    """Scrape a statement using a layout from src.layout: only its pages,
+    and only the transaction table area of each. If there is no layout, or
+    what was read doesn't pass src.layout.check_frames, the whole statement
+    is scanned (in `area`) and its layout detected.
+    Returns (data, layout), where layout is None if it was used as given,
+    else the newly detected one (None if none was found).
+    """
+    if layout:
+        try:
+            frames = [(p, read_pdf(pdf_filename, area=layout["areas"][str(p)], pages=[p],
+                                   pandas_options={"header": None}))
+                      for p in layout["pages"]]
+            ok = check_frames(frames, HEADER_MARKER, FOOTER_MARKERS)
+        except Exception:
+            ok = False # e.g. fewer pages than the layout
+        if ok:
+            count("layout.hits")
+            return scrape_frames([df for _, dfs in frames for df in dfs]), None
+        count("layout.fallbacks")
+    tables = read_pdf(pdf_filename, area=area, pages="all", output_format="json")
+    new = detect_layout(tables, HEADER_MARKER, FOOTER_MARKERS)
+    if new is not None:
+        count("layout.detected")
+    return scrape_frames(json_frames(tables)), new
+
+
+def parse_pdf(pdf_filename, area, pages, year=None, backend="tabula"):
+    """Extract the transactions from one statement PDF into a dataframe."""
+    return fix_dates(scrape_pdf(pdf_filename, area=area, pages=pages, backend=backend),
+                     *statement_period(pdf_filename, year))
+
+
+def split_pages(pages, chunk_size=None):
+    """Split a list of pages into chunks that can be read independently.
+    Pages are scraped independently, so the chunks of a PDF can be parsed in
+    parallel and concatenated afterwards.
+    """
+    if pages == "all" or not chunk_size:
+        return [pages]
+    return [pages[i:i + chunk_size] for i in range(0, len(pages), chunk_size)]
+
+
+# set in pool workers, whose metrics are sent back with each task's result
+_IN_WORKER = False
+
+
+def parse_task(task):
+    """Scrape one (pdf_filename, area, pages, layout, backend) task. `layout`
+    is None to read the pages as given, else a layout dict for
+    `scrape_pdf_layout` (empty if none is known yet, tabula only), and
+    `backend` is the name of the extraction backend.
+    Returns (data, seconds, error, metrics, new layout), where error is None
+    on success, metrics is the task's METRICS snapshot when run in a pool
+    worker, and new layout is a layout detected by the task (or None).
+    """
+    pdf_filename, area, pages, layout, backend = task
+    if _IN_WORKER:
+        METRICS.reset()
+    t0 = time.perf_counter()
+    new = None
+    try:
+        if layout is None:
+            dat = scrape_pdf(pdf_filename, area=area, pages=pages, backend=backend)
+        else:
+            dat, new = scrape_pdf_layout(pdf_filename, area=area, layout=layout)
+        err = None
+    except Exception as e:
+        dat, err = None, f"{type(e).__name__}: {e}"
+    return (dat, time.perf_counter() - t0, err,
+            METRICS.snapshot() if _IN_WORKER else None, new)
+
+
+def _init_worker(quiet):
+    # the JVM is started by the first read in each worker and then kept warm
+    # for every later task that worker picks up
+    global _IN_WORKER
+    _IN_WORKER = True
+    if quiet:
+        global print
+        def print(*args, **kwargs):
+            pass
+
+
+def run_tasks(tasks, workers=1, quiet=False):
+    """Yield the result of each task, in the same order as `tasks`.
+    If workers > 1 the tasks are fanned out over a pool of processes.
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield parse_task(task)
+        return
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_worker,
+                             initargs=(quiet,)) as ex:
+        yield from ex.map(parse_task, tasks)
+
+
+def iter_parsed(pdfs, area, pages, split=None, workers=1, quiet=False, cache=None,
+                layouts=None, template=None, backend="tabula"):
+    """Scrape each PDF, from the cache if possible, and yield
+    (data, seconds, error, cached) for each one in the same order as `pdfs`.
+    The PDFs that aren't cached are split into tasks and run with `run_tasks`.
+    With a src.layout.LayoutCache (`layouts`), whole statements are read
+    using `template`'s cached layout, and layouts detected on the way are
+    saved to it. `backend` names the src.extract backend to read PDFs with.
+    """
+    layout = None
+    if layouts is not None:
+        layout = layouts.get(template) or {}
+        pages, split = "all", None
+    keys = [None for _ in pdfs]
+    hits = [None for _ in pdfs]
+    if cache is not None:
+        # layout mode can see rows a full page scan doesn't, keep them apart
+        cache_area = area if layouts is None else ["layout", template, area]
+        if backend != "tabula":
+            cache_area = [backend, cache_area]
+        for i, fp in enumerate(pdfs):
+            keys[i] = cache.key(fp, cache_area, pages)
+            hits[i] = cache.get(keys[i])
+    tasks = []
+    n_chunks = [0 for _ in pdfs]
+    for i, fp in enumerate(pdfs):
+        if hits[i] is None:
+            for chunk in split_pages(pages, split):
+                tasks.append((fp, area, chunk, layout, backend))
+                n_chunks[i] += 1
+    # results come back in task order, so the chunks of each PDF are consecutive
+    results = run_tasks(tasks, workers, quiet)
+    for i, fp in enumerate(pdfs):
+        if hits[i] is not None:
+            yield hits[i], 0.0, None, True
+            continue
+        dat, seconds, error = init_data(), 0.0, None
+        for _ in range(n_chunks[i]):
+            chunk, secs, err, task_metrics, new_layout = next(results)
+            if task_metrics is not None:
+                METRICS.merge(task_metrics)
+            if new_layout is not None and new_layout != layout:
+                # every task shares the layout dict, so without a pool the
+                # next PDFs already use the new one (pool tasks were sent
+                # with the old one, later runs use it)
+                layouts.put(template, new_layout)
+                layout.clear()
+                layout.update(new_layout)
+            seconds += secs
+            if err is not None:
+                error = err
+            else:
+                for k, v in chunk.items():
+                    dat[k] += v
+        if error is None and cache is not None:
+            cache.put(keys[i], dat)
+        yield dat, seconds, error, False
+
+
+def default_output(pdf_filename, out_dir="."):
+    file = ''.join(str(pdf_filename.name).split(".")[:-1])
+    return Path(out_dir) / f"{file}.txt"
+
+
 parser = argparse.ArgumentParser(
     prog="capital_one.py",
-    description="Convert your CapitalOne statement PDF into a delimited text file.",
-    epilog=""
+    description="Convert your CapitalOne statement PDF(s) into delimited text file(s).",
+    epilog="Multiple PDFs, directories or glob patterns are parsed in one process, so Java is validated and the JVM started only once."
 )
-parser.add_argument("pdf_filename")
+parser.add_argument("pdf_filename",
+                    nargs="*",
+                    help="Statement PDF(s) to parse. Directories (all *.pdf inside) and glob patterns like 'statements/**/*.pdf' are expanded."
+                    )
+parser.add_argument("-f", "--file-list",
+                    default=None,
+                    help="A text file listing PDF paths to parse, one per line."
+                    )
 parser.add_argument("-o", "--output",
                     default=None,
-                    help="The path to save the script output to. Default is to save it to the working directory with the same name as the input."
+                    help="The path to save the script output to. Default is to save it to the working directory with the same name as the input. When parsing multiple PDFs this is a directory, and each output is named after its input."
                     )
 parser.add_argument("-p", "--pages",
                     default="all",
@@ -102,60 +357,175 @@ parser.add_argument("-a", "--area",
                     default="0,0,2480,3508",
                     help="Portion of the page to analyze(top,left,bottom,right). Defaults to (0,0,2480,3508), which tends to work. See https://tabula-py.readthedocs.io/en/latest/tabula.html#tabula.io.read_pdf"
                     )
+parser.add_argument("-y", "--year",
+                    type=int,
+                    default=None,
+                    help="The year the statement period ends in. Defaults to the MMYYYY date in the PDF file name (e.g. Statement_112023.pdf), or the current year. Transactions from the end of the previous year get that year."
+                    )
 parser.add_argument("-d", "--delim",
                     default="|",
                     help="The delimiter to use for the outputted delimited text file. Defaults to the pipe `|`.")
+parser.add_argument("-w", "--workers",
+                    type=int,
+                    default=1,
+                    help="Number of worker processes to parse PDFs with. Each worker keeps its own JVM alive. Defaults to 1 (no pool)."
+                    )
+parser.add_argument("--split-pages",
+                    type=int,
+                    default=None,
+                    metavar="N",
+                    help="With --pages, split each PDF into tasks of N pages so the pages of a large PDF are also parsed in parallel."
+                    )
+parser.add_argument("-m", "--merge",
+                    action="store_true",
+                    help="Write every transaction to a single output file (-o), in the order the PDFs were given, with a 'statement' column naming the source PDF."
+                    )
+parser.add_argument("-b", "--backend",
+                    choices=list(BACKENDS),
+                    default="tabula",
+                    help="How to read the PDFs: 'tabula' (needs Java) finds the tables, 'text' reads the text lines of each page with pdfminer.six, without Java. Defaults to 'tabula'."
+                    )
+parser.add_argument("--layout",
+                    action="store_true",
+                    help="Read only the transaction tables: their pages and areas are found on the first statement scanned in full, cached per --template, and reused for later statements. Statements that don't match the cached layout are scanned in full and their layout cached instead. Ignores --pages."
+                    )
+parser.add_argument("--template",
+                    default="capital_one",
+                    help="Name the layout is cached under with --layout, e.g. to keep statements with different layouts apart. Defaults to 'capital_one'."
+                    )
+parser.add_argument("--no-cache",
+                    action="store_true",
+                    help="Always extract from the PDF, ignoring (and not updating) the cache of previously parsed statements."
+                    )
+parser.add_argument("--cache-dir",
+                    default=None,
+                    help="Where to cache parsed statements, keyed by PDF content, area and pages. Defaults to ~/.cache/capital_one."
+                    )
+parser.add_argument("--cache-size",
+                    type=float,
+                    default=256,
+                    metavar="MB",
+                    help="Maximum size of the cache in MB, least recently used entries are removed first. Defaults to 256."
+                    )
 parser.add_argument("-q", "--quiet",
                     action="store_true",
                     help="If this flag is used the script is executed without printing info.")
+parser.add_argument("--metrics",
+                    default=None,
+                    metavar="FILE",
+                    help="Save timings (PDF extraction, row scraping), counters (PDFs, tables, rows, cache hits) and peak memory as JSON to FILE. Worker processes' timings are included."
+                    )
+parser.add_argument("--profile",
+                    default=None,
+                    metavar="FILE",
+                    help="Profile the run with cProfile and dump the stats to FILE (view with snakeviz or flameprof). Only the main process is profiled."
+                    )
 
 if __name__ == "__main__":
     args = parser.parse_args()
+    metrics.enable(metrics_fp=args.metrics, profile_fp=args.profile)
     if args.quiet:
         def print(*args, **kwargs):
             pass
 
-    validate_java(verbose=True)
     # process args
-    args.pdf_filename = Path(args.pdf_filename)
-    assert args.pdf_filename.exists()
+    pdfs = collect_pdfs(args.pdf_filename, args.file_list)
+    if len(pdfs) == 0:
+        parser.error("no PDF files given or found")
+    for fp in pdfs:
+        assert fp.exists(), f"{fp} does not exist"
+    batch = len(pdfs) > 1 and not args.merge
 
-    if args.output is None:
-        file = ''.join(str(args.pdf_filename.name).split(".")[:-1])
-        args.output = f"./{file}.txt"
+    if batch:
+        out_dir = Path(args.output if args.output is not None else ".")
+        out_dir.mkdir(parents=True, exist_ok=True)
+    elif args.output is None:
+        args.output = default_output(pdfs[0]) if len(pdfs) == 1 else "./merged.txt"
 
     args.area = [int(a) for a in args.area.split(",")]
     assert len(args.area) == 4
     if args.pages != "all":
         args.pages = [int(p) for p in args.pages.split(",")]
         assert len(args.pages) > 0
+    assert args.workers >= 1
 
-    # Process pdf
-    print(f"Extracting text from {args.pdf_filename}")
+    # the java version is cached next to the parsed statements
+    java_cache = None if args.no_cache else \
+        Path(args.cache_dir or default_cache_dir()) / "java_version.json"
+    if args.layout and args.backend != "tabula":
+        parser.error("--layout needs the tabula backend")
+    if get_backend(args.backend).needs_java:
+        validate_java(verbose=True, cache_fp=java_cache)
+        check_jpype(verbose=True)
+
+    # Process pdf(s)
+    print(f"Extracting text from {len(pdfs)} PDF(s)")
     print(f" - pages: {args.pages}")
     print(f" - extraction area: {args.area}")
-    pdf = tabula.read_pdf(args.pdf_filename,
-                          area=args.area,
-                          pages=args.pages)
+    print(f" - backend: {args.backend}")
+    if args.workers > 1:
+        print(f" - workers: {args.workers}")
+    cache = None
+    if not args.no_cache:
+        cache = StatementCache(args.cache_dir, max_bytes=int(args.cache_size * 2**20))
 
-    print(f"Extracting data from text")
-    dat = init_data()
-    for pg in pdf:
-        dat = scrape_page(pg, dat)
- 
-    # convert to dataframe and address corner cases in date
-    dat = pd.DataFrame(dat)
-    # if it's january, we may have transactions from december of last year
-    dat["date"] = pd.to_datetime(dat.date)
-    dat["month"] = dat.date.dt.month
-    if dat.month.mode().item() == 1:
-        dat.loc[dat.month == 12, "date"] = dat.loc[dat.month == 12,
-                                                   ].date.astype(str).str.replace(str(YEAR), str(YEAR-1))
-
-    # save
-    print(f"Saving to {args.output}")
-    pd.DataFrame(dat).to_csv(
-        args.output,
-        sep=args.delim,
-        index=False
-    )
+    timings = []
+    failed = []
+    merged = []
+    start = time.perf_counter()
+    layouts = None
+    if args.layout:
+        layouts = LayoutCache(Path(args.cache_dir or default_cache_dir()) / "layouts.json")
+        if layouts.get(args.template) is None:
+            print(f" - layout: not cached yet for '{args.template}', scanning the first statement in full")
+        else:
+            print(f" - layout: cached for '{args.template}'")
+    parsed = iter_parsed(pdfs, args.area, args.pages, split=args.split_pages,
+                         workers=args.workers, quiet=args.quiet, cache=cache,
+                         layouts=layouts, template=args.template, backend=args.backend)
+    for fp, (dat, secs, err, cached) in zip(pdfs, parsed):
+        if err is not None:
+            print(f"Warning - failed to parse {fp}, skipping.\n{err}")
+            failed.append(fp)
+            continue
+        if cached:
+            print(f"Loaded {fp} from cache")
+        with timer("parse.fix_dates"):
+            dat = fix_dates(dat, *statement_period(fp, args.year))
+        timings.append((fp, len(dat), secs, cached))
+        if args.merge:
+            dat.insert(0, "statement", fp.name)
+            merged.append(dat)
+            continue
+
+        # save
+        output = default_output(fp, out_dir) if batch else args.output
+        print(f"Saving to {output}")
+        with timer("output.write"):
+            dat.to_csv(
+                output,
+                sep=args.delim,
+                index=False
+            )
+
+    if args.merge and merged:
+        import pandas as pd
+        print(f"Saving to {args.output}")
+        with timer("output.write"):
+            pd.concat(merged, axis=0, ignore_index=True).to_csv(
+                args.output,
+                sep=args.delim,
+                index=False
+            )
+
+    total = time.perf_counter() - start
+    if len(pdfs) > 1:
+        print("Timings:")
+        for fp, n, secs, cached in timings:
+            print(f" - {fp.name}: {n} transactions in {secs:.2f}s" + (" (cached)" if cached else ""))
+    print(f"Parsed {len(timings)} PDF(s) in {total:.2f}s"
+          + (f" ({total / len(timings):.2f}s per PDF)" if timings else ""))
+    if cache is not None and cache.hits:
+        print(f"{cache.hits} of {len(pdfs)} PDF(s) loaded from cache")
+    if failed:
+        raise SystemExit(f"Failed to parse {len(failed)} PDF(s): {', '.join(str(f) for f in failed)}")
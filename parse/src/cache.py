@@ -0,0 +1,97 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+from common.metrics import count
+
+# bump when the scraped output for the same PDF changes, to invalidate old entries
+CACHE_VERSION = 1
+
+
+def default_cache_dir():
+    return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "capital_one"
+
+
+def file_hash(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class StatementCache:
+    """On-disk cache of scraped statement data.
+    Entries are keyed by the PDF's content hash plus the extraction area and
+    pages, and stored as compressed columnar .npz files. Once the cache grows
+    past `max_bytes` the least recently used entries are removed.
+    """
+    def __init__(self, cache_dir=None, max_bytes=256 * 2**20):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else default_cache_dir()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, pdf_filename, area, pages):
+        return hashlib.sha256(json.dumps(
+            [CACHE_VERSION, file_hash(pdf_filename), area, pages]
+        ).encode()).hexdigest()
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.npz"
+
+    def get(self, key):
+        """Returns the cached data dict, or None if the key isn't cached."""
+        import numpy as np
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as f:
+                amount = f["amount"].astype(object)
+                amount[np.isnan(f["amount"])] = ""
+                data = {
+                    "date": f["date"].tolist(),
+                    "descr": f["descr"].tolist(),
+                    "amount": amount.tolist()
+                }
+        except (FileNotFoundError, KeyError, ValueError, OSError):
+            self.misses += 1
+            count("cache.misses")
+            return None
+        os.utime(path) # mark as recently used
+        self.hits += 1
+        count("cache.hits")
+        return data
+
+    def put(self, key, data):
+        import numpy as np
+        # amounts that failed to parse are "" in the data, NaN in the cache
+        amount = np.array([np.nan if a == "" else a for a in data["amount"]], dtype=float)
+        tmp = self.cache_dir / f"{key}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f,
+                                date=np.array(data["date"], dtype=str),
+                                descr=np.array(data["descr"], dtype=str),
+                                amount=amount)
+        os.replace(tmp, self._path(key))
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for p in self.cache_dir.glob("*.npz"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        total = sum(e[1] for e in entries)
+        for _, size, p in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            p.unlink(missing_ok=True)
+            total -= size
+
+    def clear(self):
+        for p in self.cache_dir.glob("*.npz"):
+            p.unlink(missing_ok=True)
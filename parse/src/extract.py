@@ -0,0 +1,151 @@
+from common.metrics import timer, count
+
+# Extraction backends turn a statement PDF into rows of text, which the
+# scraper in capital_one.py searches for the transactions table. tabula
+# finds the tables (in Java) and its cells are joined back into rows; the
+# text backend reads the text of each page directly with pdfminer.six and
+# rebuilds the rows from the positions of the characters, without a JVM.
+
+
+def read_pdf(pdf_filename, area, pages, **kwargs):
+    """Read the tables from a statement PDF with tabula.
+    With jpype installed the JVM is started on the first call and kept alive
+    for the rest of the process, so later calls skip JVM startup.
+    Other keyword arguments are passed on to tabula.read_pdf.
+    """
+    import tabula
+    with timer("pdf.extract"):
+        tables = tabula.read_pdf(pdf_filename,
+                                 area=area,
+                                 pages=pages,
+                                 force_subprocess=False,
+                                 **kwargs)
+    count("pdf.reads")
+    count("pdf.tables", len(tables))
+    return tables
+
+
+def page_rows(page):
+    """The rows of a tabula dataframe as strings, cells joined by spaces."""
+    import pandas as pd
+    if page.shape[0] == 0 or page.shape[1] == 0:
+        return pd.Series([], dtype=object)
+    # same values (and dtype upcasting) that iterrows would give, and numpy's
+    # astype(str) calls str() on each cell, so NaN becomes "nan" as in the loop
+    vals = pd.DataFrame(page.values.astype(str))
+    rows = vals[0]
+    if vals.shape[1] > 1:
+        rows = rows.str.cat([vals[c] for c in vals.columns[1:]], sep=" ")
+    return rows
+
+
+class ExtractionBackend:
+    """Reads the text rows of a statement PDF.
+    name - identifies the backend, part of the parse cache key since
+           backends can split rows slightly differently
+    needs_java - whether a Java runtime has to be checked for first
+    rows(pdf_filename, area, pages) - yields a list of row strings (cells
+           separated by spaces) for each table or page, in page order
+    """
+    name = None
+    needs_java = False
+
+    def rows(self, pdf_filename, area, pages):
+        raise NotImplementedError
+
+
+class TabulaBackend(ExtractionBackend):
+    """Tables detected by tabula-py (see read_pdf)."""
+    name = "tabula"
+    needs_java = True
+
+    def rows(self, pdf_filename, area, pages):
+        for page in read_pdf(pdf_filename, area=area, pages=pages):
+            yield page_rows(page).tolist()
+
+
+class TextBackend(ExtractionBackend):
+    """Text lines of each page, read with pdfminer.six (pure Python).
+    Characters are grouped into lines by their baseline (within `line_tol`
+    points) and sorted left to right, with a space wherever the gap to the
+    previous character is over `space_gap` of the font size, so table cells
+    come out separated by spaces like tabula's joined rows. `area`
+    (top, left, bottom, right in points from the top left, as for tabula)
+    limits which characters are kept.
+    """
+    name = "text"
+
+    def __init__(self, line_tol=2.0, space_gap=0.15):
+        self.line_tol = line_tol
+        self.space_gap = space_gap
+
+    def _chars(self, obj):
+        from pdfminer.layout import LTChar
+        for o in obj:
+            if isinstance(o, LTChar):
+                yield o
+            elif hasattr(o, "__iter__"):
+                yield from self._chars(o)
+
+    def page_lines(self, page, area=None):
+        """The text lines of a pdfminer LTPage, top to bottom."""
+        chars = []
+        for c in self._chars(page):
+            top = page.height - c.y1
+            if area is not None and not (area[0] <= top and page.height - c.y0 <= area[2]
+                                         and area[1] <= c.x0 and c.x1 <= area[3]):
+                continue
+            chars.append(c)
+        chars.sort(key=lambda c: (-c.y0, c.x0))
+        lines, line, base = [], [], None
+        for c in chars:
+            if base is not None and abs(c.y0 - base) > self.line_tol:
+                lines.append(line)
+                line = []
+            if not line:
+                base = c.y0
+            line.append(c)
+        if line:
+            lines.append(line)
+        out = []
+        for line in lines:
+            line.sort(key=lambda c: c.x0)
+            txt, prev = [], None
+            for c in line:
+                if prev is not None and c.x0 - prev.x1 > self.space_gap * max(c.size, 1.0):
+                    txt.append(" ")
+                txt.append(c.get_text())
+                prev = c
+            txt = " ".join("".join(txt).split())
+            if txt:
+                out.append(txt)
+        return out
+
+    def rows(self, pdf_filename, area, pages):
+        from pdfminer.high_level import extract_pages
+        page_numbers = None if pages == "all" else [p - 1 for p in pages]
+        # without layout analysis (laparams=None) pages are just characters
+        it = extract_pages(pdf_filename, page_numbers=page_numbers, laparams=None)
+        count("pdf.reads")
+        while True:
+            # timed a page at a time, not while the caller scrapes it
+            with timer("pdf.extract"):
+                page = next(it, None)
+                lines = None if page is None else self.page_lines(page, area)
+            if page is None:
+                return
+            count("pdf.pages")
+            yield lines
+
+
+BACKENDS = {
+    "tabula": TabulaBackend,
+    "text": TextBackend
+}
+
+
+def get_backend(name, **kwargs):
+    """Make an extraction backend by name ('tabula' or 'text')."""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown extraction backend '{name}', choose from {list(BACKENDS)}")
+    return BACKENDS[name](**kwargs)
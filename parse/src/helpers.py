@@ -1,4 +1,10 @@
+import os
+import json
+import shutil
 import subprocess
+import importlib.util
+from pathlib import Path
+from glob import glob
 
 def vtofloat(vers):
     ls = vers.split('.')
@@ -7,15 +13,25 @@ def vtofloat(vers):
     return float('.'.join(ls[startidx:endidx]))
 
 
-def validate_java(verbose = True):
-    if not verbose:
-        def stdout(*args, **kwargs):
+def java_version(cache_fp = None):
+    """The version string reported by `java -version`.
+    With cache_fp the result is kept in that json file, keyed by the resolved
+    path and mtime of the java binary, so the JVM is only started again when
+    java is replaced or upgraded.
+    """
+    key = None
+    java = shutil.which("java")
+    if cache_fp is not None and java is not None:
+        java = os.path.realpath(java)
+        key = [java, os.stat(java).st_mtime_ns]
+        try:
+            with open(cache_fp, "r") as f:
+                cached = json.load(f)
+            if cached["key"] == key:
+                return cached["version"]
+        except (OSError, ValueError, KeyError, TypeError):
             pass
-    else:
-        def stdout(*args, **kwargs):
-            print(*args, **kwargs)
 
-    stdout("This script uses tabula-py, which requires a Java runtime, version 8+. Checking Java version...")
     out = subprocess.run(["java", "-version"], capture_output=True, text=True)
     if out.returncode > 0:
         raise SystemExit(out.stderr) #forward stderr msg from java
@@ -26,6 +42,29 @@ def validate_java(verbose = True):
             break
         version += char
     version = version.replace('"', "").replace("'", "")
+
+    if key is not None:
+        try:
+            Path(cache_fp).parent.mkdir(parents=True, exist_ok=True)
+            tmp = f"{cache_fp}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump({"key": key, "version": version}, f)
+            os.replace(tmp, cache_fp)
+        except OSError:
+            pass # just check again next time
+    return version
+
+
+def validate_java(verbose = True, cache_fp = None):
+    if not verbose:
+        def stdout(*args, **kwargs):
+            pass
+    else:
+        def stdout(*args, **kwargs):
+            print(*args, **kwargs)
+
+    stdout("This script uses tabula-py, which requires a Java runtime, version 8+. Checking Java version...")
+    version = java_version(cache_fp)
     stdout(f"Found Java version {version},", end=" ")
     v_num = vtofloat(version)
 
@@ -34,5 +73,44 @@ def validate_java(verbose = True):
     else:
         stdout("this version may be too low. Continuing, but be prepared for an error.")
 
+
+def check_jpype(verbose = True):
+    """tabula-py runs its Java library in-process through jpype when it is
+    installed, so the JVM is started once and reused by every later read.
+    Without jpype each read spawns a new `java` subprocess.
+    """
+    found = importlib.util.find_spec("jpype") is not None
+    if not found and verbose:
+        print("Warning - jpype is not installed, tabula will start a new JVM for every PDF. Install jpype1 to reuse one JVM.")
+    return found
+
+
+def collect_pdfs(paths, file_list = None):
+    """Expand files, directories and glob patterns into a sorted, de-duplicated
+    list of PDF paths. `file_list` is an optional text file with one path per line.
+    """
+    paths = list(paths)
+    if file_list is not None:
+        with open(file_list, "r") as f:
+            paths += [l.strip() for l in f if l.strip() and not l.startswith("#")]
+    pdfs = []
+    for p in paths:
+        p = str(p)
+        if Path(p).is_dir():
+            pdfs += sorted(Path(p).glob("*.pdf")) + sorted(Path(p).glob("*.PDF"))
+        elif any(c in p for c in "*?["):
+            pdfs += [Path(g) for g in sorted(glob(p, recursive=True))]
+        else:
+            pdfs.append(Path(p))
+    out = []
+    seen = set()
+    for p in pdfs:
+        key = p.resolve()
+        if key not in seen:
+            seen.add(key)
+            out.append(p)
+    return out
+
+
 if __name__ == "__main__":
     validate_java()
\ No newline at end of file
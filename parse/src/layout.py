@@ -0,0 +1,119 @@
+import os
+import json
+from pathlib import Path
+
+# Where the transactions are on a statement's pages, learned from a full
+# scan and reused for later statements from the same template: only the
+# pages with transactions are read, and only the part of each page from
+# the "Trans Date" header down (from the top of the table on pages it
+# continues onto), so tabula and the scraper see far fewer rows.
+# A layout is {"pages": [page numbers], "areas": {page: [top, left, bottom, right]}}
+# in PDF points, as tabula's `area` option takes them.
+
+LAYOUT_VERSION = 1
+
+
+def row_text(row):
+    """Lowercased text of a row of tabula json cells."""
+    return " ".join(c["text"] for c in row).lower().strip()
+
+
+def detect_layout(tables, header, footers, pad=12.0, page_bottom=3508.0):
+    """Find the transaction table regions in tabula's json output for a full
+    page scan. The area kept for a page starts just above its first header
+    row, or above its first row on a page a table continues onto without a
+    header, and runs to the bottom of the page (the number of transactions
+    varies from statement to statement), between the sides of its tables.
+    Returns the layout, or None if no header was found or the last table
+    isn't closed by a footer row (it may continue on a page not scanned).
+    """
+    areas = {}
+    in_table = False
+    for t in tables:
+        page = int(t["page_number"])
+        if in_table and page not in areas and t["data"]:
+            # continued from the page before
+            top = min(c["top"] for c in t["data"][0]) - pad
+            areas[page] = [top, t["left"] - pad, page_bottom, t["right"] + pad]
+        for row in t["data"]:
+            txt = row_text(row)
+            if header in txt:
+                in_table = True
+                top = min(c["top"] for c in row) - pad
+                a = areas.setdefault(page, [top, t["left"] - pad, page_bottom, t["right"] + pad])
+                a[0] = min(a[0], top)
+            elif in_table and any(m in txt for m in footers):
+                in_table = False
+        if page in areas:
+            areas[page][1] = min(areas[page][1], t["left"] - pad)
+            areas[page][3] = max(areas[page][3], t["right"] + pad)
+    if not areas or in_table:
+        return None
+    return {"pages": sorted(areas),
+            "areas": {str(p): [round(max(v, 0.0), 1) for v in a] for p, a in areas.items()}}
+
+
+def json_frames(tables):
+    """tabula's json tables as dataframes, keeping every row (the first row
+    isn't used as column names) and empty cells as NaN, like
+    read_pdf(..., pandas_options={"header": None})."""
+    import numpy as np
+    import pandas as pd
+    return [pd.DataFrame([[c["text"] or np.nan for c in row] for row in t["data"]])
+            for t in tables]
+
+
+def check_frames(frames_by_page, header, footers):
+    """Whether the tables read with a cached layout look complete: every
+    page's area starts at a header row, or continues a table from the page
+    before, and the last table is closed by a footer row, so nothing was cut
+    off above or continues past the last page.
+    `frames_by_page` is a list of (page, [dataframes]) in page order.
+    """
+    in_table = False
+    for _, frames in frames_by_page:
+        rows = [" ".join(map(str, r)).lower().strip()
+                for df in frames for r in df.itertuples(index=False)]
+        if not in_table and not any(header in r for r in rows):
+            return False
+        for r in rows:
+            if header in r:
+                in_table = True
+            elif in_table and any(m in r for m in footers):
+                in_table = False
+    return bool(frames_by_page) and not in_table
+
+
+class LayoutCache:
+    """Layouts by template name (e.g. the issuer), in one json file."""
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return data if data.get("version") == LAYOUT_VERSION else {}
+
+    def get(self, template):
+        return self._load().get("layouts", {}).get(template)
+
+    def put(self, template, layout):
+        data = self._load() or {"version": LAYOUT_VERSION, "layouts": {}}
+        data["layouts"][template] = layout
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def clear(self, template=None):
+        data = self._load()
+        if template is None or not data:
+            self.path.unlink(missing_ok=True)
+            return
+        data["layouts"].pop(template, None)
+        with open(self.path, "w") as f:
+            json.dump(data, f, indent=1)
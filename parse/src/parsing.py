@@ -0,0 +1,107 @@
+import re
+import calendar
+from datetime import datetime
+from functools import lru_cache
+from common.statements import statement_month
+
+MONTHS = {mnth.lower(): idx for idx, mnth
+          in enumerate(calendar.month_abbr) if mnth}
+
+YEAR = datetime.now().year
+
+# characters to drop from an amount like "$1,234.56"
+AMOUNT_RE = re.compile(r"[^\d\.]")
+# what float() accepts once AMOUNT_RE has been applied
+AMOUNT_VALID_RE = re.compile(r"\d+\.?\d*|\.\d+")
+
+
+@lru_cache(maxsize=1024)
+def format_date(date_str, year=None):
+    """Convert "Mon DD" into an ISO "YYYY-MM-DD" string.
+    Memoized, since a statement has at most ~366 distinct dates.
+    Raises an exception if the string is not a valid month and day.
+    """
+    m, d = date_str.lower().strip().split(" ")
+    m, d = MONTHS[m.strip()], int(d)
+    datetime(2000, m, d) # validate the day (2000 is a leap year)
+    if year is None:
+        year = YEAR
+    return f"{year}-{m:02d}-{d:02d}"
+
+
+def format_num(num_str):
+    return float(AMOUNT_RE.sub("", num_str))
+
+
+def format_dates(date_strs, year=None):
+    """Bulk `format_date`: array of "Mon DD" strings in, array of ISO date
+    strings out. Each distinct value is parsed once, and values that can't be
+    parsed become "".
+    """
+    import numpy as np
+    date_strs = np.asarray(date_strs, dtype=str)
+    if date_strs.size == 0:
+        return np.array([], dtype=object)
+    uniq, inv = np.unique(date_strs, return_inverse=True)
+    table = np.empty(len(uniq), dtype=object)
+    for i, d in enumerate(uniq):
+        try:
+            table[i] = format_date(str(d), year)
+        except Exception:
+            table[i] = ""
+    return table[inv.reshape(-1)]
+
+
+def format_nums(num_strs):
+    """Bulk `format_num`: array of amount strings in, float64 array out.
+    Values that can't be parsed become NaN.
+    """
+    import numpy as np
+    import pandas as pd
+    cleaned = pd.Series(np.asarray(num_strs, dtype=str), dtype=object)
+    cleaned = cleaned.str.replace(AMOUNT_RE, "", regex=True)
+    valid = cleaned.str.fullmatch(AMOUNT_VALID_RE).to_numpy(dtype=bool)
+    out = np.full(len(cleaned), np.nan)
+    out[valid] = cleaned[valid].astype(float).values
+    return out
+
+
+def period_end_month(months):
+    """The last month of a statement period, given the months of its
+    transactions. A period can wrap around the new year (Dec -> Jan), so the
+    end is the month just before the largest gap in the circular sequence of
+    months seen.
+    """
+    ms = sorted(set(int(m) for m in months))
+    if len(ms) == 0:
+        return None
+    gaps = [((ms[(i + 1) % len(ms)] - m) % 12 or 12, m) for i, m in enumerate(ms)]
+    return max(gaps)[1]
+
+
+def infer_years(months, end_year, end_month=None):
+    """Year of each transaction, given the year and month its statement
+    period ends in. Each transaction gets the year that puts it closest to
+    that month, so December charges on a January statement fall in the
+    previous year. If `end_month` is None it is inferred from the months.
+    """
+    import numpy as np
+    months = np.asarray(months, dtype=int)
+    if end_month is None:
+        end_month = period_end_month(months)
+    if end_month is None:
+        return np.array([], dtype=int)
+    diff = months - end_month
+    return end_year - (diff > 6) + (diff < -6)
+
+
+def statement_period(pdf_filename, year=None):
+    """(year, month) of a statement, from a MMYYYY date in its file name
+    (e.g. Statement_112023.pdf). `year` overrides the year. When the name has
+    no date the month is None (inferred from the transactions) and the year
+    defaults to the current year.
+    """
+    period = statement_month(pdf_filename)
+    if period is None:
+        return (YEAR if year is None else year), None
+    return (period[0] if year is None else year), period[1]
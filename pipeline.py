@@ -0,0 +1,518 @@
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+# Run the whole workflow (parse -> concat -> embed -> classify -> stats) as
+# one incremental pipeline. Each stage declares its inputs, outputs and
+# parameters; their fingerprints are kept in .pipeline/state.json, and a
+# stage only reruns when one of them changed or an output is missing.
+# Within a stage only the new rows are processed where that is expensive:
+# only new/changed PDFs are parsed and only new descriptions are embedded.
+
+ROOT = Path(__file__).resolve().parent
+ANALYSIS = ROOT / "analysis"
+
+
+def file_sha(fp, known=None):
+    """Content hash of a file. `known` is its last [size, mtime_ns, sha],
+    reused without reading the file if the size and mtime still match."""
+    st = os.stat(fp)
+    if known is not None and known[:2] == [st.st_size, st.st_mtime_ns]:
+        return known
+    h = hashlib.sha256()
+    with open(fp, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            h.update(block)
+    return [st.st_size, st.st_mtime_ns, h.hexdigest()]
+
+
+def load_script(name):
+    """Import one of the analysis scripts (they aren't importable by name)."""
+    if str(ANALYSIS) not in sys.path:
+        sys.path.insert(0, str(ANALYSIS))
+    spec = importlib.util.spec_from_file_location(f"analysis_{name}", ANALYSIS / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Stage:
+    """A step of the pipeline.
+    inputs/outputs - functions returning lists of paths, called when the
+                     stage is checked (so they can glob what earlier stages made)
+    run - function(changed_inputs, rebuild) doing the work, `rebuild` is
+          True when the parameters changed so earlier outputs can't be reused
+    params - anything else the outputs depend on (must be JSON serializable)
+    deps - names of the stages that have to finish first
+    optional - skip the stage, instead of failing, if an input is missing
+    """
+    def __init__(self, name, inputs, outputs, run, params=None, deps=(), optional=False):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.run = run
+        self.params = params or {}
+        self.deps = list(deps)
+        self.optional = optional
+
+
+class Pipeline:
+    def __init__(self, stages, state_fp=ROOT / ".pipeline" / "state.json"):
+        self.stages = {s.name: s for s in stages}
+        self.state_fp = Path(state_fp)
+        self.state = {"files": {}, "stages": {}}
+        # stages run in threads, guard the state while it is updated or saved
+        self.lock = threading.Lock()
+        if self.state_fp.exists():
+            with open(self.state_fp) as f:
+                self.state = json.load(f)
+
+    def save_state(self):
+        self.state_fp.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_fp.with_suffix(".tmp")
+        with self.lock, open(tmp, "w") as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(tmp, self.state_fp)
+
+    def fingerprint(self, paths):
+        """{path: content hash} for paths, updating the known file hashes."""
+        out = {}
+        for fp in map(str, paths):
+            sha = file_sha(fp, self.state["files"].get(fp))
+            with self.lock:
+                self.state["files"][fp] = sha
+            out[fp] = sha[2]
+        return out
+
+    def check(self, stage):
+        """Returns (inputs, changed inputs, rebuild), or None if the stage is
+        up to date. `rebuild` means the parameters changed, so earlier
+        outputs can't be reused."""
+        inputs = [Path(p) for p in stage.inputs()]
+        missing = [p for p in inputs if not p.exists()]
+        if missing:
+            if stage.optional:
+                return None
+            raise FileNotFoundError(f"stage '{stage.name}' is missing input(s): "
+                                    + ", ".join(str(p) for p in missing))
+        last = self.state["stages"].get(stage.name)
+        if last is None or last["params"] != stage.params:
+            return inputs, inputs, True
+        shas = self.fingerprint(inputs)
+        changed = [p for p in inputs if last["inputs"].get(str(p)) != shas[str(p)]]
+        removed = set(last["inputs"]) - set(shas)
+        if changed or removed or not all(Path(p).exists() for p in stage.outputs()):
+            return inputs, changed, False
+        return None
+
+    def run_stage(self, stage, force=False):
+        from common.metrics import timer
+        if stage.optional and not all(Path(p).exists() for p in stage.inputs()):
+            return "skipped, missing inputs"
+        todo = self.check(stage)
+        if force:
+            inputs = [Path(p) for p in stage.inputs()]
+            todo = inputs, inputs, True
+        if todo is None:
+            return "up to date"
+        inputs, changed, rebuild = todo
+        t0 = time.perf_counter()
+        with timer(f"stage.{stage.name}"):
+            stage.run(changed, rebuild)
+        secs = time.perf_counter() - t0
+        record = {
+            # listed again, a stage may have created some of its inputs
+            "inputs": self.fingerprint(Path(p) for p in stage.inputs()),
+            "params": stage.params,
+            "outputs": self.fingerprint(p for p in stage.outputs() if Path(p).exists()),
+            "seconds": round(secs, 3)
+        }
+        with self.lock:
+            self.state["stages"][stage.name] = record
+        return f"ran in {secs:.2f}s"
+
+    def resolve(self, targets=None):
+        """The stages needed for targets (default all), in pipeline order."""
+        todo = set()
+        stack = list(targets or self.stages)
+        while stack:
+            name = stack.pop()
+            if name not in self.stages:
+                raise ValueError(f"unknown stage '{name}', choose from {list(self.stages)}")
+            if name not in todo:
+                todo.add(name)
+                stack.extend(self.stages[name].deps)
+        return [n for n in self.stages if n in todo]
+
+    def status(self, targets=None, force=()):
+        """What a run would do, without running anything."""
+        out, runs = {}, set()
+        for name in self.resolve(targets):
+            stage = self.stages[name]
+            if stage.optional and not all(Path(p).exists() for p in stage.inputs()):
+                out[name] = "skipped, missing inputs"
+            elif name in force or any(d in runs for d in stage.deps):
+                out[name] = "would run"
+            else:
+                out[name] = "up to date" if self.check(stage) is None else "would run"
+            if out[name] == "would run":
+                runs.add(name)
+        return out
+
+    def run(self, targets=None, force=(), jobs=4):
+        """Run the stages needed for `targets`, each as soon as the stages it
+        depends on are done, with up to `jobs` stages running at a time.
+        Returns {stage: what happened}.
+        """
+        order = self.resolve(targets)
+        results, running = {}, {}
+        if jobs == 1:
+            # one at a time in this thread, so --profile sees every stage
+            for name in order:
+                print(f"[{name}] started")
+                try:
+                    results[name] = self.run_stage(self.stages[name], name in force)
+                except Exception as e:
+                    self.save_state()
+                    raise RuntimeError(f"stage '{name}' failed") from e
+                print(f"[{name}] {results[name]}")
+                self.save_state()
+            return results
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            while len(results) < len(order):
+                for name in order:
+                    stage = self.stages[name]
+                    if name in results or name in running or \
+                            not all(d in results for d in stage.deps):
+                        continue
+                    running[name] = pool.submit(self.run_stage, stage, name in force)
+                    print(f"[{name}] started")
+                finished, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+                for name in [n for n, fut in running.items() if fut in finished]:
+                    fut = running.pop(name)
+                    if fut.exception() is not None:
+                        self.save_state()
+                        for other in running.values():
+                            other.cancel()
+                        raise RuntimeError(f"stage '{name}' failed") from fut.exception()
+                    results[name] = fut.result()
+                    print(f"[{name}] {results[name]}")
+                    self.save_state()
+        return results
+
+
+def make_backend(args):
+    from src.backends import get_backend
+    if args.backend == "openai":
+        return get_backend("openai", api_key=os.environ.get("OPENAI"),
+                           batch_size=args.batch_size, concurrency=args.concurrency)
+    return get_backend(args.backend, idf_fp=args.idf)
+
+
+def build_stages(args):
+    """The stages of the workflow, with paths and settings from the cli args."""
+    from src.emb_store import emb_paths
+    data = Path(args.data_dir)
+    parsed = Path(args.parsed_dir)
+    spend = data / "spend.txt"
+    spend_emb = data / "spend_w_emb.txt"
+    classd = data / "spend_w_emb_classd.csv"
+    knn = data / "spend_w_emb_knn.csv"
+    stats_dir = data / "stats"
+    cube = data / "stats.sqlite"
+    store = Path(args.store)
+    labeled_table = Path(args.labeled_table)
+
+    # the outputs the parse stage wrote, so those of removed PDFs can be
+    # deleted (and nothing else in the parsed directory is)
+    parsed_list = parsed / ".pipeline_outputs.json"
+
+    def pdfs():
+        return sorted(Path(args.statements).rglob("*.pdf"))
+
+    def parsed_fp(pdf):
+        # named like capital_one.py names its outputs, in the PDF's
+        # subdirectory, so same-named statements in two folders both stay
+        rel = pdf.relative_to(args.statements)
+        return parsed / rel.parent / f"{''.join(rel.name.split('.')[:-1])}.txt"
+
+    def parsed_outputs():
+        return [parsed_fp(p) for p in pdfs()]
+
+    def run_capital_one(cli_args):
+        cmd = [sys.executable, str(ROOT / "parse" / "capital_one.py"), *cli_args,
+               "-d", args.delim, "-b", args.parse_backend, "-w", str(args.workers), "-q"]
+        if args.metrics is not None:
+            # capital_one.py runs in its own process, add its metrics to ours
+            from common.metrics import METRICS
+            parse_metrics = Path(args.state).parent / "parse_metrics.json"
+            parse_metrics.parent.mkdir(parents=True, exist_ok=True)
+            subprocess.run(cmd + ["--metrics", str(parse_metrics)], check=True)
+            with open(parse_metrics) as f:
+                METRICS.merge(json.load(f))
+        else:
+            subprocess.run(cmd, check=True)
+
+    def parse(changed, rebuild):
+        expected = {str(fp.relative_to(parsed)) for fp in parsed_outputs()}
+        if parsed_list.exists():
+            with open(parsed_list) as f:
+                for rel in set(json.load(f)) - expected:
+                    (parsed / rel).unlink(missing_ok=True)
+                    print(f"[parse] removed {rel}, its PDF is gone")
+        parsed.mkdir(parents=True, exist_ok=True)
+        with open(parsed_list, "w") as f:
+            json.dump(sorted(expected), f)
+        # only new or changed PDFs (unchanged ones also hit the parse cache),
+        # one capital_one.py run per folder since it names outputs by file name
+        folders = {}
+        for p in pdfs():
+            if rebuild or p in changed or not parsed_fp(p).exists():
+                folders.setdefault(parsed_fp(p).parent, []).append(p)
+        for folder, todo in folders.items():
+            folder.mkdir(parents=True, exist_ok=True)
+            out = parsed_fp(todo[0]) if len(todo) == 1 else folder
+            run_capital_one([*map(str, todo), "-o", str(out)])
+
+    def concat(changed, rebuild):
+        m = load_script("1_concat_data")
+        spend.parent.mkdir(parents=True, exist_ok=True)
+        # oldest statement first: a new one only appends rows to spend.txt,
+        # so the stats stage reads just those (anything else rebuilds the cube)
+        m.concat_files(m.statement_order([fp for fp in parsed_outputs() if fp.exists()]), spend,
+                       sep=args.delim, threads=4)
+
+    def embed(changed, rebuild):
+        from src.backends import HashingBackend
+        from src.embed_cache import EmbeddingCache
+        from src.stream import iter_table
+        m = load_script("2_embed_data")
+        backend = make_backend(args)
+        if isinstance(backend, HashingBackend) and backend.idf is None:
+            texts = (t for c in iter_table(spend, sep=args.delim, usecols=["descr"], dtype=str)
+                     for t in c["descr"].fillna(""))
+            backend.fit_idf(texts, save_fp=args.idf)
+        cache = EmbeddingCache(args.cache) if backend.cacheable else None
+        # the last run's embeddings can be reused unless the backend changed
+        n, n_new = m.embed_file(spend, spend_emb, backend, cache, sep=args.delim,
+                                reuse_fp=None if rebuild else spend_emb)
+        print(f"[embed] {n} rows, {n_new} embedded")
+        if cache is not None:
+            cache.close()
+
+    def labeled(changed, rebuild):
+        # labels edited in the labeled table go to the store first, so the
+        # export doesn't overwrite them
+        from src.embed_cache import EmbeddingCache
+        from src.txn_store import TransactionStore
+        m = load_script("2_embed_data")
+        st = TransactionStore(store, sep=args.delim)
+        if labeled_table.exists():
+            print(f"[labeled] {st.import_labels(labeled_table, sep=args.delim)} label(s) edited")
+        st.export(labeled_table, sep=args.delim)
+        backend = make_backend(args)
+        cache = EmbeddingCache(args.cache) if backend.cacheable else None
+        n, n_new = m.embed_file(labeled_table, args.labeled, backend, cache, sep=args.delim,
+                                reuse_fp=None if rebuild else args.labeled)
+        print(f"[labeled] {n} rows, {n_new} embedded")
+        if cache is not None:
+            cache.close()
+
+    def labeled_inputs():
+        # the store's index and label log, and the table labels are edited in
+        return [store / "index.json",
+                *(p for p in (store / "labels.txt", labeled_table) if p.exists())]
+
+    def classify(changed, rebuild):
+        from src.classify import load_labels, embed_label_dict
+        from src.embed_cache import EmbeddingCache
+        from src.fastpath import FastClassifier
+        m = load_script("4_zeroshot_classify")
+        backend = make_backend(args)
+        cache = EmbeddingCache(args.cache) if backend.cacheable else None
+        lab_embs = embed_label_dict(load_labels(args.labels), backend, cache=cache)
+        fast = None
+        if fast_inputs():
+            labeled, rules = (p if p.exists() else None
+                              for p in (Path(args.labeled), Path(args.rules)))
+            fast = FastClassifier.from_files(labeled, rules, sep=args.delim)
+        m.classify_file(spend_emb, classd, lab_embs, sep=args.delim, top_k=args.top_k, fast=fast)
+        if fast is not None:
+            print(f"[classify] fast path labeled {fast.hits} of {fast.rows} rows ({fast.hit_rate:.1%})")
+        if cache is not None:
+            cache.close()
+
+    def fast_inputs():
+        # hand labels and rules for the classify stage's fast path, if there are any
+        return [p for p in (Path(args.labeled), Path(args.rules)) if p.exists()]
+
+    def knn_classify(changed, rebuild):
+        m = load_script("4_knn_classify")
+        index, _ = m.update_index(args.knn_index, args.labeled, delim=args.delim, rebuild=rebuild)
+        m.knn_file(index, spend_emb, knn, k=args.k, n_probe=args.n_probe, delim=args.delim)
+
+    def stats(changed, rebuild):
+        from src.stats import StatsCube, GRAINS, export
+        stats_dir.mkdir(parents=True, exist_ok=True)
+        with StatsCube(cube) as c:
+            # only the rows appended to the labeled data since the last run are read
+            c.update(classd, sep=args.delim)
+            for grain in GRAINS:
+                export(c.query(grain), stats_dir / f"{grain}_label.csv")
+                export(c.query(grain, by_label=False), stats_dir / f"{grain}.csv")
+
+    embed_params = {"backend": args.backend, "idf": args.idf if args.backend == "hashing" else None}
+    return [
+        Stage("parse", pdfs, parsed_outputs, parse,
+              params={"delim": args.delim, "backend": args.parse_backend}),
+        Stage("concat", lambda: [fp for fp in parsed_outputs() if fp.exists()], lambda: [spend], concat,
+              params={"delim": args.delim}, deps=["parse"]),
+        Stage("embed", lambda: [spend], lambda: emb_paths(spend_emb), embed,
+              params=embed_params, deps=["concat"]),
+        Stage("labeled", labeled_inputs, lambda: [labeled_table, *emb_paths(Path(args.labeled))],
+              labeled, params=embed_params, deps=["embed"], optional=True),
+        Stage("classify", lambda: [*emb_paths(spend_emb), Path(args.labels), *fast_inputs()],
+              lambda: [classd],
+              classify, params={**embed_params, "top_k": args.top_k}, deps=["embed", "labeled"]),
+        Stage("knn", lambda: [*emb_paths(spend_emb), *emb_paths(Path(args.labeled))],
+              lambda: [knn, Path(args.knn_index)], knn_classify,
+              params={"k": args.k, "n_probe": args.n_probe}, deps=["embed", "labeled"], optional=True),
+        Stage("stats", lambda: [classd],
+              lambda: [cube, *(stats_dir / f"{g}{s}.csv" for g in ("year", "month", "week")
+                               for s in ("", "_label"))],
+              stats, deps=["classify"])
+    ]
+
+
+parser = argparse.ArgumentParser(
+    prog="pipeline.py",
+    description="Run the statement PDFs -> labeled transactions -> stats workflow, only redoing what changed since the last run.",
+    epilog="Stages: parse, concat, embed, labeled (if --store exists), classify, knn (if --labeled exists), stats. "
+           "Paths given are relative to the current directory; the default paths are in the repository."
+)
+parser.add_argument("targets",
+                    nargs="*",
+                    help="Stage(s) to bring up to date, with the stages they depend on. Defaults to all."
+                    )
+parser.add_argument("-s", "--statements",
+                    default=str(ROOT / "statements"),
+                    help="Directory of statement PDFs (searched recursively). Defaults to statements/ in the repository."
+                    )
+parser.add_argument("--parsed-dir",
+                    default=str(ROOT / "parse/outputs"),
+                    help="Where parsed statements are saved. Defaults to parse/outputs/ in the repository."
+                    )
+parser.add_argument("--data-dir",
+                    default=str(ROOT / "analysis/data"),
+                    help="Where the combined, embedded and labeled data is saved. Defaults to analysis/data/ in the repository."
+                    )
+parser.add_argument("-d", "--delim",
+                    default="|",
+                    help="Delimiter of the text files. Defaults to the pipe `|`."
+                    )
+parser.add_argument("--parse-backend",
+                    default="tabula",
+                    choices=["tabula", "text"], # parse/src/extract.py BACKENDS
+                    help="How capital_one.py reads the PDFs. 'text' is pure Python (pdfminer.six) and needs no Java. Defaults to 'tabula'."
+                    )
+parser.add_argument("-b", "--backend",
+                    default="hashing",
+                    choices=["openai", "hashing"],
+                    help="Embedding backend. Defaults to 'hashing' (local, no API key needed)."
+                    )
+parser.add_argument("--idf",
+                    default=str(ROOT / "analysis/data/hashing_idf.npy"),
+                    help="IDF weights for the hashing backend, fitted on the data the first time."
+                    )
+parser.add_argument("--cache",
+                    default=str(ROOT / "analysis/data/embeddings.sqlite"),
+                    help="Embedding cache (for the openai backend)."
+                    )
+parser.add_argument("--labels",
+                    default=str(ROOT / "analysis/data/labels/labels_nl_descr_simple.json"),
+                    help="Labels json ({label: [keywords]}) for zero-shot classification."
+                    )
+parser.add_argument("--store",
+                    default=str(ROOT / "analysis/data/hand_labeled_store"),
+                    help="Hand labeled transaction store from analysis/extra/append_hand_labeled.py. If it exists, the labeled stage saves the labels edited in --labeled-table to it, exports it there and embeds it to --labeled."
+                    )
+parser.add_argument("--labeled-table",
+                    default=str(ROOT / "analysis/data/hand_labeled_spend.txt"),
+                    help="Where the labeled stage exports the store to, for labeling by hand."
+                    )
+parser.add_argument("--labeled",
+                    default=str(ROOT / "analysis/data/hand_labeled_spend_w_emb.txt"),
+                    help="Hand labeled transactions with embeddings, for the knn stage (and the classify stage's exact matches)."
+                    )
+parser.add_argument("--rules",
+                    default=str(ROOT / "analysis/data/labels/rules.json"),
+                    help="Rules json ({label: [description prefixes]}) labeling matching transactions, with the hand labeled ones, before the classify stage's embedding similarity."
+                    )
+parser.add_argument("--knn-index",
+                    default=str(ROOT / "analysis/data/knn_index.npz"),
+                    help="Where the nearest neighbor index is kept."
+                    )
+parser.add_argument("--top-k", type=int, default=3,
+                    help="Labels kept per transaction by the classify stage.")
+parser.add_argument("-k", type=int, default=10,
+                    help="Neighbors voting on each label in the knn stage.")
+parser.add_argument("--n-probe", type=int, default=16,
+                    help="Index lists scanned per query in the knn stage.")
+parser.add_argument("--batch-size", type=int, default=256,
+                    help="Texts per embedding request (openai backend).")
+parser.add_argument("--concurrency", type=int, default=8,
+                    help="Embedding requests in flight (openai backend).")
+parser.add_argument("-w", "--workers", type=int, default=1,
+                    help="Worker processes for parsing PDFs.")
+parser.add_argument("-j", "--jobs", type=int, default=4,
+                    help="Stages that can run at the same time. Defaults to 4.")
+parser.add_argument("--state",
+                    default=str(ROOT / ".pipeline/state.json"),
+                    help="Where the fingerprints of the last run are kept. Defaults to .pipeline/state.json in the repository."
+                    )
+parser.add_argument("-f", "--force",
+                    action="append",
+                    default=[],
+                    metavar="STAGE",
+                    help="Rerun STAGE from scratch even if it is up to date (can be repeated)."
+                    )
+parser.add_argument("-n", "--dry-run",
+                    action="store_true",
+                    help="Only print which stages would run.")
+parser.add_argument("--metrics",
+                    default=None,
+                    metavar="FILE",
+                    help="Save per stage timings, counters (rows, pages, API calls, cache hits) and peak memory as JSON to FILE."
+                    )
+parser.add_argument("--profile",
+                    default=None,
+                    metavar="FILE",
+                    help="Profile the run with cProfile and dump the stats to FILE. Only the main thread is profiled, which runs the stages with -j 1 (with more jobs they run in worker threads and aren't profiled)."
+                    )
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if str(ANALYSIS) not in sys.path:
+        sys.path.insert(0, str(ANALYSIS))
+    from common.metrics import enable
+    enable(metrics_fp=args.metrics, profile_fp=args.profile)
+    pipeline = Pipeline(build_stages(args), state_fp=args.state)
+
+    if args.dry_run:
+        for name, status in pipeline.status(args.targets, force=args.force).items():
+            print(f"{name}: {status}")
+        raise SystemExit(0)
+
+    start = time.perf_counter()
+    results = pipeline.run(args.targets, force=args.force, jobs=args.jobs)
+    ran = [n for n, r in results.items() if r.startswith("ran")]
+    print(f"Pipeline done in {time.perf_counter() - start:.2f}s, "
+          f"{len(ran)} of {len(results)} stage(s) ran")